@@ -12,8 +12,9 @@ echo ""
 
 # ===== 配置区域 - 请根据实际情况修改 =====
 PROJECT_DIR="/data/crm"  # 项目目录（生产环境实际路径）
-BACKUP_DIR="/var/backups/monsterabc_crm"  # 备份目录
+BACKUP_DIR="${CRM_BACKUP_DIR:-$PROJECT_DIR/backups}"  # 备份目录（与服务的 CRM_BACKUP_DIR 一致，默认项目下的 backups/）
 SERVICE_NAME="monsterabc_crm"  # Supervisor服务名
+PYTHON="${PYTHON:-python3}"  # 项目虚拟环境中的 python（如 venv/bin/python）
 # =========================================
 
 TIMESTAMP=$(date +%Y%m%d_%H%M%S)
@@ -33,11 +34,13 @@ echo ""
 # 1. 备份数据库
 echo "📦 [1/6] 备份数据库..."
 mkdir -p $BACKUP_DIR
-if [ -f "db.sqlite3" ]; then
-    cp db.sqlite3 $BACKUP_DIR/db_backup_$TIMESTAMP.sqlite3
-    echo "✅ 数据库已备份: $BACKUP_DIR/db_backup_$TIMESTAMP.sqlite3"
+# 在线备份（SQLite 备份接口 / pg_dump），服务运行中也能得到一致的快照；
+# 直接 cp db.sqlite3 在有写入时可能复制到损坏的文件，也会漏掉 WAL 中的修改
+if DB_BACKUP=$($PYTHON manage.py backup_database --output-dir $BACKUP_DIR --retention-days 0); then
+    echo "✅ $DB_BACKUP"
 else
-    echo "⚠️  警告: 未找到 db.sqlite3 文件"
+    echo "❌ 错误: 数据库备份失败，已停止部署"
+    exit 1
 fi
 echo ""
 
@@ -146,7 +149,7 @@ echo "========================================="
 echo ""
 echo "📊 部署摘要:"
 echo "  - 备份位置: $BACKUP_DIR/"
-echo "  - 数据库备份: db_backup_$TIMESTAMP.sqlite3"
+echo "  - 数据库备份: $DB_BACKUP"
 echo "  - 代码备份: sales/forms.py.backup.$TIMESTAMP"
 echo ""
 echo "🧪 下一步操作:"
@@ -160,6 +163,7 @@ echo "  tail -f /var/log/monsterabc_crm/gunicorn_error.log"
 echo ""
 echo "🔙 如需回滚:"
 echo "  cp sales/forms.py.backup.$TIMESTAMP sales/forms.py"
+echo "  # 数据库需要回滚时（先停止服务）: $PYTHON manage.py restore_database <备份文件>"
 echo "  sudo supervisorctl restart $SERVICE_NAME"
 echo ""
 echo "========================================="
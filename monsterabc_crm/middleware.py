@@ -0,0 +1,322 @@
+"""
+项目级中间件
+
+- QueryStatsMiddleware: 按URL名称记录每个请求的SQL查询次数、数据库耗时、重复查询次数和响应时间,
+  DEBUG模式下通过响应头输出, 并在进程内汇总, 供管理员接口查看。
+- ReplicaRoutingMiddleware: 只读页面的查询发往只读副本, 用户写入后短时间内粘滞在主库。
+
+两个中间件同时支持同步和异步请求: 以 ASGI 方式运行时整条中间件链保持异步,
+异步视图不会被切换到线程中执行。
+
+流式响应(CSV导出、变更流、备份下载)的查询发生在视图返回之后、正文发送期间,
+两个中间件都会包装 streaming_content, 让查询统计和副本路由持续到正文发送完毕。
+"""
+
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .routers import read_from_replica, replica_alias, start_replica_reads, stop_replica_reads, track_primary_writes
+
+
+# 进程内汇总数据: {url_name: {...}}
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class QueryCollector:
+    """数据库执行包装器, 收集单个请求内的所有查询"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        """完全相同(SQL和参数一致)的重复查询次数"""
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+
+def record_request(url_name, collector, response_time):
+    """把单个请求的统计累加到进程内汇总数据"""
+    with _stats_lock:
+        entry = _stats.setdefault(url_name, {
+            'requests': 0,
+            'queries': 0,
+            'max_queries': 0,
+            'duplicates': 0,
+            'db_time': 0.0,
+            'response_time': 0.0,
+            'max_response_time': 0.0,
+        })
+        entry['requests'] += 1
+        entry['queries'] += collector.count
+        entry['max_queries'] = max(entry['max_queries'], collector.count)
+        entry['duplicates'] += collector.duplicates
+        entry['db_time'] += collector.duration
+        entry['response_time'] += response_time
+        entry['max_response_time'] = max(entry['max_response_time'], response_time)
+
+
+def get_query_stats():
+    """返回按平均查询次数倒序排列的汇总统计(时间单位: 毫秒)"""
+    with _stats_lock:
+        snapshot = {name: dict(entry) for name, entry in _stats.items()}
+
+    rows = []
+    for url_name, entry in snapshot.items():
+        requests = entry['requests']
+        rows.append({
+            'url_name': url_name,
+            'requests': requests,
+            'avg_queries': round(entry['queries'] / requests, 2),
+            'max_queries': entry['max_queries'],
+            'avg_duplicates': round(entry['duplicates'] / requests, 2),
+            'avg_db_time_ms': round(entry['db_time'] * 1000 / requests, 2),
+            'avg_response_time_ms': round(entry['response_time'] * 1000 / requests, 2),
+            'max_response_time_ms': round(entry['max_response_time'] * 1000, 2),
+        })
+    rows.sort(key=lambda row: row['avg_queries'], reverse=True)
+    return rows
+
+
+def reset_query_stats():
+    """清空汇总统计"""
+    with _stats_lock:
+        _stats.clear()
+
+
+class QueryStatsMiddleware:
+    """统计每个请求的数据库查询情况"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        collector = QueryCollector()
+        started = time.perf_counter()
+
+        # 所有数据库连接都挂上包装器(连接按线程隔离, 并发请求互不影响)
+        with ExitStack() as stack:
+            install_collector(stack, collector)
+            response = self.get_response(request)
+
+        return self.process_response(request, response, collector, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        collector = QueryCollector()
+        started = time.perf_counter()
+
+        # 异步请求的查询在该请求专用的同步线程中执行, 包装器也要挂在那个线程的连接上
+        stack = ExitStack()
+        await sync_to_async(install_collector)(stack, collector)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+
+        return self.process_response(request, response, collector, time.perf_counter() - started)
+
+    def process_response(self, request, response, collector, response_time):
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.view_name if match and match.view_name else '<unresolved>'
+
+        if response.streaming:
+            # 正文发送完(或连接关闭)时才记录; 响应头此时已发出, 不输出统计头
+            started = time.perf_counter() - response_time
+            collect_streaming(response, collector, lambda: record_request(
+                url_name, collector, time.perf_counter() - started,
+            ))
+            return response
+
+        record_request(url_name, collector, response_time)
+
+        if settings.DEBUG:
+            response['X-DB-Query-Count'] = str(collector.count)
+            response['X-DB-Time-Ms'] = f'{collector.duration * 1000:.2f}'
+            response['X-DB-Duplicate-Queries'] = str(collector.duplicates)
+            response['X-Response-Time-Ms'] = f'{response_time * 1000:.2f}'
+
+        return response
+
+
+def install_collector(stack, collector):
+    """给当前线程的所有数据库连接挂上查询收集器, stack 关闭时卸下"""
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(collector))
+
+
+def collect_streaming(response, collector, finish):
+    """
+    发送流式响应正文期间继续收集查询, 正文发送完或响应关闭时调用一次 finish
+
+    同步迭代器在 WSGI 线程(或 ASGI 下该请求专用的同步线程)中迭代,
+    异步迭代器中的查询经 sync_to_async 在该请求专用的线程中执行, 收集器都挂在那个线程上。
+    """
+    finished = False
+
+    def finish_once():
+        nonlocal finished
+        if not finished:
+            finished = True
+            finish()
+
+    if response.is_async:
+        async def content(stream):
+            stack = ExitStack()
+            await sync_to_async(install_collector)(stack, collector)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await sync_to_async(stack.close)()
+                finish_once()
+    else:
+        def content(stream):
+            try:
+                with ExitStack() as stack:
+                    install_collector(stack, collector)
+                    yield from stream
+            finally:
+                finish_once()
+
+    response.streaming_content = content(response.streaming_content)
+    # 正文没有被迭代就关闭(如客户端提前断开)时也要记录
+    response._resource_closers.append(finish_once)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    只读请求走副本
+
+    GET/HEAD 请求且URL名称在 settings.READ_REPLICA_VIEWS 中时读副本；
+    用户有写入(非安全方法或写过业务数据)后, 通过cookie在
+    READ_REPLICA_STICKY_SECONDS 秒内固定读主库, 保证能看到自己的修改。
+    """
+
+    COOKIE_NAME = 'crm_primary_until'
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        request.read_from_replica = False
+        with track_primary_writes() as writes:
+            try:
+                response = self.get_response(request)
+            finally:
+                token = getattr(request, '_replica_token', None)
+                if token is not None:
+                    stop_replica_reads(token)
+
+        return self.process_response(request, response, writes)
+
+    async def __acall__(self, request):
+        request.read_from_replica = False
+        # 异步模式下 process_view 在线程中执行, 设置的副本标记会被带回当前上下文,
+        # 它的 token 不能在这里重置, 改为在请求开始时记下当前状态并在结束时恢复
+        token = start_replica_reads(False)
+        with track_primary_writes() as writes:
+            try:
+                response = await self.get_response(request)
+            finally:
+                stop_replica_reads(token)
+
+        return self.process_response(request, response, writes)
+
+    def process_response(self, request, response, writes):
+        if response.streaming and request.read_from_replica:
+            response.streaming_content = replica_streaming_content(response)
+
+        if writes or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            sticky_seconds = getattr(settings, 'READ_REPLICA_STICKY_SECONDS', 10)
+            response.set_cookie(
+                self.COOKIE_NAME,
+                str(int(time.time()) + sticky_seconds),
+                max_age=sticky_seconds,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # 视图(包括模板渲染)执行期间读副本, 在 __call__ 中恢复; 流式响应的正文见 replica_streaming_content
+        if self.should_use_replica(request):
+            request.read_from_replica = True
+            request._replica_token = start_replica_reads()
+        return None
+
+    def should_use_replica(self, request):
+        if not replica_alias() or request.method not in ('GET', 'HEAD'):
+            return False
+        match = request.resolver_match
+        if not match or match.view_name not in getattr(settings, 'READ_REPLICA_VIEWS', ()):
+            return False
+        try:
+            pinned_until = int(request.COOKIES.get(self.COOKIE_NAME, 0))
+        except ValueError:
+            pinned_until = 0
+        return pinned_until <= time.time()
+
+
+def replica_streaming_content(response):
+    """
+    读副本的视图返回流式响应时, 生成每一块正文期间同样读副本
+
+    副本标记只在取下一块时设置, 块与块之间(正文发送期间)恢复原状,
+    不会影响同一线程或同一上下文中的其他代码。
+    """
+    if response.is_async:
+        async def content(iterator):
+            while True:
+                with read_from_replica():
+                    try:
+                        chunk = await anext(iterator)
+                    except StopAsyncIteration:
+                        return
+                yield chunk
+
+        return content(aiter(response.streaming_content))
+
+    def content(iterator):
+        while True:
+            with read_from_replica():
+                chunk = next(iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    return content(iter(response.streaming_content))
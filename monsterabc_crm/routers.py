@@ -0,0 +1,83 @@
+"""
+读写分离数据库路由
+
+配置了只读副本（settings.READ_REPLICA_DATABASE）时，列表页、导出等只读请求
+以及显式使用 read_from_replica() 的报表任务，把 sales 应用的查询发到副本；
+写入、事务内的读取以及用户刚写入后的一小段时间内（粘滞窗口）仍然读主库，
+保证用户能立即看到自己的修改。
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# 只有业务数据走副本；会话、用户、验证码等读主库，避免登录后副本延迟导致掉线
+REPLICA_APPS = {'sales'}
+
+_read_from_replica = ContextVar('read_from_replica', default=False)
+_primary_writes = ContextVar('primary_writes', default=None)
+
+
+def replica_alias():
+    """返回只读副本的数据库别名，未配置时返回 None"""
+    return getattr(settings, 'READ_REPLICA_DATABASE', None)
+
+
+def start_replica_reads(enabled=True):
+    """开始把只读查询发到副本，返回用于恢复的 token"""
+    return _read_from_replica.set(enabled)
+
+
+def stop_replica_reads(token):
+    _read_from_replica.reset(token)
+
+
+@contextmanager
+def read_from_replica(enabled=True):
+    """在代码块内把只读查询发到副本（用于报表、导出等任务）"""
+    token = start_replica_reads(enabled)
+    try:
+        yield
+    finally:
+        stop_replica_reads(token)
+
+
+@contextmanager
+def track_primary_writes():
+    """记录代码块内是否写入过业务数据，返回可检查的列表"""
+    writes = []
+    token = _primary_writes.set(writes)
+    try:
+        yield writes
+    finally:
+        _primary_writes.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """主库写、副本读的路由"""
+
+    def db_for_read(self, model, **hints):
+        replica = replica_alias()
+        if (replica
+                and _read_from_replica.get()
+                and model._meta.app_label in REPLICA_APPS
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        writes = _primary_writes.get()
+        if writes is not None and model._meta.app_label in REPLICA_APPS:
+            writes.append(model._meta.label)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 副本与主库是同一份数据
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 副本的表结构由主库复制过来
+        return db == DEFAULT_DB_ALIAS
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 放在最前面，统计包含会话、认证在内的全部查询
+    "monsterabc_crm.middleware.QueryStatsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -50,6 +53,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "monsterabc_crm.middleware.ReplicaRoutingMiddleware",
 ]
 
 ROOT_URLCONF = "monsterabc_crm.urls"
@@ -75,13 +79,133 @@ WSGI_APPLICATION = "monsterabc_crm.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# 通过环境变量选择数据库，未配置时使用SQLite（开发环境默认）
+#   CRM_DB_ENGINE=postgresql  CRM_DB_NAME / CRM_DB_USER / CRM_DB_PASSWORD / CRM_DB_HOST / CRM_DB_PORT
+#   CRM_DB_CONN_MAX_AGE  持久连接保持秒数（默认600，0表示每个请求新建连接；ASGI 部署默认0）
+
+CRM_DB_ENGINE = os.environ.get("CRM_DB_ENGINE", "sqlite")
+
+# 部署方式: wsgi（gunicorn 同步 worker）或 asgi（gunicorn + uvicorn worker），见 start.sh
+# ASGI 下每个请求的数据库操作在该请求专用的线程中执行，持久连接无法被后续请求复用，
+# 只会在线程结束后才被回收，因此默认不保持连接
+CRM_SERVER = os.environ.get("CRM_SERVER", "wsgi")
+
+if CRM_DB_ENGINE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("CRM_DB_NAME", "monsterabc_crm"),
+            "USER": os.environ.get("CRM_DB_USER", "postgres"),
+            "PASSWORD": os.environ.get("CRM_DB_PASSWORD", ""),
+            "HOST": os.environ.get("CRM_DB_HOST", "127.0.0.1"),
+            "PORT": os.environ.get("CRM_DB_PORT", "5432"),
+            "CONN_MAX_AGE": int(os.environ.get("CRM_DB_CONN_MAX_AGE", "0" if CRM_SERVER == "asgi" else "600")),
+            # 复用持久连接前先检查是否可用，避免数据库重启后报错
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            # 事务以 BEGIN IMMEDIATE 开始，见 monsterabc_crm/sqlite_backend/base.py
+            "ENGINE": "monsterabc_crm.sqlite_backend",
+            "NAME": os.environ.get("CRM_DB_NAME", BASE_DIR / "db.sqlite3"),
+        }
+    }
+
+# 只读副本（可选）：设置 CRM_DB_REPLICA_NAME 后启用读写分离（见 monsterabc_crm/routers.py）
+#   PostgreSQL: CRM_DB_REPLICA_NAME / CRM_DB_REPLICA_HOST / CRM_DB_REPLICA_PORT，其余连接参数与主库相同
+#   SQLite: CRM_DB_REPLICA_NAME 为副本文件路径（本地测试可用主库文件的拷贝）
+if os.environ.get("CRM_DB_REPLICA_NAME"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": os.environ["CRM_DB_REPLICA_NAME"],
+        "HOST": os.environ.get("CRM_DB_REPLICA_HOST", DATABASES["default"].get("HOST", "")),
+        "PORT": os.environ.get("CRM_DB_REPLICA_PORT", DATABASES["default"].get("PORT", "")),
+        # 测试时副本指向测试主库
+        "TEST": {"MIRROR": "default"},
+    }
+    READ_REPLICA_DATABASE = "replica"
+else:
+    READ_REPLICA_DATABASE = None
+
+DATABASE_ROUTERS = ["monsterabc_crm.routers.PrimaryReplicaRouter"]
+
+# 读副本的页面（仅GET/HEAD）
+READ_REPLICA_VIEWS = [
+    "dashboard",
+    "my_customers",
+    "high_seas",
+    "visited",
+    "signed",
+    "key_customers",
+    "pending_reminders_api",
+    "export_customers_api",
+    "backup_data_api",
+    "admin:sales_customer_changelist",
+    "admin:sales_highseascustomer_changelist",
+]
+
+# 用户写入后多少秒内固定读主库，应大于副本的复制延迟
+READ_REPLICA_STICKY_SECONDS = int(os.environ.get("CRM_DB_REPLICA_STICKY_SECONDS", "10"))
+
+# SQLite连接初始化（见 monsterabc_crm/sqlite.py），每个新连接都会执行
+# WAL: 写入时不阻塞读取；busy_timeout: 等待写锁的毫秒数；
+# synchronous=NORMAL: WAL模式下安全且减少fsync；mmap_size/cache_size: 读缓存（cache_size为负数表示KB）
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "busy_timeout": int(os.environ.get("CRM_SQLITE_BUSY_TIMEOUT", "10000")),
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64000,
+}
+
+
+# 缓存：基于文件，多个 gunicorn 进程共享，无需 Redis 等外部服务
+#   CRM_CACHE_DIR  缓存目录（默认项目下的 cache/）
+# 缓存文件读取时会被反序列化（pickle），会话也存在缓存中：目录只能由运行服务的用户写入，
+# 不能放在 /tmp 等所有用户可写的公共目录下（其他用户抢先创建目录即可写入恶意缓存文件）
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("CRM_CACHE_DIR", str(BASE_DIR / "cache")),
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
     }
 }
 
+# 列表页查询结果缓存秒数（见 sales/caching.py，客户数据变化时立即失效）
+LIST_PAGE_CACHE_TIMEOUT = int(os.environ.get("CRM_LIST_PAGE_CACHE_TIMEOUT", "300"))
+
+# 后台客户列表（见 sales/admin.py）：筛选栏取值列表的缓存秒数；
+# PostgreSQL 估计行数超过该值时分页直接使用估计值，不执行 COUNT(*)
+ADMIN_FACET_CACHE_TIMEOUT = int(os.environ.get("CRM_ADMIN_FACET_CACHE_TIMEOUT", "600"))
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.environ.get("CRM_ADMIN_ESTIMATED_COUNT_THRESHOLD", "10000"))
+
+# 客户变更订阅（见 sales/changefeed.py）只返回该秒数之前的变更，
+# 留出时间让进行中的写事务提交，避免下游的同步游标越过尚未提交的修改
+CHANGE_FEED_LAG_SECONDS = int(os.environ.get("CRM_CHANGE_FEED_LAG_SECONDS", "300"))
+
+# 数据库在线备份（见 sales/backup.py）：备份目录和保留天数（0 表示不清理）；
+# SQLite 非 WAL 模式下每步复制的页数；PostgreSQL 的 pg_dump / pg_restore 所在目录（默认从 PATH 查找）
+# 备份含客户信息和密码哈希：默认放在项目下的 backups/（运行服务的用户可写，已在 .gitignore 中排除），
+# 生产环境建议用 CRM_BACKUP_DIR 指向代码目录之外、运行服务的用户有写权限的目录
+BACKUP_DIR = os.environ.get("CRM_BACKUP_DIR", str(BASE_DIR / "backups"))
+BACKUP_RETENTION_DAYS = int(os.environ.get("CRM_BACKUP_RETENTION_DAYS", "30"))
+BACKUP_PAGES_PER_STEP = int(os.environ.get("CRM_BACKUP_PAGES_PER_STEP", "1000"))
+PG_BIN_DIR = os.environ.get("CRM_PG_BIN_DIR", "")
+
+# 后台任务运行统计（见 sales/jobstats.py）：每个任务保留的最近运行记录数；
+# 任务启动比计划时间晚超过该秒数时记警告日志
+SCHEDULER_STATS_HISTORY = int(os.environ.get("CRM_SCHEDULER_STATS_HISTORY", "100"))
+SCHEDULER_LAG_ALERT_SECONDS = float(os.environ.get("CRM_SCHEDULER_LAG_ALERT_SECONDS", "30"))
+
+# 会话：cached_db 优先读缓存，只在会话内容变化时写数据库（未修改的请求不再写 django_session）
+# 过期会话和验证码由后台任务定期清理（见 sales/tasks.py cleanup_expired_sessions）
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+SESSION_SAVE_EVERY_REQUEST = False
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -0,0 +1,56 @@
+"""
+生产环境配置
+
+使用方式: export DJANGO_SETTINGS_MODULE=monsterabc_crm.settings_production
+密钥（CRM_SECRET_KEY）和允许的主机（CRM_ALLOWED_HOSTS）必须通过环境变量设置，未设置时拒绝启动；
+数据库配置见 settings.py。
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+
+# 生产环境关闭调试：不再在内存中记录每条SQL，出错时不显示调试页面
+DEBUG = False
+
+# 密钥必须单独设置，不能退回 settings.py 中公开的开发密钥
+SECRET_KEY = os.environ.get("CRM_SECRET_KEY", "")
+if not SECRET_KEY:
+    raise ImproperlyConfigured("生产环境必须设置环境变量 CRM_SECRET_KEY")
+
+# 允许的主机（逗号分隔，如 crm.example.com,10.0.0.5），必须设置，没有默认值
+ALLOWED_HOSTS = [host.strip() for host in os.environ.get("CRM_ALLOWED_HOSTS", "").split(",") if host.strip()]
+if not ALLOWED_HOSTS:
+    raise ImproperlyConfigured("生产环境必须设置环境变量 CRM_ALLOWED_HOSTS（逗号分隔的域名或IP）")
+
+# 模板：显式使用缓存加载器，模板只编译一次（设置 loaders 时必须关闭 APP_DIRS）
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        "APP_DIRS": False,
+        "OPTIONS": {
+            **TEMPLATES[0]["OPTIONS"],
+            "debug": False,
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                ),
+            ],
+        },
+    },
+]
+
+# HTTPS相关（使用SSL时设置 CRM_HTTPS=1）
+if os.environ.get("CRM_HTTPS") == "1":
+    SECURE_SSL_REDIRECT = True
+    SESSION_COOKIE_SECURE = True
+    CSRF_COOKIE_SECURE = True
+SECURE_CONTENT_TYPE_NOSNIFF = True
+
+# 静态文件配置
+STATIC_URL = "/static/"
+STATIC_ROOT = BASE_DIR / "staticfiles"
@@ -0,0 +1,66 @@
+"""
+SQLite 单机部署调优
+
+- 每个新连接执行 settings.SQLITE_PRAGMAS 中的 PRAGMA（WAL、busy_timeout 等），
+  WAL 模式下导入、回收等大批量写入不再阻塞其他请求的读取。
+- retry_on_locked: 批量写入遇到 "database is locked" 时退避重试。
+"""
+
+import logging
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection as default_connection
+
+
+logger = logging.getLogger(__name__)
+
+
+def apply_pragmas(cursor, pragmas):
+    """在DB-API游标上执行PRAGMA设置"""
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """connection_created 信号处理：初始化SQLite连接"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if pragmas:
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor, pragmas)
+
+
+def is_locked_error(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def retry_on_locked(func=None, *, attempts=5, delay=0.1):
+    """
+    SQLite 写锁冲突时重试的装饰器
+
+    busy_timeout 只能处理普通的锁等待，读事务升级为写事务时 SQLite 会直接返回
+    "database is locked"，需要整体重试。在外层事务内无法安全重试，此时直接抛出。
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(1, attempts + 1):
+                try:
+                    return func(*args, **kwargs)
+                except OperationalError as e:
+                    if (not is_locked_error(e) or attempt == attempts
+                            or default_connection.in_atomic_block):
+                        raise
+                    wait = delay * (2 ** (attempt - 1)) * (1 + random.random())
+                    logger.warning(f"[SQLite] {func.__name__} 数据库被锁定, {wait:.2f}秒后第{attempt}次重试")
+                    time.sleep(wait)
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
@@ -0,0 +1,17 @@
+"""
+SQLite 数据库后端：事务以 BEGIN IMMEDIATE 开始
+
+Django 4.2 的 SQLite 后端用 BEGIN（DEFERRED）开始事务，事务中先读后写
+（如 CustomerQuerySet.update 先读出旧值再修改）时，如果其他进程在两者之间提交了写入，
+SQLite 不等待 busy_timeout，直接返回 "database is locked"；多个 worker 同时导入、
+批量修改时 retry_on_locked 的重试也可能全部落空。
+BEGIN IMMEDIATE 在事务开始时就取得写锁，拿不到时按 busy_timeout 等待。
+（Django 5.1 起可以改用 OPTIONS 中的 "transaction_mode": "IMMEDIATE"）
+"""
+
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE")
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "monsterabc_crm.settings")
 
 application = get_wsgi_application()
+
+# 后台任务调度器只在 Web 进程中启动（manage.py 命令和测试不启动）
+from sales.tasks import start_scheduler_once  # noqa: E402
+
+start_scheduler_once()
@@ -1,13 +1,33 @@
+import json
+import re
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.models import ADDITION, CHANGE, DELETION, LogEntry
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from import_export import resources, fields
 from import_export.admin import ImportExportModelAdmin
+from import_export.results import RowResult
 from datetime import datetime
-from .models import Customer, CustomField
+from .models import Customer, CustomerEvent, CustomField
+from .caching import user_scope
+from .geo import fill_locations
+from .phones import MOBILE_LENGTH, archived_phone_keys, existing_customers, normalize_phone, normalize_phones
 
 
 class CustomerResource(resources.ModelResource):
-    """客户资源类 - 处理Excel导入导出"""
+    """
+    客户资源类 - 处理Excel导入导出
+    
+    导入使用批量模式：不生成逐行差异，已存在的客户在导入前按规范化电话一次查出，
+    新客户和要更新的客户分别攒够 batch_size 条后用 bulk_create / bulk_update 写入，
+    不再逐条调用 Customer.save()。
+    """
     
     # 中文表头映射
     name = fields.Field(attribute='name', column_name='姓名')
@@ -21,6 +41,69 @@ class CustomerResource(resources.ModelResource):
         model = Customer
         fields = ('name', 'phone', 'created_at', 'source', 'city_auto', 'region_manual')
         import_id_fields = ('phone',)  # 使用电话号码作为唯一标识
+        use_bulk = True
+        batch_size = 1000
+        skip_diff = True
+    
+    def get_bulk_update_fields(self):
+        """除导入的列外，负责人（导入人决定）和按号段补全的省份也需要写入"""
+        return super().get_bulk_update_fields() + ['sales_rep', 'province']
+    
+    def bulk_update(self, using_transactions, dry_run, raise_errors, batch_size=None, result=None):
+        """
+        批量更新后补写变更记录
+        
+        bulk_update 用 CASE 表达式更新，CustomerQuerySet.update 无法记录变更，
+        这里与导入前的取值比较（见 after_init_instance），与 Customer.save() 写入相同的记录。
+        """
+        events = []
+        for instance in self.update_instances:
+            old_values = self.original_values.pop(instance.pk, None)
+            if old_values is not None:
+                events.extend(CustomerEvent.changes(instance.pk, old_values, CustomerEvent.values_of(instance)))
+        super().bulk_update(using_transactions, dry_run, raise_errors, batch_size=batch_size, result=result)
+        if events and (using_transactions or not dry_run):
+            CustomerEvent.objects.bulk_create(events, batch_size=1000)
+    
+    def before_import(self, dataset, **kwargs):
+        """整批规范化电话，一次查出已存在的客户，避免逐行查询"""
+        super().before_import(dataset, **kwargs)
+        phones = dataset['电话'] if '电话' in (dataset.headers or []) else []
+        phone_keys = normalize_phones(phones)
+        self.existing_customers = existing_customers(phone_keys)
+        self.archived_phone_keys = archived_phone_keys(phone_keys)
+        # 已有客户导入前的取值: {客户ID: CustomerEvent.values_of()}
+        self.original_values = {}
+    
+    def get_instance(self, instance_loader, row):
+        """按规范化后的电话匹配已有客户（同一文件中的重复号码也会匹配到前面导入的客户）"""
+        return getattr(self, 'existing_customers', {}).get(normalize_phone(row.get('电话')))
+    
+    def skip_row(self, instance, original, row, import_validation_errors=None):
+        """已归档客户的号码不再新建客户（归档客户恢复时号码会冲突）"""
+        if instance.pk is None and normalize_phone(row.get('电话')) in getattr(self, 'archived_phone_keys', ()):
+            return True
+        return super().skip_row(instance, original, row, import_validation_errors)
+    
+    def before_save_instance(self, instance, row, **kwargs):
+        """按电话号段补全省份和城市"""
+        super().before_save_instance(instance, row, **kwargs)
+        fill_locations([instance])
+        # 批量写入前就设置规范化电话，本批后面重复的号码才能匹配到这条客户
+        instance.phone_key = normalize_phone(instance.phone) or None
+    
+    def save_instance(self, instance, is_create, row, **kwargs):
+        """同一文件中重复的号码匹配到本批尚未写入的客户时，直接修改该对象，不再重复加入批次"""
+        if self._meta.use_bulk and not is_create and instance.pk is None:
+            self.before_save_instance(instance, row, **kwargs)
+            self.after_save_instance(instance, row, **kwargs)
+            return
+        super().save_instance(instance, is_create, row, **kwargs)
+    
+    def after_save_instance(self, instance, row, **kwargs):
+        super().after_save_instance(instance, row, **kwargs)
+        if instance.phone_key and hasattr(self, 'existing_customers'):
+            self.existing_customers[instance.phone_key] = instance
     
     def before_import_row(self, row, **kwargs):
         """导入前处理每一行数据"""
@@ -35,15 +118,19 @@ class CustomerResource(resources.ModelResource):
             except (ValueError, TypeError):
                 row['线索创建时间'] = None
     
-    def after_import_instance(self, instance, new, row_dict=None, **kwargs):
-        """导入后处理实例"""
-        # 从kwargs中获取request对象
-        request = kwargs.get('request', None)
-        if request and hasattr(request, 'user'):
+    def after_init_instance(self, instance, new, row, **kwargs):
+        """取得（或新建）客户后设置负责人"""
+        if instance.pk is not None:
+            self.original_values.setdefault(instance.pk, CustomerEvent.values_of(instance))
+        # 后台导入时 import_data 会传入 user 和 request
+        user = kwargs.get('user')
+        if user is None and kwargs.get('request') is not None:
+            user = getattr(kwargs['request'], 'user', None)
+        if user is not None:
             # 超级用户导入 -> 公海(sales_rep=None)
             # 普通员工导入 -> 私海(sales_rep=当前用户)
-            if not request.user.is_superuser:
-                instance.sales_rep = request.user
+            if not user.is_superuser:
+                instance.sales_rep = user
             else:
                 instance.sales_rep = None
     
@@ -53,14 +140,97 @@ class CustomerResource(resources.ModelResource):
         return options
 
 
-class MyCustomerAdmin(ImportExportModelAdmin):
+def estimated_count(queryset):
+    """
+    PostgreSQL 查询计划中的估计行数，其他数据库返回 None
+
+    只执行 EXPLAIN，不扫描数据，大表上比 COUNT(*) 快得多。
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    后台列表分页器：估计行数超过阈值时直接使用估计值，不再执行 COUNT(*)
+
+    总数和页数是近似的，只影响分页栏的显示，各页的数据仍按偏移量准确查询。
+    """
+    
+    @cached_property
+    def count(self):
+        threshold = getattr(settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 10000)
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate >= threshold:
+            return estimate
+        return super().count
+
+
+class CachedValuesFieldListFilter(admin.AllValuesFieldListFilter):
+    """
+    取值列表缓存一段时间的筛选器
+    
+    默认的 AllValuesFieldListFilter 每次打开列表页都对整张表执行 SELECT DISTINCT，
+    这里按（后台页面, 字段, 用户范围）缓存取值列表；新出现的取值最多延迟一个缓存周期才出现在筛选栏。
+    """
+    
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        key = f'crm:admin:facet:{model_admin.opts.label_lower}:{field_path}:{user_scope(request.user)}'
+        choices = cache.get(key)
+        if choices is None:
+            choices = list(self.lookup_choices)
+            cache.set(key, choices, getattr(settings, 'ADMIN_FACET_CACHE_TIMEOUT', 600))
+        self.lookup_choices = choices
+
+
+# 搜索词只包含数字和电话分隔符时按电话号码处理
+_PHONE_SEARCH = re.compile(r'[\d\s+()-]+')
+
+
+class HighVolumeCustomerAdminMixin:
+    """
+    客户表数据量大时的后台列表设置
+    
+    - 线索来源、城市筛选使用缓存的取值列表；
+    - 不显示未筛选的总数（少一次全表 COUNT），大表使用估计行数分页；
+    - 负责人一起查出，编辑页负责人使用自动补全，不渲染全部用户的下拉框；
+    - 搜索使用前缀匹配（可走索引），完整的手机号按规范化号码精确匹配。
+    """
+    
+    list_filter = [
+        'status',
+        ('source', CachedValuesFieldListFilter),
+        ('city_auto', CachedValuesFieldListFilter),
+    ]
+    search_fields = ['name__startswith', 'phone__startswith']
+    list_select_related = ['sales_rep']
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    
+    def get_autocomplete_fields(self, request):
+        # 销售只能选择自己（见 formfield_for_foreignkey），不需要自动补全
+        if request.user.is_superuser:
+            return ['sales_rep']
+        return []
+    
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if _PHONE_SEARCH.fullmatch(term):
+            phone_key = normalize_phone(term)
+            if len(phone_key) == MOBILE_LENGTH:
+                return queryset.filter(phone_key=phone_key), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+class MyCustomerAdmin(HighVolumeCustomerAdminMixin, ImportExportModelAdmin):
     """我的客户管理"""
     resource_class = CustomerResource
     
-    list_display = ['name', 'phone', 'status', 'source', 'city_auto', 
+    list_display = ['name', 'phone', 'status', 'sales_rep', 'source', 'city_auto', 
                    'contact_count', 'next_contact_time', 'created_at']
-    list_filter = ['status', 'source', 'city_auto']
-    search_fields = ['name', 'phone']
     readonly_fields = ['created_at', 'last_contact_at', 'contact_count']
     
     fieldsets = (
@@ -82,6 +252,36 @@ class MyCustomerAdmin(ImportExportModelAdmin):
         }),
     )
     
+    def generate_log_entries(self, result, request):
+        """
+        导入日志一次批量写入（默认逐行 INSERT）
+        
+        批量模式下新客户在整批写入后才有ID，从导入结果保留的实例中读取。
+        """
+        if self.get_skip_admin_log():
+            return
+        action_flags = {
+            RowResult.IMPORT_TYPE_NEW: ADDITION,
+            RowResult.IMPORT_TYPE_UPDATE: CHANGE,
+            RowResult.IMPORT_TYPE_DELETE: DELETION,
+        }
+        content_type_id = ContentType.objects.get_for_model(self.model).pk
+        entries = []
+        for row in result:
+            if row.import_type not in action_flags:
+                continue
+            instance = getattr(row, 'instance', None)
+            object_id = instance.pk if instance is not None and instance.pk else row.object_id
+            entries.append(LogEntry(
+                user_id=request.user.pk,
+                content_type_id=content_type_id,
+                object_id=str(object_id) if object_id is not None else None,
+                object_repr=(row.object_repr or '')[:200],
+                action_flag=action_flags[row.import_type],
+                change_message=f'{row.import_type} through import_export',
+            ))
+        LogEntry.objects.bulk_create(entries, batch_size=1000)
+    
     def get_queryset(self, request):
         """只显示当前用户的客户"""
         qs = super().get_queryset(request)
@@ -106,13 +306,13 @@ class HighSeasCustomer(Customer):
         verbose_name_plural = '公海客户'
 
 
-class HighSeasAdmin(admin.ModelAdmin):
+class HighSeasAdmin(HighVolumeCustomerAdminMixin, admin.ModelAdmin):
     """公海客户管理"""
     
     list_display = ['name', 'phone', 'status', 'source', 'city_auto', 
                    'contact_count', 'created_at']
-    list_filter = ['status', 'source', 'city_auto']
-    search_fields = ['name', 'phone']
+    # 公海客户没有负责人
+    list_select_related = False
     
     actions = ['claim_customers']
     
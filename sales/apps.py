@@ -1,5 +1,4 @@
 from django.apps import AppConfig
-import os
 
 
 class SalesConfig(AppConfig):
@@ -8,22 +7,12 @@ class SalesConfig(AppConfig):
     verbose_name = "销售管理"
     
     def ready(self):
-        """应用就绪时启动后台任务"""
-        # 使用文件锁确保调度器只启动一次
-        import fcntl
+        """应用就绪时初始化数据库连接设置、注册删除用户时的客户交接（后台任务调度器由 wsgi.py / asgi.py 启动）"""
+        from django.contrib.auth.models import User
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import pre_delete
+        from monsterabc_crm.sqlite import configure_sqlite_connection
+        from .models import release_customers
         
-        lock_file = '/tmp/monsterabc_crm_scheduler.lock'
-        
-        try:
-            # 尝试获取独占锁
-            lock_fd = open(lock_file, 'w')
-            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            
-            # 成功获取锁,启动调度器
-            from .tasks import start_scheduler
-            start_scheduler()
-            
-            # 注意: 不要关闭lock_fd或释放锁,保持锁直到进程结束
-        except IOError:
-            # 锁已被其他进程持有,跳过启动
-            pass
+        connection_created.connect(configure_sqlite_connection, dispatch_uid='configure_sqlite_connection')
+        pre_delete.connect(release_customers, sender=User, dispatch_uid='release_customers')
@@ -0,0 +1,89 @@
+"""
+冷数据归档
+
+已签约/无意向、且超过一年没有任何修改（last_contact_at 随每次保存自动更新）的客户，
+按主键分批从 Customer 表移到 ArchivedCustomer 表：每批一个事务，复制后删除主表行，
+主表和它的索引只保留活跃的线索。
+
+归档保留原客户ID和变更记录，客户详情页、搜索和导出在主表找不到时继续查归档表；
+编辑归档客户时先把它恢复到主表。
+"""
+
+from datetime import timedelta
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from monsterabc_crm.sqlite import retry_on_locked
+
+from .caching import bump_generations
+from .models import ArchivedCustomer, Customer, CustomFieldValue
+
+
+ARCHIVE_STATUSES = ['signed', 'no_intent']
+ARCHIVE_AFTER_DAYS = 365
+BATCH_SIZE = 1000
+
+
+def cold_customers(days=ARCHIVE_AFTER_DAYS, now=None):
+    """可以归档的客户"""
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return Customer.objects.filter(status__in=ARCHIVE_STATUSES, last_contact_at__lt=cutoff)
+
+
+@transaction.atomic
+def archive_customers(pks):
+    """把一批客户移入归档表，返回归档数量"""
+    rows = list(Customer.objects.filter(pk__in=pks).values(*ArchivedCustomer.customer_columns()))
+    if not rows:
+        return 0
+    
+    now = timezone.now()
+    ArchivedCustomer.objects.bulk_create([ArchivedCustomer(archived_at=now, **row) for row in rows])
+    
+    pks = [row['id'] for row in rows]
+    # 自定义字段取值可由 extra_data 重建，直接删除
+    CustomFieldValue.objects.filter(customer_id__in=pks).delete()
+    # 变更记录要保留（删除客户时 Django 会级联删除），客户仍然存在于归档表中，也不记删除标记，
+    # 所以不用 QuerySet.delete()，直接按主键删除主表行
+    with connections[router.db_for_write(Customer)].cursor() as cursor:
+        table = cursor.db.ops.quote_name(Customer._meta.db_table)
+        cursor.execute(f'DELETE FROM {table} WHERE id IN ({", ".join(["%s"] * len(pks))})', pks)
+    bump_generations({row['sales_rep_id'] for row in rows})
+    return len(rows)
+
+
+def archive_cold_customers(days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, now=None):
+    """按主键分批归档冷数据，返回归档总数"""
+    queryset = cold_customers(days, now)
+    archived = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return archived
+        archived += retry_on_locked(archive_customers)(pks)
+
+
+@transaction.atomic
+def restore_customer(pk):
+    """把归档客户恢复到 Customer 表（保留原ID），返回恢复后的客户"""
+    archived = ArchivedCustomer.objects.get(pk=pk)
+    customer = archived.to_customer()
+    # bulk_create 保留原ID插入；最后联系时间会更新为当前时间，恢复后不会马上被再次归档
+    Customer.objects.bulk_create([customer])
+    CustomFieldValue.sync_customers([customer])
+    archived.delete()
+    return customer
+
+
+def search_archive(user, search_query, limit=20):
+    """按姓名或电话搜索归档客户（销售只能搜到自己的）"""
+    if not search_query:
+        return []
+    archived = ArchivedCustomer.objects.filter(
+        Q(name__icontains=search_query) | Q(phone__icontains=search_query)
+    )
+    if not user.is_superuser:
+        archived = archived.filter(sales_rep=user)
+    return list(archived.select_related('sales_rep')[:limit])
@@ -0,0 +1,223 @@
+"""
+数据库在线备份与恢复
+
+- SQLite: 用 SQLite 在线备份接口（sqlite3.Connection.backup）复制出一致的快照，再 gzip 压缩。
+  WAL 模式下读事务不阻塞写入，整库在一个读事务中复制，不会因为其他连接写入而重新开始；
+  其他日志模式下读锁会阻塞写入，按 BACKUP_PAGES_PER_STEP 页分步复制，每步之间让出锁。
+  直接 cp 数据库文件在有写入时可能得到损坏的副本（WAL 中尚未合并的修改也不会被复制）。
+- PostgreSQL: pg_dump 自定义格式（已压缩），在一个快照中导出，不阻塞读写。
+
+备份文件名为 crm_backup_<时间>.sqlite3.gz / crm_backup_<时间>.pgdump，先写入临时文件，完成后再改名，
+目录中不会出现写了一半的备份。恢复前先完整读取一遍并检查完整性，检查不通过不会修改数据库。
+"""
+
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PREFIX = 'crm_backup_'
+SQLITE_SUFFIX = '.sqlite3.gz'
+POSTGRES_SUFFIX = '.pgdump'
+COPY_CHUNK_SIZE = 1024 * 1024
+# 分步复制时每步之间的间隔秒数
+STEP_SLEEP = 0.05
+
+
+def backup_filename(vendor, now=None):
+    suffix = POSTGRES_SUFFIX if vendor == 'postgresql' else SQLITE_SUFFIX
+    return f'{BACKUP_PREFIX}{timezone.localtime(now).strftime("%Y%m%d_%H%M%S")}{suffix}'
+
+
+def pg_command(program, settings_dict):
+    """pg_dump / pg_restore 的命令和环境变量（连接参数取自数据库配置）"""
+    command = [os.path.join(settings.PG_BIN_DIR, program) if settings.PG_BIN_DIR else program]
+    for option, key in (('--host', 'HOST'), ('--port', 'PORT'), ('--username', 'USER')):
+        if settings_dict.get(key):
+            command += [option, str(settings_dict[key])]
+    env = dict(os.environ)
+    if settings_dict.get('PASSWORD'):
+        env['PGPASSWORD'] = settings_dict['PASSWORD']
+    return command, env
+
+
+def run_pg(program, settings_dict, *args):
+    """执行 PostgreSQL 命令行工具，失败时抛出 RuntimeError"""
+    command, env = pg_command(program, settings_dict)
+    try:
+        result = subprocess.run(command + list(args), env=env, capture_output=True, text=True)
+    except OSError as e:
+        raise RuntimeError(f'无法执行 {program}: {e}')
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        raise RuntimeError(f'{program} 失败: {lines[-1] if lines else result.returncode}')
+
+
+def snapshot_sqlite(target_path, using='default'):
+    """用在线备份接口把 SQLite 数据库复制到 target_path，返回复制的页数"""
+    connection = connections[using]
+    # 复制时要读取已提交的数据，连接上有未提交的写事务时备份接口会一直等待
+    if connection.in_atomic_block:
+        raise RuntimeError('不能在事务中备份数据库')
+    connection.ensure_connection()
+    source = connection.connection
+    journal_mode = source.execute('PRAGMA journal_mode').fetchone()[0].lower()
+    pages = -1 if journal_mode == 'wal' else settings.BACKUP_PAGES_PER_STEP
+
+    copied = 0
+
+    def progress(status, remaining, total):
+        nonlocal copied
+        copied = total
+
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages, progress=progress, sleep=STEP_SLEEP)
+    finally:
+        target.close()
+    return copied
+
+
+def write_backup(path, using='default'):
+    """把数据库快照（压缩后）写入 path"""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        run_pg(
+            'pg_dump', connection.settings_dict,
+            '--format=custom', '--no-owner', '--no-privileges', '--file', path, connection.settings_dict['NAME'],
+        )
+        return
+
+    fd, snapshot = tempfile.mkstemp(suffix='.sqlite3', dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        snapshot_sqlite(snapshot, using)
+        with open(snapshot, 'rb') as source, gzip.open(path, 'wb', compresslevel=6) as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+    finally:
+        os.remove(snapshot)
+
+
+def create_backup(directory, using='default'):
+    """在 directory 中生成一份备份，返回备份文件路径"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, backup_filename(connections[using].vendor))
+    partial = f'{path}.part'
+    try:
+        write_backup(partial, using)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    logger.info(f"[数据库备份] 已生成 {os.path.basename(path)} ({os.path.getsize(path) // 1024} KB)")
+    return path
+
+
+def list_backups(directory):
+    """目录中的备份文件（新的在前）"""
+    if not os.path.isdir(directory):
+        return []
+    paths = [
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith(BACKUP_PREFIX) and name.endswith((SQLITE_SUFFIX, POSTGRES_SUFFIX))
+    ]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def prune_backups(directory, days):
+    """删除超过保留天数的备份（至少保留最新的一份），返回删除的文件路径；days 为 0 时不清理"""
+    if days <= 0:
+        return []
+    cutoff = (timezone.now() - timedelta(days=days)).timestamp()
+    removed = [path for path in list_backups(directory)[1:] if os.path.getmtime(path) < cutoff]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def extract_sqlite(path, target_path):
+    """解压 SQLite 备份并检查完整性，不是有效备份时抛出 ValueError"""
+    try:
+        with gzip.open(path, 'rb') as source, open(target_path, 'wb') as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+    except (OSError, EOFError) as e:
+        raise ValueError(f'备份文件无法解压: {e}')
+
+    database = sqlite3.connect(target_path)
+    try:
+        result = [row[0] for row in database.execute('PRAGMA integrity_check')]
+        has_migrations = database.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'django_migrations'"
+        ).fetchone()
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f'备份文件不是有效的数据库: {e}')
+    finally:
+        database.close()
+    if result != ['ok']:
+        raise ValueError(f'完整性检查失败: {"; ".join(result[:5])}')
+    if not has_migrations:
+        raise ValueError('备份中没有 django_migrations 表，不是本系统的数据库')
+
+
+def verify_backup(path, using='default'):
+    """完整读取一遍备份并检查完整性，不通过时抛出 ValueError"""
+    if path.endswith(POSTGRES_SUFFIX):
+        try:
+            # 把整个备份转换成SQL（丢弃输出），每个数据块都会被读取和解压
+            run_pg('pg_restore', connections[using].settings_dict, '--file', os.devnull, path)
+        except RuntimeError as e:
+            raise ValueError(str(e))
+        return
+
+    fd, extracted = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(fd)
+    try:
+        extract_sqlite(path, extracted)
+    finally:
+        os.remove(extracted)
+
+
+def restore_sqlite(snapshot_path, target):
+    """用在线备份接口把检查过的快照写入目标数据库连接（整库替换）"""
+    source = sqlite3.connect(snapshot_path)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+
+
+def restore_backup(path, using='default'):
+    """检查备份完整性后恢复到数据库（整库替换），检查不通过时抛出 ValueError"""
+    connection = connections[using]
+    if path.endswith(POSTGRES_SUFFIX):
+        if connection.vendor != 'postgresql':
+            raise ValueError('PostgreSQL 备份只能恢复到 PostgreSQL 数据库')
+        verify_backup(path, using)
+        connection.close()
+        run_pg(
+            'pg_restore', connection.settings_dict, '--clean', '--if-exists', '--no-owner', '--no-privileges',
+            '--single-transaction', '--dbname', connection.settings_dict['NAME'], path,
+        )
+    else:
+        if connection.vendor != 'sqlite':
+            raise ValueError('SQLite 备份只能恢复到 SQLite 数据库')
+        fd, extracted = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        try:
+            extract_sqlite(path, extracted)
+            connection.ensure_connection()
+            restore_sqlite(extracted, connection.connection)
+        finally:
+            os.remove(extracted)
+    logger.info(f"[数据库恢复] 已从 {os.path.basename(path)} 恢复")
@@ -0,0 +1,168 @@
+"""
+按筛选条件批量修改/删除客户
+
+管理员选择"应用到全部筛选结果"时，不再由浏览器提交所有客户ID，而是在后台线程中
+按主键分块处理：每块一条 UPDATE（状态和负责人合并修改）或 DELETE，累计实际影响的行数。
+任务进度和取消标记保存在缓存中（多进程共享），每处理完一块检查一次是否已取消。
+
+后台线程随所在的 Web worker 一起结束（worker 重启、超时、达到 max-requests 被回收），
+来不及写入结果。每处理完一块更新一次 updated_at，运行中的任务超过 HEARTBEAT_TIMEOUT 秒
+没有更新时，查询进度返回 interrupted，进度条不再一直轮询。
+"""
+
+import logging
+import threading
+import uuid
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from monsterabc_crm.sqlite import retry_on_locked
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+JOB_TIMEOUT = 24 * 3600
+# 运行中的任务超过该秒数没有更新进度，视为已中断
+HEARTBEAT_TIMEOUT = 300
+
+
+def job_key(job_id):
+    return f'crm:bulkjob:{job_id}'
+
+
+def cancel_key(job_id):
+    return f'crm:bulkjob:{job_id}:cancel'
+
+
+def apply_in_chunks(queryset, action, updates=None, chunk_size=CHUNK_SIZE, should_stop=None, progress=None):
+    """
+    按主键顺序分块修改或删除 queryset 中的客户
+
+    每块重新套用原筛选条件，只处理仍然符合条件的行。
+    返回 (处理的行数, 实际影响的行数, 是否被取消)。
+    """
+    processed = affected = 0
+    last_pk = 0
+    while True:
+        if should_stop and should_stop():
+            return processed, affected, True
+        pks = list(
+            queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not pks:
+            return processed, affected, False
+
+        chunk = queryset.filter(pk__in=pks)
+        if action == 'delete':
+            # 只统计客户本身，不含级联删除的自定义字段取值
+            affected += retry_on_locked(chunk.delete)()[1].get(queryset.model._meta.label, 0)
+        else:
+            affected += retry_on_locked(chunk.update)(**updates)
+        processed += len(pks)
+        last_pk = pks[-1]
+
+        if progress:
+            progress(processed, affected)
+
+
+def start_bulk_job(user, queryset, action, updates=None):
+    """创建批量任务并在后台线程中执行，返回任务ID"""
+    job_id = uuid.uuid4().hex
+    now = timezone.now().isoformat()
+    cache.set(job_key(job_id), {
+        'id': job_id,
+        'action': action,
+        'user_id': user.pk,
+        'status': 'running',
+        'total': queryset.count(),
+        'processed': 0,
+        'affected': 0,
+        'started_at': now,
+        'updated_at': now,
+        'finished_at': None,
+        'error': '',
+    }, JOB_TIMEOUT)
+
+    thread = threading.Thread(
+        target=run_in_thread,
+        args=(job_id, queryset, action, updates),
+        name=f'bulk-job-{job_id}',
+        daemon=True,
+    )
+    thread.start()
+    return job_id
+
+
+def update_job(job_id, **fields):
+    job = cache.get(job_key(job_id))
+    if job is None:
+        return
+    job.update(fields, updated_at=timezone.now().isoformat())
+    cache.set(job_key(job_id), job, JOB_TIMEOUT)
+
+
+def run_bulk_job(job_id, queryset, action, updates=None):
+    """后台执行批量任务，记录进度和结果"""
+    try:
+        processed, affected, cancelled = apply_in_chunks(
+            queryset,
+            action,
+            updates,
+            should_stop=lambda: cache.get(cancel_key(job_id), False),
+            progress=lambda processed, affected: update_job(job_id, processed=processed, affected=affected),
+        )
+        status = 'cancelled' if cancelled else 'done'
+        update_job(
+            job_id, status=status, processed=processed, affected=affected,
+            finished_at=timezone.now().isoformat(),
+        )
+        logger.info(f"[批量操作] 任务 {job_id} {action} {status}: 处理 {processed} 个客户, 影响 {affected} 个")
+    except Exception as e:
+        update_job(job_id, status='failed', error=str(e), finished_at=timezone.now().isoformat())
+        logger.error(f"[批量操作] 任务 {job_id} 失败: {e}")
+
+
+def run_in_thread(*args):
+    try:
+        run_bulk_job(*args)
+    finally:
+        # 后台线程使用独立的数据库连接，结束时关闭
+        connection.close()
+
+
+def check_interrupted(job, now=None):
+    """运行中但长时间没有更新进度的任务（后台线程已随 worker 结束）标记为 interrupted"""
+    if job is None or job['status'] != 'running':
+        return job
+    updated_at = job.get('updated_at') or job.get('started_at')
+    if updated_at is None:
+        return job
+    idle = ((now or timezone.now()) - datetime.fromisoformat(updated_at)).total_seconds()
+    if idle <= HEARTBEAT_TIMEOUT:
+        return job
+    return {
+        **job,
+        'status': 'interrupted',
+        'error': f'后台任务已中断（{int(idle)} 秒没有进度，可能是服务重启或超时），已处理的客户不会回滚，可重新提交',
+    }
+
+
+def get_bulk_job(job_id):
+    return check_interrupted(cache.get(job_key(job_id)))
+
+
+async def aget_bulk_job(job_id):
+    """异步视图轮询任务进度时使用"""
+    return check_interrupted(await cache.aget(job_key(job_id)))
+
+
+def cancel_bulk_job(job_id):
+    """请求取消任务，当前块处理完后停止（已处理的块不会回滚）"""
+    if get_bulk_job(job_id) is None:
+        return False
+    cache.set(cancel_key(job_id), True, JOB_TIMEOUT)
+    return True
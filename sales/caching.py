@@ -0,0 +1,94 @@
+"""
+列表页查询结果缓存
+
+按 (用户, 视图, 筛选条件, 页码) 缓存分页后的客户列表和总数，缓存键中带有代数（generation）：
+- 销售看到的是自己的客户，使用该销售自己的代数；
+- 管理员看到全部客户，使用全局代数。
+客户的任何写入（save/delete、批量 update/delete/bulk_create、认领、回收）都会递增受影响
+销售的代数和全局代数，旧缓存随即失效，无需逐个删除。
+
+缓存后端使用 settings.CACHES['default']（默认基于文件，多进程共享，无需外部服务）。
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db import transaction
+
+
+GLOBAL_SCOPE = 'all'
+
+
+def generation_key(scope):
+    return f'crm:gen:{scope}'
+
+
+def get_generation(scope):
+    """返回某个范围（销售ID或全局）的当前代数"""
+    generation = cache.get(generation_key(scope))
+    if generation is None:
+        # 代数丢失（缓存被清理）时用当前时间初始化，避免与旧缓存键重复
+        generation = time.time_ns()
+        cache.add(generation_key(scope), generation, timeout=None)
+        generation = cache.get(generation_key(scope), generation)
+    return generation
+
+
+def _bump(scopes):
+    for scope in scopes:
+        try:
+            cache.incr(generation_key(scope))
+        except ValueError:
+            cache.set(generation_key(scope), time.time_ns(), timeout=None)
+
+
+def bump_generations(user_ids=()):
+    """
+    客户数据变化后让相关缓存失效
+
+    user_ids 为受影响的销售ID（变更前后的负责人），公海客户传 None 即可，
+    全局代数总是递增。在事务中调用时，提交后会再递增一次，
+    防止并发请求在提交前把旧数据写入新代数的缓存。
+    """
+    scopes = {GLOBAL_SCOPE} | {user_id for user_id in user_ids if user_id is not None}
+    _bump(scopes)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(scopes))
+
+
+def user_scope(user, own_only=True):
+    """列表数据所属的代数范围：销售的私海用自己的代数，管理员和公海用全局代数"""
+    if user.is_superuser or not own_only:
+        return GLOBAL_SCOPE
+    return user.pk
+
+
+def page_cache_key(user, view_name, params, page_number):
+    scope = user_scope(user)
+    filters = '&'.join(f'{key}={value}' for key, value in sorted(params.items()) if key != 'page')
+    digest = hashlib.md5(filters.encode('utf-8')).hexdigest()
+    return f'crm:page:{view_name}:{user.pk}:{get_generation(scope)}:{digest}:{page_number}'
+
+
+def get_cached_page(user, view_name, queryset, params, page_number, per_page=100):
+    """
+    返回分页后的客户列表，命中缓存时不查询数据库
+
+    params 为筛选条件（通常是 request.GET），与 page_number 一起组成缓存键。
+    """
+    key = page_cache_key(user, view_name, params, page_number)
+    paginator = Paginator(queryset, per_page)
+
+    cached = cache.get(key)
+    if cached is not None:
+        count, number, objects = cached
+        paginator.count = count
+        return Page(objects, number, paginator)
+
+    page = paginator.get_page(page_number)
+    objects = list(page.object_list)
+    cache.set(key, (paginator.count, page.number, objects), getattr(settings, 'LIST_PAGE_CACHE_TIMEOUT', 300))
+    return Page(objects, page.number, paginator)
@@ -0,0 +1,166 @@
+"""
+客户变更订阅（下游增量同步）
+
+BI 数仓等下游每次只拉取上次同步之后新增、修改、删除的客户，同步量与变化量成正比，而不是与表大小成正比：
+
+- Customer.updated_at 在每次写入时更新，包括 save()、bulk_create() 以及 QuerySet.update() / bulk_update()
+  （last_contact_at 只在 save() 时更新，批量修改不会变化，不能作为同步依据）；
+- 删除客户时写入 CustomerTombstone，下游据此删除；归档不算删除；
+- 变更按 (时间, 类型, 主键) 排序，游标就是上一页最后一条的位置。(updated_at, id) 和 (deleted_at, id)
+  上有索引，每页只扫描索引中游标之后的部分。
+
+同一客户多次修改只返回一次（最新数据）。修改时间是应用写入时的时间而不是提交时间，
+所以只返回 CHANGE_FEED_LAG_SECONDS 之前的变更，留出时间让进行中的事务提交。
+变更订阅总是读主库，副本的复制延迟可能让游标越过尚未同步到副本的修改。
+"""
+
+import base64
+import csv
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Customer, CustomerTombstone
+
+
+UPSERT = 'upsert'
+DELETE = 'delete'
+# 同一时刻先返回修改再返回删除
+CHANGE_TYPES = [UPSERT, DELETE]
+
+CHANGE_FIELDS = [
+    'id', 'name', 'phone', 'status', 'sales_rep_id', 'source', 'city_auto', 'region_manual', 'province',
+    'contact_count', 'next_contact_time', 'is_key_customer', 'notes', 'extra_data',
+    'created_at', 'last_contact_at', 'updated_at',
+]
+CHANGE_HEADERS = ['op', 'changed_at'] + CHANGE_FIELDS
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+# 每次按主键读取的客户数（SQLite 单条语句的参数个数有限）
+FETCH_CHUNK_SIZE = 500
+
+
+def encode_cursor(changed_at, op, pk):
+    raw = json.dumps([changed_at.isoformat(), op, pk]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """解析游标，返回 (时间, 类型, 主键)，格式错误时抛出 ValueError"""
+    try:
+        changed_at, op, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        changed_at = parse_datetime(changed_at)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('cursor')
+    if changed_at is None or op not in CHANGE_TYPES:
+        raise ValueError('cursor')
+    return changed_at, op, pk
+
+
+def feed_until():
+    """变更订阅返回的最晚时间"""
+    return timezone.now() - timedelta(seconds=settings.CHANGE_FEED_LAG_SECONDS)
+
+
+def after_cursor(queryset, time_field, op, position):
+    """游标位置之后的记录"""
+    if position is None:
+        return queryset
+    changed_at, cursor_op, pk = position
+    later = Q(**{f'{time_field}__gt': changed_at})
+    if op == cursor_op:
+        return queryset.filter(later | Q(**{time_field: changed_at, 'pk__gt': pk}))
+    if CHANGE_TYPES.index(op) > CHANGE_TYPES.index(cursor_op):
+        return queryset.filter(**{f'{time_field}__gte': changed_at})
+    return queryset.filter(later)
+
+
+def change_page(cursor=None, limit=DEFAULT_PAGE_SIZE, until=None):
+    """
+    读取游标之后的一页变更，返回 (变更列表, 下一页游标, 是否还有更多)
+
+    变更为 (时间, 类型, 排序主键, 客户ID)，只读取索引中的时间和主键，客户数据由 change_rows 分块读取。
+    没有新变更时下一页游标就是传入的游标。cursor 格式错误时抛出 ValueError。
+    """
+    position = decode_cursor(cursor) if cursor else None
+    until = until or feed_until()
+
+    upserts = after_cursor(Customer.objects.filter(updated_at__lte=until), 'updated_at', UPSERT, position)
+    deletes = after_cursor(
+        CustomerTombstone.objects.filter(deleted_at__lte=until), 'deleted_at', DELETE, position
+    )
+    changes = [
+        (changed_at, UPSERT, pk, pk)
+        for changed_at, pk in upserts.order_by('updated_at', 'pk').values_list('updated_at', 'pk')[:limit + 1]
+    ]
+    changes += [
+        (changed_at, DELETE, pk, customer_id)
+        for changed_at, pk, customer_id in deletes.order_by('deleted_at', 'pk').values_list(
+            'deleted_at', 'pk', 'customer_id'
+        )[:limit + 1]
+    ]
+    changes.sort(key=lambda change: (change[0], CHANGE_TYPES.index(change[1]), change[2]))
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    next_cursor = encode_cursor(*changes[-1][:3]) if changes else cursor
+    return changes, next_cursor, has_more
+
+
+def change_rows(changes):
+    """按变更顺序返回输出行（字典），修改的客户按主键一次读出"""
+    ids = [customer_id for _, op, _, customer_id in changes if op == UPSERT]
+    customers = {row['id']: row for row in Customer.objects.filter(pk__in=ids).values(*CHANGE_FIELDS)}
+    rows = []
+    for changed_at, op, _, customer_id in changes:
+        if op == DELETE:
+            rows.append({'op': DELETE, 'changed_at': changed_at, 'id': customer_id})
+        elif customer_id in customers:
+            # 读取这一页之后又被删除的客户跳过，删除记录在之后的页中
+            rows.append({'op': UPSERT, 'changed_at': changed_at, **customers[customer_id]})
+    return rows
+
+
+def change_chunks(changes):
+    """把一页变更按 FETCH_CHUNK_SIZE 分块"""
+    for start in range(0, len(changes), FETCH_CHUNK_SIZE):
+        yield changes[start:start + FETCH_CHUNK_SIZE]
+
+
+def ndjson_lines(rows):
+    return ''.join(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in rows)
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+class ChangeCSVWriter:
+    """把变更行写成CSV文本（删除行只有 op、changed_at、id）"""
+
+    def __init__(self):
+        self.writer = csv.writer(self)
+
+    def write(self, value):
+        return value
+
+    def header(self):
+        return self.writer.writerow(CHANGE_HEADERS)
+
+    def lines(self, rows):
+        return ''.join(
+            self.writer.writerow([csv_value(row.get(column)) for column in CHANGE_HEADERS]) for row in rows
+        )
@@ -1,11 +1,46 @@
 from functools import wraps
-from django.contrib.auth.decorators import login_required
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.decorators import login_required as django_login_required
+from django.contrib.auth.views import redirect_to_login
 from django.shortcuts import redirect
 from django.contrib import messages
 
 
+async def get_request_user(request):
+    """在异步视图中取得当前用户（读取会话和用户表是同步操作，放到线程中执行）"""
+    def load_user():
+        user = request.user
+        user.is_authenticated  # 触发惰性对象加载，之后可在事件循环中直接使用
+        return user
+    return await sync_to_async(load_user)()
+
+
+def login_required(function):
+    """登录校验，同时支持同步和异步视图（Django 4.2 的 login_required 不支持异步视图）"""
+    if not iscoroutinefunction(function):
+        return django_login_required(function)
+
+    @wraps(function)
+    async def wrap(request, *args, **kwargs):
+        user = await get_request_user(request)
+        if user.is_authenticated:
+            return await function(request, *args, **kwargs)
+        return redirect_to_login(request.get_full_path())
+    return wrap
+
+
 def admin_required(function):
     """仅管理员可访问的装饰器"""
+    if iscoroutinefunction(function):
+        @wraps(function)
+        @login_required
+        async def async_wrap(request, *args, **kwargs):
+            if request.user.is_superuser:
+                return await function(request, *args, **kwargs)
+            messages.error(request, '您没有权限访问此页面,仅管理员可访问。')
+            return redirect('dashboard')
+        return async_wrap
+
     @wraps(function)
     @login_required
     def wrap(request, *args, **kwargs):
@@ -0,0 +1,127 @@
+"""
+线索分配
+
+把一批客户（通常是公海中按条件筛选出的线索，或离职销售的全部客户）分配给多个销售：
+- round_robin: 轮流平均分配，除不尽的部分优先给当前未结案客户最少的销售；
+- weighted: 按权重比例分配；
+- capacity: 按剩余容量分配，每条线索给当前负载（未结案客户数 + 本次已分配）最低的销售，
+  可设置每人容量上限，超出容量的线索留在原处。
+
+先在内存中算出每个销售分到的数量，再按主键顺序切成连续区间，每个销售一条
+UPDATE ... WHERE 原筛选条件 AND id BETWEEN 区间首尾，5万条线索只需与销售人数相同的几条语句。
+"""
+
+import heapq
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Customer
+
+
+STRATEGY_CHOICES = [
+    ('round_robin', '轮流平均分配'),
+    ('weighted', '按权重分配'),
+    ('capacity', '按剩余容量分配'),
+]
+
+# 已结案的状态不计入销售的当前负载
+CLOSED_STATUSES = ['signed', 'no_intent']
+
+
+def open_lead_counts(rep_ids):
+    """各销售当前未结案的客户数（一条 GROUP BY 查询）"""
+    counts = dict.fromkeys(rep_ids, 0)
+    rows = (
+        Customer.objects.filter(sales_rep_id__in=rep_ids)
+        .exclude(status__in=CLOSED_STATUSES)
+        .values('sales_rep_id')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    for row in rows:
+        counts[row['sales_rep_id']] = row['count']
+    return counts
+
+
+def _apportion(total, weights, loads):
+    """最大余数法按权重拆分 total，余数相同时优先给负载低的销售"""
+    weight_sum = sum(weights.values())
+    if total <= 0 or weight_sum <= 0:
+        return dict.fromkeys(weights, 0)
+
+    shares = {rep: total * weight / weight_sum for rep, weight in weights.items()}
+    quotas = {rep: int(share) for rep, share in shares.items()}
+    remainder = total - sum(quotas.values())
+    order = sorted(weights, key=lambda rep: (-(shares[rep] - quotas[rep]), loads[rep], rep))
+    for rep in order[:remainder]:
+        quotas[rep] += 1
+    return quotas
+
+
+def _fill_by_load(total, loads, capacity):
+    """每条线索分给当前负载最低且未满的销售"""
+    quotas = dict.fromkeys(loads, 0)
+    heap = [
+        (load, rep) for rep, load in loads.items()
+        if capacity.get(rep) is None or load < capacity[rep]
+    ]
+    heapq.heapify(heap)
+    for _ in range(total):
+        if not heap:
+            break
+        load, rep = heapq.heappop(heap)
+        quotas[rep] += 1
+        if capacity.get(rep) is None or load + 1 < capacity[rep]:
+            heapq.heappush(heap, (load + 1, rep))
+    return quotas
+
+
+def plan_quotas(total, loads, strategy='round_robin', weights=None, capacity=None):
+    """
+    计算每个销售分到的线索数
+
+    loads: {销售ID: 当前未结案客户数}；weights: {销售ID: 权重}（weighted）；
+    capacity: {销售ID: 容量上限} 或统一的整数上限（capacity，None 表示不限）。
+    """
+    if not loads:
+        return {}
+    if strategy == 'weighted':
+        weights = {rep: max(0, (weights or {}).get(rep, 1)) for rep in loads}
+        return _apportion(total, weights, loads)
+    if strategy == 'capacity':
+        if not isinstance(capacity, dict):
+            capacity = dict.fromkeys(loads, capacity)
+        return _fill_by_load(total, loads, capacity)
+    return _apportion(total, dict.fromkeys(loads, 1), loads)
+
+
+def distribute_leads(queryset, rep_ids, strategy='round_robin', weights=None, capacity=None):
+    """
+    把 queryset 中的客户分配给 rep_ids 中的销售
+
+    返回 {销售ID: 实际分配的客户数}。
+    """
+    rep_ids = sorted(set(
+        User.objects.filter(pk__in=rep_ids, is_active=True).values_list('pk', flat=True)
+    ))
+    if not rep_ids:
+        return {}
+
+    with transaction.atomic():
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+        quotas = plan_quotas(len(pks), open_lead_counts(rep_ids), strategy, weights, capacity)
+
+        assigned = {}
+        start = 0
+        for rep_id in rep_ids:
+            count = quotas.get(rep_id, 0)
+            if not count:
+                assigned[rep_id] = 0
+                continue
+            block = pks[start:start + count]
+            start += count
+            # 区间内仍符合原筛选条件的客户即为分配给该销售的一段
+            assigned[rep_id] = queryset.filter(pk__gte=block[0], pk__lte=block[-1]).update(sales_rep_id=rep_id)
+    return assigned
@@ -2,7 +2,8 @@ from django import forms
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.contrib.auth.models import User
 from captcha.fields import CaptchaField
-from .models import Customer
+from .models import ArchivedCustomer, Customer, CustomFieldValue
+from .phones import normalize_phone
 import json
 
 
@@ -155,9 +156,12 @@ class CustomerForm(forms.ModelForm):
                     })
                 )
             elif custom_field.field_type == 'number':
+                # 与 CustomFieldValue 可保存的数字范围一致（15位整数、4位小数）
                 field = forms.DecimalField(
                     label=custom_field.label,
                     required=custom_field.is_required,
+                    max_digits=CustomFieldValue.NUMBER_INTEGER_DIGITS + CustomFieldValue.NUMBER_DECIMAL_PLACES,
+                    decimal_places=CustomFieldValue.NUMBER_DECIMAL_PLACES,
                     widget=forms.NumberInput(attrs={
                         'class': 'form-control',
                         'placeholder': custom_field.placeholder
@@ -214,6 +218,29 @@ class CustomerForm(forms.ModelForm):
                     if value is not None:
                         self.initial[field_name] = value
     
+    def clean_phone(self):
+        """规范化后相同的电话视为重复（如 +86 138-0000-0000 与 13800000000）"""
+        phone = self.cleaned_data['phone'].strip()
+        phone_key = normalize_phone(phone)
+        if not phone_key:
+            raise forms.ValidationError('请输入有效的电话号码')
+        duplicates = Customer.objects.filter(phone_key=phone_key)
+        if self.instance.pk:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        # 规范化前遗留的重复客户（phone_key 为空，等待 dedupe_customers 合并）不改号码时仍可编辑
+        leftover = (
+            self.instance.pk and self.instance.phone_key is None
+            and normalize_phone(self.instance.phone) == phone_key
+        )
+        if not leftover and duplicates.exists():
+            raise forms.ValidationError('该电话号码的客户已存在')
+        archived = ArchivedCustomer.objects.filter(phone_key=phone_key)
+        if self.instance.pk:
+            archived = archived.exclude(pk=self.instance.pk)
+        if archived.exists():
+            raise forms.ValidationError('该电话号码的客户已归档，可在客户列表中搜索后编辑')
+        return phone
+    
     def save(self, commit=True):
         """保存表单，包括处理extra_data"""
         from .models import CustomField
@@ -0,0 +1,89 @@
+"""
+手机号段归属地（离线）
+
+随代码发布的 data/mobile_prefixes.tsv.gz 把7位手机号段（如 1380000）映射到省份和城市，
+合并成按起点排序的区间。加载后用两个紧凑数组保存：区间起点（array 'l'）和地区编号（array 'H'），
+查询时对起点数组二分查找，不访问网络或数据库，每秒可查询数十万个号码。
+
+导入客户（批量添加、Excel导入、后台导入）时只填写空的 city_auto / province，
+已有客户用 backfill_phone_locations 命令回填。数据文件由 build_phone_prefixes 命令生成。
+"""
+
+import gzip
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from pathlib import Path
+
+from .phones import normalize_phone
+
+
+DATA_FILE = Path(__file__).resolve().parent / 'data' / 'mobile_prefixes.tsv.gz'
+PREFIX_LENGTH = 7
+MOBILE_LENGTH = 11
+
+
+class PrefixTable:
+    """号段区间表：starts[i] 起到 starts[i+1] 之前的号段属于 locations[location_ids[i]]"""
+
+    def __init__(self, starts, location_ids, locations):
+        self.starts = starts
+        self.location_ids = location_ids
+        # 编号0为未知地区
+        self.locations = locations
+
+    @classmethod
+    def load(cls, path=DATA_FILE):
+        starts = array('l')
+        location_ids = array('H')
+        locations = {0: None}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('#'):
+                    continue
+                fields = line.rstrip('\n').split('\t')
+                if fields[0] == 'L':
+                    locations[int(fields[1])] = (fields[2], fields[3])
+                else:
+                    starts.append(int(fields[0]))
+                    location_ids.append(int(fields[1]))
+        return cls(starts, location_ids, [locations.get(i) for i in range(max(locations) + 1)])
+
+    def lookup(self, phone_key):
+        """返回规范化号码的 (省份, 城市)，未知号段返回 None"""
+        if len(phone_key) != MOBILE_LENGTH or not phone_key.isdigit():
+            return None
+        index = bisect_right(self.starts, int(phone_key[:PREFIX_LENGTH])) - 1
+        if index < 0:
+            return None
+        return self.locations[self.location_ids[index]]
+
+
+@lru_cache(maxsize=None)
+def prefix_table():
+    """首次查询时加载号段表，之后在进程内复用"""
+    return PrefixTable.load()
+
+
+def locate_phone(phone):
+    """返回号码的 (省份, 城市)，未知返回 None"""
+    return prefix_table().lookup(normalize_phone(phone))
+
+
+def fill_locations(customers):
+    """按电话号段填写客户空的 province / city_auto（只修改内存中的对象），返回填写的客户数"""
+    table = prefix_table()
+    filled = 0
+    for customer in customers:
+        if customer.city_auto and customer.province:
+            continue
+        location = table.lookup(normalize_phone(customer.phone))
+        if location is None:
+            continue
+        province, city = location
+        if not customer.province:
+            customer.province = province
+        if not customer.city_auto:
+            customer.city_auto = city
+        filled += 1
+    return filled
@@ -0,0 +1,179 @@
+"""
+后台任务运行统计
+
+start_scheduler 通过 track_jobs 给每个任务记录实际开始时间，并注册 APScheduler 事件监听，每次运行记录：
+- 启动延迟：实际开始时间与计划时间之差，超过 SCHEDULER_LAG_ALERT_SECONDS 时记警告日志；
+- 耗时和是否出错；
+- 任务返回的计数：处理条数 items、企业微信发送成功/失败 webhook_ok / webhook_failed；
+- 错过执行（misfire）和上一次仍在运行而跳过的次数。
+
+每个任务在进程内保留最近 SCHEDULER_STATS_HISTORY 次记录。调度器只在一个 worker 中运行，
+每次记录后把汇总写入缓存（文件缓存，多个进程共享），管理员接口在任何 worker 上都能读到。
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+STATS_CACHE_KEY = 'crm:scheduler:stats'
+# 任务返回的计数（字典）中累计的项
+COUNTERS = ['items', 'webhook_ok', 'webhook_failed']
+
+# 进程内记录: {job_id: {...}}
+_jobs = {}
+# 运行中的任务: {job_id: (开始时间, perf_counter)}，同一任务同时只运行一个实例
+_running = {}
+_lock = threading.Lock()
+
+
+def timed_job(job_id, func):
+    """包装任务函数，记录实际开始时间"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with _lock:
+            _running[job_id] = (datetime.now(dt_timezone.utc), time.perf_counter())
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def _entry(job_id):
+    entry = _jobs.get(job_id)
+    if entry is None:
+        entry = _jobs[job_id] = {
+            'runs': 0,
+            'failures': 0,
+            'misfires': 0,
+            'skipped': 0,
+            **dict.fromkeys(COUNTERS, 0),
+            'recent': deque(maxlen=settings.SCHEDULER_STATS_HISTORY),
+        }
+    return entry
+
+
+def record_run(job_id, scheduled_at, counters=None, error=None):
+    """任务运行结束（成功或出错）时记录一次运行"""
+    with _lock:
+        started = _running.pop(job_id, None)
+    run = {'scheduled_at': scheduled_at.isoformat(), 'status': 'error' if error else 'ok'}
+    lag = None
+    if started is not None:
+        started_at, started_counter = started
+        lag = (started_at - scheduled_at).total_seconds()
+        run.update(
+            started_at=started_at.isoformat(),
+            lag_ms=round(lag * 1000, 1),
+            duration_ms=round((time.perf_counter() - started_counter) * 1000, 1),
+        )
+    counters = {name: int(counters.get(name, 0)) for name in COUNTERS} if isinstance(counters, dict) else {}
+    run.update(counters)
+    if error:
+        run['error'] = str(error)
+
+    with _lock:
+        entry = _entry(job_id)
+        entry['runs'] += 1
+        entry['failures'] += 1 if error else 0
+        for name, value in counters.items():
+            entry[name] += value
+        entry['recent'].append(run)
+
+    summary = ' '.join(f'{name} {value}' for name, value in counters.items() if value)
+    logger.info(
+        f"[任务监控] {job_id} {'失败' if error else '完成'}: 延迟 {run.get('lag_ms', '-')} ms, "
+        f"耗时 {run.get('duration_ms', '-')} ms{', ' + summary if summary else ''}"
+    )
+    if lag is not None and lag > settings.SCHEDULER_LAG_ALERT_SECONDS:
+        logger.warning(
+            f"[任务监控] {job_id} 启动延迟 {lag:.1f} 秒，超过 {settings.SCHEDULER_LAG_ALERT_SECONDS} 秒"
+            f"（计划 {timezone.localtime(scheduled_at):%Y-%m-%d %H:%M:%S}）"
+        )
+    publish_job_stats()
+
+
+def record_missed(job_id, scheduled_times, reason):
+    """记录未执行的计划：misfires（错过执行）或 skipped（上一次仍在运行）"""
+    with _lock:
+        entry = _entry(job_id)
+        entry[reason] += len(scheduled_times)
+        for scheduled_at in scheduled_times:
+            entry['recent'].append({'scheduled_at': scheduled_at.isoformat(), 'status': reason})
+    label = '错过执行' if reason == 'misfires' else '上一次仍在运行，跳过'
+    for scheduled_at in scheduled_times:
+        logger.warning(f"[任务监控] {job_id} {label}（计划 {timezone.localtime(scheduled_at):%Y-%m-%d %H:%M:%S}）")
+    publish_job_stats()
+
+
+def on_job_event(event):
+    """APScheduler 事件监听"""
+    from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED
+
+    if event.code == EVENT_JOB_EXECUTED:
+        record_run(event.job_id, event.scheduled_run_time, counters=event.retval)
+    elif event.code == EVENT_JOB_ERROR:
+        record_run(event.job_id, event.scheduled_run_time, error=event.exception)
+    elif event.code == EVENT_JOB_MISSED:
+        record_missed(event.job_id, [event.scheduled_run_time], 'misfires')
+    else:
+        record_missed(event.job_id, event.scheduled_run_times, 'skipped')
+
+
+def track_jobs(scheduler):
+    """给调度器中已添加的每个任务记录开始时间，并注册事件监听（在 scheduler.start() 之前调用）"""
+    from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+
+    for job in scheduler.get_jobs():
+        job.modify(func=timed_job(job.id, job.func))
+    scheduler.add_listener(
+        on_job_event, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES
+    )
+
+
+def get_job_stats():
+    """返回各任务的汇总统计（耗时、延迟按最近的记录计算，时间单位: 毫秒）"""
+    with _lock:
+        snapshot = {job_id: {**entry, 'recent': list(entry['recent'])} for job_id, entry in _jobs.items()}
+
+    rows = []
+    for job_id, entry in sorted(snapshot.items()):
+        recent = entry.pop('recent')
+        durations = [run['duration_ms'] for run in recent if 'duration_ms' in run]
+        lags = [run['lag_ms'] for run in recent if 'lag_ms' in run]
+        rows.append({
+            'job_id': job_id,
+            **entry,
+            'avg_duration_ms': round(sum(durations) / len(durations), 1) if durations else None,
+            'max_duration_ms': max(durations, default=None),
+            'avg_lag_ms': round(sum(lags) / len(lags), 1) if lags else None,
+            'max_lag_ms': max(lags, default=None),
+            'last_run': recent[-1] if recent else None,
+            'recent': recent,
+        })
+    return rows
+
+
+def publish_job_stats():
+    """把汇总写入缓存，供其他 worker 上的管理员接口读取"""
+    cache.set(STATS_CACHE_KEY, {'updated_at': timezone.now().isoformat(), 'jobs': get_job_stats()}, None)
+
+
+def cached_job_stats():
+    """读取调度器所在进程最近写入的汇总，调度器未运行过任务时为空"""
+    return cache.get(STATS_CACHE_KEY) or {'updated_at': None, 'jobs': []}
+
+
+def reset_job_stats():
+    """清空统计"""
+    with _lock:
+        _jobs.clear()
+        _running.clear()
+    cache.delete(STATS_CACHE_KEY)
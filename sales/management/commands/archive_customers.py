@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from sales.archive import ARCHIVE_AFTER_DAYS, BATCH_SIZE, archive_cold_customers, cold_customers
+
+
+class Command(BaseCommand):
+    help = '把长期未变化的已签约/无意向客户分批移到归档表（调度器每天04:00自动执行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=ARCHIVE_AFTER_DAYS,
+            help=f'超过多少天未变化的客户才归档（默认{ARCHIVE_AFTER_DAYS}）'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'每批归档的客户数量（默认{BATCH_SIZE}）'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='只统计可归档的客户数量，不实际移动'
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = cold_customers(options['days']).count()
+            self.stdout.write(f'可归档客户 {count} 个')
+            return
+
+        self.stdout.write(f'开始归档超过 {options["days"]} 天未变化的客户，每批 {options["batch_size"]} 个...')
+        archived = archive_cold_customers(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'完成！共归档 {archived} 个客户'))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from monsterabc_crm.sqlite import retry_on_locked
+from sales.models import CustomField, CustomFieldValue, Customer
+
+
+class Command(BaseCommand):
+    help = '根据extra_data分批回填自定义字段类型化取值表'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='每批处理的客户数量（默认1000）'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        
+        custom_fields = list(CustomField.objects.all())
+        if not custom_fields:
+            self.stdout.write('没有定义自定义字段，无需回填')
+            return
+        
+        self.stdout.write(f'开始回填自定义字段取值，共 {len(custom_fields)} 个字段，每批 {batch_size} 个客户...')
+        
+        # 按主键分段遍历，避免 OFFSET 在大表上越翻越慢
+        last_pk = 0
+        customer_count = 0
+        value_count = 0
+        while True:
+            batch = list(
+                Customer.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', 'extra_data')[:batch_size]
+            )
+            if not batch:
+                break
+            
+            sync_batch = retry_on_locked(transaction.atomic(CustomFieldValue.sync_customers))
+            value_count += sync_batch(batch, custom_fields=custom_fields)
+            
+            last_pk = batch[-1].pk
+            customer_count += len(batch)
+            self.stdout.write(f'  - 已处理 {customer_count} 个客户')
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'\n完成！共处理 {customer_count} 个客户，写入 {value_count} 条自定义字段取值'
+        ))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from monsterabc_crm.sqlite import retry_on_locked
+from sales.geo import fill_locations
+from sales.models import Customer
+
+
+class Command(BaseCommand):
+    help = '按电话号段分批回填客户空的省份和自动定位城市（离线号段表，不访问网络）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='每批处理的客户数量（默认1000）'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        missing = Customer.objects.filter(Q(city_auto='') | Q(province=''))
+
+        self.stdout.write(f'开始回填省份和城市，每批 {batch_size} 个客户...')
+
+        # 按主键分段遍历，避免 OFFSET 在大表上越翻越慢
+        last_pk = 0
+        scanned = 0
+        filled = 0
+        while True:
+            batch = list(
+                missing.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', 'phone', 'city_auto', 'province', 'sales_rep_id')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            scanned += len(batch)
+
+            changed = [customer for customer in batch if fill_locations([customer])]
+            if changed:
+                retry_on_locked(Customer.objects.bulk_update)(changed, ['city_auto', 'province'])
+            filled += len(changed)
+            self.stdout.write(f'  - 已处理 {scanned} 个客户，回填 {filled} 个')
+
+        self.stdout.write(self.style.SUCCESS(f'\n完成！共检查 {scanned} 个客户，回填 {filled} 个'))
@@ -0,0 +1,38 @@
+import os
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.backup import create_backup, prune_backups
+
+
+class Command(BaseCommand):
+    help = (
+        '在线备份数据库（SQLite 在线备份接口 / PostgreSQL pg_dump），压缩后保存到备份目录，'
+        '并删除超过保留天数的旧备份（调度器每天03:30自动执行）'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output-dir',
+            default=settings.BACKUP_DIR,
+            help=f'备份目录（默认{settings.BACKUP_DIR}）'
+        )
+        parser.add_argument(
+            '--retention-days',
+            type=int,
+            default=settings.BACKUP_RETENTION_DAYS,
+            help=f'保留最近多少天的备份（默认{settings.BACKUP_RETENTION_DAYS}，0表示不清理）'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            path = create_backup(options['output_dir'])
+        except (OSError, RuntimeError, sqlite3.Error) as e:
+            raise CommandError(f'备份失败: {e}')
+        self.stdout.write(self.style.SUCCESS(f'备份完成: {path} ({os.path.getsize(path) // 1024} KB)'))
+
+        if options['retention_days'] > 0:
+            for removed in prune_backups(options['output_dir'], options['retention_days']):
+                self.stdout.write(f'删除过期备份: {os.path.basename(removed)}')
@@ -0,0 +1,243 @@
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from sales.bulk import JOB_TIMEOUT, job_key
+from .loadtest_crm import create_session, error_text, percentile, response_summary
+
+
+# 两种部署方式的 gunicorn 参数（与 start.sh 一致）
+SERVERS = {
+    'wsgi': ['monsterabc_crm.wsgi:application'],
+    'asgi': ['-k', 'uvicorn_worker.UvicornWorker', 'monsterabc_crm.asgi:application'],
+}
+
+# 压测用的批量任务进度记录
+BENCHMARK_JOB_ID = 'benchmark'
+DEFAULT_PATHS = ['/api/pending-reminders/', f'/api/bulk-jobs/{BENCHMARK_JOB_ID}/']
+
+
+def parse_levels(value):
+    """解析并发连接数列表，如 "10,50,200" """
+    try:
+        levels = [int(level) for level in value.split(',') if level.strip()]
+    except ValueError:
+        raise CommandError(f'并发连接数格式错误: {value}')
+    if not levels or min(levels) < 1:
+        raise CommandError(f'并发连接数格式错误: {value}')
+    return levels
+
+
+def summarize(latencies, errors, elapsed):
+    """汇总一轮压测结果（latencies 单位: 毫秒）"""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) if latencies else 0.0,
+        'p95_ms': percentile(latencies, 95) if latencies else 0.0,
+        'max_ms': round(latencies[-1], 2) if latencies else 0.0,
+    }
+
+
+def run_clients(port, paths, cookie, concurrency, requests_per_client, timeout):
+    """
+    并发 concurrency 个保持连接的客户端，每个依次请求 requests_per_client 次（轮流使用 paths）
+
+    返回总体结果，以及每个URL单独的结果（如导出进行中时轮询接口的延迟），
+    其中包括各状态码的次数（异常记为 exception）和首个错误信息。
+    """
+    latencies = {path: [] for path in paths}
+    errors = dict.fromkeys(paths, 0)
+    statuses = {path: Counter() for path in paths}
+    first_errors = dict.fromkeys(paths, '')
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency + 1)
+
+    def client(index):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        barrier.wait()
+        for i in range(requests_per_client):
+            path = paths[(index + i) % len(paths)]
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path, headers={'Cookie': cookie})
+                response = conn.getresponse()
+                body = response.read()
+                status, error = response.status, ''
+                if status >= 400:
+                    error = f'HTTP {status}: {response_summary(body.decode("utf-8", "replace"))}'
+            except (OSError, http.client.HTTPException) as exc:
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+                status, error = 'exception', f'{type(exc).__name__}: {exc}'
+            with lock:
+                statuses[path][status] += 1
+                if error:
+                    errors[path] += 1
+                    first_errors[path] = first_errors[path] or error_text(error)
+                else:
+                    latencies[path].append((time.perf_counter() - started) * 1000)
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    def details(path):
+        counts = sorted(statuses[path].items(), key=lambda item: str(item[0]))
+        return {
+            'statuses': {str(status): count for status, count in counts},
+            'first_error': first_errors[path],
+        }
+
+    result = summarize([value for values in latencies.values() for value in values], sum(errors.values()), elapsed)
+    result['first_error'] = next((first_errors[path] for path in paths if first_errors[path]), '')
+    result['paths'] = {path: {**summarize(latencies[path], errors[path], elapsed), **details(path)} for path in paths}
+    return result
+
+
+def wait_until_ready(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+class Command(BaseCommand):
+    help = (
+        '分别以同步 worker（WSGI）和 uvicorn worker（ASGI）启动 gunicorn，'
+        '用不同并发连接数请求轮询类接口，对比吞吐量、延迟和失败数'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='压测的URL，可重复指定（默认待提醒和任务进度接口）')
+        parser.add_argument('--concurrency', default='10,50,200', help='并发连接数列表（默认10,50,200）')
+        parser.add_argument('--requests', type=int, default=10, help='每个连接的请求次数（默认10）')
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn 进程数（默认2）')
+        parser.add_argument('--servers', default='wsgi,asgi', help='对比的部署方式（默认wsgi,asgi）')
+        parser.add_argument('--port', type=int, default=8765, help='压测服务端口（默认8765）')
+        parser.add_argument('--timeout', type=float, default=30, help='单个请求超时秒数（默认30）')
+        parser.add_argument('--username', help='以该用户身份请求（默认第一个管理员）')
+        parser.add_argument('--output', help='结果JSON文件路径')
+
+    def handle(self, *args, **options):
+        servers = [name for name in options['servers'].split(',') if name]
+        unknown = set(servers) - set(SERVERS)
+        if unknown:
+            raise CommandError(f'未知的部署方式: {", ".join(sorted(unknown))}')
+        levels = parse_levels(options['concurrency'])
+        paths = options['paths'] or DEFAULT_PATHS
+
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+        else:
+            user = User.objects.filter(is_superuser=True, is_active=True).order_by('pk').first()
+        if user is None:
+            raise CommandError('找不到用于压测的用户，请先创建管理员或通过 --username 指定')
+
+        # 直接创建登录会话，压测请求带上会话cookie
+        session_key = create_session(user)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}'
+        cache.set(job_key(BENCHMARK_JOB_ID), {
+            'id': BENCHMARK_JOB_ID, 'action': 'update', 'user_id': user.pk, 'status': 'running',
+            'total': 0, 'processed': 0, 'affected': 0,
+            'started_at': timezone.now().isoformat(), 'finished_at': None, 'error': '',
+        }, JOB_TIMEOUT)
+
+        results = []
+        try:
+            for server in servers:
+                for result in self.benchmark_server(server, paths, cookie, levels, options):
+                    results.append(result)
+                    self.stdout.write(
+                        f"{server:<5} 并发 {result['concurrency']:>4}   {result['rps']:>8.1f} 请求/秒"
+                        f"   p50 {result['p50_ms']:>8.1f} ms   p95 {result['p95_ms']:>8.1f} ms"
+                        f"   最大 {result['max_ms']:>8.1f} ms   失败 {result['errors']}"
+                    )
+                    for path, path_result in result['paths'].items():
+                        statuses = ' '.join(f'{status}×{count}' for status, count in path_result['statuses'].items())
+                        self.stdout.write(
+                            f"      {path:<32} p50 {path_result['p50_ms']:>8.1f} ms"
+                            f"   p95 {path_result['p95_ms']:>8.1f} ms   失败 {path_result['errors']}   {statuses}"
+                        )
+                        if path_result['first_error']:
+                            self.stdout.write(self.style.ERROR(f"        首个错误: {path_result['first_error']}"))
+        finally:
+            import_module(settings.SESSION_ENGINE).SessionStore(session_key).delete()
+            cache.delete(job_key(BENCHMARK_JOB_ID))
+
+        if options['output']:
+            report = {
+                'generated_at': timezone.now().isoformat(),
+                'python': sys.version.split()[0],
+                'workers': options['workers'],
+                'requests_per_client': options['requests'],
+                'paths': paths,
+                'results': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'结果已写入 {options["output"]}'))
+
+    def benchmark_server(self, server, paths, cookie, levels, options):
+        """启动一种部署方式的 gunicorn，依次用各并发数压测后关闭"""
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE,
+            CRM_SERVER=server,
+            CRM_SCHEDULER='0',
+        )
+        command = [
+            sys.executable, '-m', 'gunicorn',
+            '--bind', f'127.0.0.1:{options["port"]}',
+            '--workers', str(options['workers']),
+            '--timeout', str(int(options['timeout']) + 30),
+            '--log-level', 'warning',
+            *SERVERS[server],
+        ]
+        with tempfile.TemporaryFile(mode='w+') as log:
+            process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, stdout=log, stderr=log)
+            try:
+                if not wait_until_ready(options['port'], process):
+                    log.seek(0)
+                    lines = log.read().strip().splitlines()
+                    raise CommandError(f'{server} 服务启动失败: {lines[-1] if lines else "端口未就绪"}')
+                # 预热：每个 worker 完成首次请求的初始化
+                run_clients(options['port'], paths, cookie, options['workers'], 2, options['timeout'])
+
+                for concurrency in levels:
+                    result = run_clients(
+                        options['port'], paths, cookie, concurrency, options['requests'], options['timeout']
+                    )
+                    yield {'server': server, 'concurrency': concurrency, **result}
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
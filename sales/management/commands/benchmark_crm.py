@@ -0,0 +1,174 @@
+import json
+import statistics
+import time
+from datetime import timedelta
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import Workbook
+
+from sales.models import Customer
+from sales.synthetic import ensure_reps, generate_customers
+from sales.tasks import recycle_unreachable_leads
+
+
+class Command(BaseCommand):
+    help = '在不同数据量下对CRM核心路径做基准测试，结果输出为JSON（会向当前数据库写入模拟数据）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10000, 100000, 1000000],
+            help='依次测试的客户总量（默认 10000 100000 1000000）'
+        )
+        parser.add_argument('--repeat', type=int, default=3, help='每项操作重复次数（默认3）')
+        parser.add_argument('--reps', type=int, default=20, help='模拟销售人数（默认20）')
+        parser.add_argument('--import-rows', type=int, default=1000, help='导入测试的Excel行数（默认1000）')
+        parser.add_argument('--skip', nargs='*', default=[], help='跳过的操作名称')
+        parser.add_argument('--output', help='结果JSON文件路径（默认只输出到终端）')
+        parser.add_argument('--noinput', action='store_true', help='不询问确认')
+
+    def handle(self, *args, **options):
+        if not options['noinput']:
+            db_name = connection.settings_dict['NAME']
+            answer = input(f'基准测试会向数据库 {db_name} 写入大量模拟数据，请确认使用的是独立的测试库 (y/N): ')
+            if answer.lower() != 'y':
+                raise CommandError('已取消')
+
+        reps = ensure_reps(options['reps'])
+        admin, _ = User.objects.get_or_create(
+            username='bench_admin',
+            defaults={'is_staff': True, 'is_superuser': True}
+        )
+
+        self.admin_client = Client()
+        self.admin_client.force_login(admin)
+        self.rep_client = Client()
+        self.rep_client.force_login(reps[0])
+        self.import_rows = options['import_rows']
+
+        results = []
+        for size in sorted(options['sizes']):
+            current = Customer.objects.count()
+            if current < size:
+                self.stdout.write(f'生成模拟数据: {current} -> {size} ...')
+                generate_customers(size - current, reps)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n数据量 {size}'))
+            for name, operation in self.operations():
+                if name in options['skip']:
+                    continue
+                result = self.measure(operation, options['repeat'])
+                result.update({'size': size, 'operation': name})
+                results.append(result)
+                self.stdout.write(
+                    f"  {name:<24} median {result['median_ms']:>10.1f} ms"
+                    f"   min {result['min_ms']:>10.1f} ms   queries {result['queries']}"
+                )
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'database': {
+                'vendor': connection.vendor,
+                'name': str(connection.settings_dict['NAME']),
+            },
+            'repeat': options['repeat'],
+            'results': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'\n结果已写入 {options["output"]}'))
+        else:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+
+    def measure(self, operation, repeat):
+        """重复执行一项操作，返回耗时统计和查询次数"""
+        timings = []
+        queries = 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                operation()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = len(ctx)
+        return {
+            'min_ms': round(min(timings), 2),
+            'median_ms': round(statistics.median(timings), 2),
+            'max_ms': round(max(timings), 2),
+            'queries': queries,
+        }
+
+    def operations(self):
+        """需要测试的核心路径"""
+        return [
+            ('my_customers_admin', lambda: self.get(self.admin_client, '/my-customers/')),
+            ('my_customers_rep', lambda: self.get(self.rep_client, '/my-customers/')),
+            ('my_customers_sorted', lambda: self.get(
+                self.rep_client, '/my-customers/?sort_by=next_contact_time&sort_order=desc'
+            )),
+            ('key_customers', lambda: self.get(self.rep_client, '/key-customers/')),
+            ('high_seas', lambda: self.get(self.admin_client, '/high-seas/')),
+            ('visited', lambda: self.get(self.admin_client, '/visited/')),
+            ('signed', lambda: self.get(self.admin_client, '/signed/')),
+            ('search_phone', lambda: self.get(self.admin_client, '/my-customers/?search=1380')),
+            ('search_name', lambda: self.get(self.admin_client, '/my-customers/?search=王')),
+            ('dashboard_admin', lambda: self.get(self.admin_client, '/dashboard/')),
+            ('dashboard_rep', lambda: self.get(self.rep_client, '/dashboard/')),
+            ('pending_reminders_api', lambda: self.get(self.rep_client, '/api/pending-reminders/')),
+            ('reminder_job_query', reminder_job_query),
+            ('recycle_job', lambda: rolled_back(recycle_unreachable_leads)),
+            ('import', lambda: rolled_back(self.run_import)),
+            ('export', lambda: self.get(self.admin_client, '/api/export/')),
+        ]
+
+    def get(self, client, url):
+        response = client.get(url)
+        if response.status_code >= 400:
+            raise CommandError(f'{url} 返回 {response.status_code}')
+        # 导出等流式响应需要读取完整内容才算完成
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+        return response
+
+    def run_import(self):
+        response = self.admin_client.post('/api/import/', {'excel_file': build_import_file(self.import_rows)})
+        if response.status_code >= 400:
+            raise CommandError(f'导入返回 {response.status_code}')
+
+
+def reminder_job_query():
+    """提醒任务的查询部分（不发送webhook）"""
+    now = timezone.now().replace(second=0, microsecond=0)
+    list(Customer.objects.filter(
+        next_contact_time__gte=now,
+        next_contact_time__lt=now + timedelta(minutes=1),
+        sales_rep__isnull=False
+    ).select_related('sales_rep'))
+
+
+def rolled_back(func):
+    """在事务中执行并回滚，保证重复测试时数据不变"""
+    with transaction.atomic():
+        func()
+        transaction.set_rollback(True)
+
+
+def build_import_file(rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['姓名', '电话', '状态', '负责人', '线索渠道', '自动定位城市', '手动填写地域'])
+    for i in range(rows):
+        ws.append([f'导入客户{i}', f'1999{i:07d}', '', '', '抖音', '北京', ''])
+    output = BytesIO()
+    wb.save(output)
+    return SimpleUploadedFile('benchmark.xlsx', output.getvalue())
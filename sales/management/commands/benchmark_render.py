@@ -0,0 +1,158 @@
+import json
+import os
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.template import Engine, RequestContext
+from django.test import RequestFactory
+from django.utils import timezone
+
+from sales.models import Customer
+
+
+TEMPLATE_NAME = 'my_customers.html'
+
+# 优化前每行使用的状态徽章写法，用于对比
+BADGE_CELL = '<span class="badge {{ customer.status_badge_class }}">{{ customer.status_label }}</span>'
+LEGACY_BADGE_CELL = """{% if customer.status == 'wait_contact' %}
+<span class="badge bg-info">{{ customer.get_status_display }}</span>
+{% elif customer.status == 'wait_followup' %}
+<span class="badge bg-warning text-dark">{{ customer.get_status_display }}</span>
+{% elif customer.status == 'wait_visit' %}
+<span class="badge bg-primary">{{ customer.get_status_display }}</span>
+{% elif customer.status == 'visited' %}
+<span class="badge bg-success">{{ customer.get_status_display }}</span>
+{% elif customer.status == 'signed' %}
+<span class="badge bg-dark">{{ customer.get_status_display }}</span>
+{% elif customer.status == 'no_intent' %}
+<span class="badge bg-secondary">{{ customer.get_status_display }}</span>
+{% elif customer.status == 'unreachable' %}
+<span class="badge bg-danger">{{ customer.get_status_display }}</span>
+{% else %}
+<span class="badge bg-secondary">{{ customer.get_status_display }}</span>
+{% endif %}"""
+
+APP_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
+
+class Command(BaseCommand):
+    help = '对比客户列表页（每页100行）在开发/生产配置、状态徽章两种写法下的模板渲染耗时，不访问数据库'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100, help='每页行数（默认100）')
+        parser.add_argument('--repeat', type=int, default=200, help='每种方式渲染次数（默认200）')
+        parser.add_argument('--output', help='结果JSON文件路径')
+
+    def handle(self, *args, **options):
+        context = build_context(options['rows'])
+        request = context.pop('request')
+        processors = settings.TEMPLATES[0]['OPTIONS']['context_processors']
+
+        def engine(debug, *dirs):
+            # 与原配置相同：Django 4.2 在 DEBUG 开启时同样使用缓存加载器，模板只从文件编译一次
+            loaders = [('django.template.loaders.filesystem.Loader', list(dirs))] if dirs else []
+            return Engine(
+                debug=debug,
+                loaders=[('django.template.loaders.cached.Loader', loaders + APP_LOADERS)],
+                context_processors=processors,
+            )
+
+        source = engine(False).find_template(TEMPLATE_NAME)[0].source
+        if BADGE_CELL not in source:
+            raise CommandError(f'{TEMPLATE_NAME} 中找不到状态徽章单元格，无法还原优化前的模板')
+
+        with tempfile.TemporaryDirectory() as legacy_dir:
+            # 优化前的模板（if/elif链）写成文件，和其他模板一样经缓存加载器加载
+            with open(os.path.join(legacy_dir, TEMPLATE_NAME), 'w', encoding='utf-8') as f:
+                f.write(source.replace(BADGE_CELL, LEGACY_BADGE_CELL))
+
+            scenarios = [
+                # 优化前：原开发配置（DEBUG开启）+ if/elif链
+                ('before: DEBUG on + if/elif', engine(True, legacy_dir)),
+                ('DEBUG off + if/elif', engine(False, legacy_dir)),
+                ('DEBUG on + badge mapping', engine(True)),
+                # 优化后：生产配置（DEBUG关闭）+ 状态徽章查表
+                ('after: DEBUG off + badge mapping', engine(False)),
+            ]
+
+            results = []
+            for name, scenario_engine in scenarios:
+                # 预热：首次加载时编译并缓存模板
+                scenario_engine.get_template(TEMPLATE_NAME)
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    scenario_engine.get_template(TEMPLATE_NAME).render(RequestContext(request, context))
+                    timings.append((time.perf_counter() - started) * 1000)
+                results.append({
+                    'scenario': name,
+                    'median_ms': round(statistics.median(timings), 3),
+                    'min_ms': round(min(timings), 3),
+                })
+
+        baseline = results[0]['median_ms']
+        self.stdout.write(f'渲染 {TEMPLATE_NAME}，每页 {options["rows"]} 行，各 {options["repeat"]} 次:')
+        for result in results:
+            result['speedup'] = round(baseline / result['median_ms'], 2)
+            self.stdout.write(
+                f"  {result['scenario']:<44} median {result['median_ms']:>8.2f} ms"
+                f"   min {result['min_ms']:>8.2f} ms   x{result['speedup']}"
+            )
+
+        if options['output']:
+            report = {
+                'generated_at': timezone.now().isoformat(),
+                'template': TEMPLATE_NAME,
+                'rows': options['rows'],
+                'repeat': options['repeat'],
+                'results': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'结果已写入 {options["output"]}'))
+
+
+def build_context(rows):
+    """构造与 my_customers_view 相同结构的上下文（内存对象，不写数据库）"""
+    now = timezone.now()
+    statuses = [value for value, _ in Customer.STATUS_CHOICES]
+    customers = [
+        Customer(
+            pk=i + 1,
+            name=f'客户{i}',
+            phone=f'139{i:08d}',
+            status=statuses[i % len(statuses)],
+            city_auto='北京',
+            contact_count=i % 5,
+            next_contact_time=now + timedelta(hours=i) if i % 2 else None,
+            last_contact_at=now,
+            created_at=now - timedelta(days=i),
+            notes='需要再次跟进' if i % 3 else '',
+        )
+        for i in range(rows * 10)
+    ]
+
+    user = User(pk=1, username='bench', is_superuser=True, is_staff=True)
+    request = RequestFactory().get('/my-customers/')
+    request.user = user
+
+    return {
+        'request': request,
+        'customers': Paginator(customers, rows).get_page(1),
+        'status_choices': Customer.STATUS_CHOICES,
+        'current_status': '',
+        'current_city': '',
+        'search_query': '',
+        'sort_by': '',
+        'sort_order': 'asc',
+        'all_users': [user],
+    }
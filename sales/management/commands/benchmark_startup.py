@@ -0,0 +1,117 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+# 每种启动方式在新的 Python 进程中执行的代码
+STARTUP_SCRIPTS = {
+    # gunicorn worker 启动：导入 WSGI 应用（django.setup + 中间件）
+    'web': 'import monsterabc_crm.wsgi',
+    # manage.py 命令执行前的初始化
+    'command': 'import django; django.setup()',
+}
+
+# 只在用到的代码路径中导入，启动时不应加载的模块
+LAZY_MODULES = ['apscheduler', 'requests']
+
+
+def parse_importtime(stderr):
+    """解析 python -X importtime 的输出，返回 {模块: (自身耗时us, 累计耗时us)}"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure(script):
+    """在新进程中执行一次启动代码，返回 (导入总耗时ms, 进程总耗时ms, 模块耗时)"""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE, CRM_SCHEDULER='0')
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise CommandError(f'启动失败: {result.stderr.strip().splitlines()[-1]}')
+    modules = parse_importtime(result.stderr)
+    return sum(self_us for self_us, _ in modules.values()) / 1000, wall_ms, modules
+
+
+class Command(BaseCommand):
+    help = '用 python -X importtime 测量 Web worker 和 manage.py 命令的冷启动导入耗时，超出预算时失败'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='每种启动方式测量次数，取中位数（默认5）')
+        parser.add_argument('--budget-ms', type=float, default=1000, help='导入耗时预算（毫秒，默认1000）')
+        parser.add_argument('--top', type=int, default=8, help='列出自身耗时最多的顶层包数量（默认8）')
+        parser.add_argument('--output', help='结果JSON文件路径')
+
+    def handle(self, *args, **options):
+        results = []
+        failures = []
+        for target, script in STARTUP_SCRIPTS.items():
+            import_times = []
+            wall_times = []
+            for _ in range(options['repeat']):
+                import_ms, wall_ms, modules = measure(script)
+                import_times.append(import_ms)
+                wall_times.append(wall_ms)
+
+            # 按顶层包汇总最后一次测量的自身耗时
+            packages = Counter()
+            for name, (self_us, _) in modules.items():
+                packages[name.split('.')[0]] += self_us
+            loaded_lazy = [name for name in LAZY_MODULES if name in modules]
+
+            result = {
+                'target': target,
+                'import_ms': round(statistics.median(import_times), 1),
+                'wall_ms': round(statistics.median(wall_times), 1),
+                'modules': len(modules),
+                'top_packages': [
+                    {'package': package, 'self_ms': round(self_us / 1000, 1)}
+                    for package, self_us in packages.most_common(options['top'])
+                ],
+                'lazy_modules_loaded': loaded_lazy,
+            }
+            results.append(result)
+
+            self.stdout.write(
+                f"{target:<8} 导入 {result['import_ms']:>7.1f} ms   进程 {result['wall_ms']:>7.1f} ms"
+                f"   模块 {result['modules']} 个"
+            )
+            for package in result['top_packages']:
+                self.stdout.write(f"    {package['package']:<24} {package['self_ms']:>7.1f} ms")
+
+            if result['import_ms'] > options['budget_ms']:
+                failures.append(f"{target} 导入耗时 {result['import_ms']} ms 超出预算 {options['budget_ms']} ms")
+            if loaded_lazy:
+                failures.append(f"{target} 启动时加载了应延迟导入的模块: {', '.join(loaded_lazy)}")
+
+        if options['output']:
+            report = {
+                'generated_at': timezone.now().isoformat(),
+                'python': sys.version.split()[0],
+                'repeat': options['repeat'],
+                'budget_ms': options['budget_ms'],
+                'results': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'结果已写入 {options["output"]}'))
+
+        if failures:
+            raise CommandError('；'.join(failures))
+        self.stdout.write(self.style.SUCCESS(f'启动耗时均在预算 {options["budget_ms"]} ms 以内'))
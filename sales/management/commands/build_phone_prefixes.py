@@ -0,0 +1,85 @@
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.forms import CustomerForm
+from sales.geo import DATA_FILE, PREFIX_LENGTH
+
+
+# 省份简称（长的在前，避免"内蒙古"被其他简称截断）
+PROVINCES = sorted((value for value, _ in CustomerForm.PROVINCE_CHOICES if value), key=len, reverse=True)
+PROVINCE_SUFFIXES = ('维吾尔自治区', '壮族自治区', '回族自治区', '特别行政区', '自治区', '省', '市')
+
+
+def split_location(location):
+    """'山东省济南市' -> ('山东', '济南')，直辖市 '北京市' -> ('北京', '北京')"""
+    for province in PROVINCES:
+        if location.startswith(province):
+            rest = location[len(province):]
+            for suffix in PROVINCE_SUFFIXES:
+                if rest.startswith(suffix):
+                    rest = rest[len(suffix):]
+                    break
+            city = rest[:-1] if rest.endswith('市') else rest
+            return province, city or province
+    return '', location
+
+
+class Command(BaseCommand):
+    help = '从 phonenumbers 的中文地理数据生成离线手机号段归属地文件（仅更新数据时需要，运行时不依赖 phonenumbers）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=str(DATA_FILE), help=f'输出文件（默认 {DATA_FILE}）')
+
+    def handle(self, *args, **options):
+        try:
+            from phonenumbers.geodata import GEOCODE_DATA
+        except ImportError:
+            raise CommandError('需要先安装 phonenumbers: pip install phonenumbers')
+
+        # 国家码86后的手机号段（1开头，3~7位），较长的号段优先
+        prefixes = sorted(
+            (key[2:], names['zh'])
+            for key, names in GEOCODE_DATA.items()
+            if key.startswith('861') and 3 <= len(key) - 2 <= PREFIX_LENGTH and 'zh' in names
+        )
+        prefixes.sort(key=lambda item: len(item[0]))
+
+        covered = {}
+        for prefix, location in prefixes:
+            start = int(prefix.ljust(PREFIX_LENGTH, '0'))
+            end = int(prefix.ljust(PREFIX_LENGTH, '9')) + 1
+            location = split_location(location)
+            for number in range(start, end):
+                covered[number] = location
+
+        # 地区编号从1开始，0表示未知（"天津"与"天津市"等写法合并为同一地区）
+        locations = {}
+        for location in sorted(set(covered.values())):
+            locations[location] = len(locations) + 1
+
+        # 相邻且地区相同的号段合并为一个区间，只记录区间起点
+        ranges = []
+        previous = None
+        for number in sorted(covered):
+            location_id = locations[covered[number]]
+            if previous is None or number != previous + 1:
+                if ranges and ranges[-1][1] != 0:
+                    ranges.append((previous + 1, 0))
+                ranges.append((number, location_id))
+            elif ranges[-1][1] != location_id:
+                ranges.append((number, location_id))
+            previous = number
+        ranges.append((previous + 1, 0))
+
+        with gzip.open(options['output'], 'wt', encoding='utf-8') as f:
+            f.write('# 手机号段归属地（由 build_phone_prefixes 命令根据 phonenumbers 地理数据生成，Apache-2.0）\n')
+            f.write('# L<TAB>地区编号<TAB>省份<TAB>城市；其余每行为 7位号段起点<TAB>地区编号，到下一行起点为止，0表示未知\n')
+            for (province, city), location_id in locations.items():
+                f.write(f'L\t{location_id}\t{province}\t{city}\n')
+            for start, location_id in ranges:
+                f.write(f'{start}\t{location_id}\n')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'已生成 {options["output"]}: {len(covered)} 个号段，{len(ranges)} 个区间，{len(locations)} 个地区'
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from sales.models import Customer
+from sales.phones import merge_duplicate_customers
+
+
+class Command(BaseCommand):
+    help = '按规范化后的电话号码分批合并重复客户（保留最早的记录，合并备注、联系次数、变更记录等）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='每批处理的客户数量（默认1000）'
+        )
+
+    def handle(self, *args, **options):
+        pending = Customer.objects.filter(phone_key__isnull=True).count()
+        if not pending:
+            self.stdout.write('没有待处理的客户，无需合并')
+            return
+
+        self.stdout.write(f'开始处理 {pending} 个未规范化电话的客户，每批 {options["batch_size"]} 个...')
+
+        def progress(last_pk, merged, keyed):
+            self.stdout.write(f'  - 已处理到客户ID {last_pk}，合并 {merged} 个重复客户')
+
+        merged, keyed = merge_duplicate_customers(options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'\n完成！合并删除 {merged} 个重复客户，{keyed} 个客户设置了规范化电话'
+        ))
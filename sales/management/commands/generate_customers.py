@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from sales.synthetic import ensure_reps, generate_customers
+
+
+class Command(BaseCommand):
+    help = '批量生成模拟客户数据（用于本地复现生产数据量）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help='生成的客户数量')
+        parser.add_argument(
+            '--reps',
+            type=int,
+            default=20,
+            help='模拟销售人数（默认20，账号为 bench_rep01...）'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='每批写入数量（默认5000）'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='随机种子，指定后可重复生成相同数据'
+        )
+
+    def handle(self, *args, **options):
+        count = options['count']
+        reps = ensure_reps(options['reps'])
+        
+        self.stdout.write(f'开始生成 {count} 个模拟客户，分配给 {len(reps)} 个销售...')
+        
+        created = generate_customers(
+            count,
+            reps,
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            progress=lambda done: self.stdout.write(f'  - 已写入 {done} 个客户'),
+        )
+        
+        self.stdout.write(self.style.SUCCESS(f'\n完成！共生成 {created} 个客户'))
@@ -0,0 +1,365 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from sales.models import Customer
+from sales.synthetic import ensure_reps
+
+
+# 各操作的权重（模拟销售日常使用的比例）
+ACTION_WEIGHTS = [
+    ('pending_reminders', 40),
+    ('my_customers_page', 25),
+    ('search', 10),
+    ('edit_customer', 15),
+    ('claim_high_seas', 10),
+]
+
+SEARCH_TERMS = ['王', '李', '张', '138', '139', '186', '陈', '刘']
+
+# 错误信息最多保留的字符数
+ERROR_TEXT_LENGTH = 200
+
+
+def route_name(url):
+    """URL 对应的路由名（如 customer_detail），无法解析时返回路径本身"""
+    path = url.split('?', 1)[0]
+    try:
+        return resolve(path).url_name or path
+    except Resolver404:
+        return path
+
+
+def error_text(text):
+    """压缩为单行并截断，用于报告中的首个错误信息"""
+    return ' '.join(str(text).split())[:ERROR_TEXT_LENGTH]
+
+
+def response_summary(body):
+    """错误响应正文的摘要：HTML 页面取标题（DEBUG 错误页标题即异常信息），否则取去掉标签后的文本"""
+    title = re.search(r'<title>(.*?)</title>', body, re.IGNORECASE | re.DOTALL)
+    return error_text(title.group(1) if title else strip_tags(body))
+
+
+class RouteRecorder:
+    """按路由名汇总每个请求的耗时、状态码和首个错误（多线程共享）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route, elapsed_ms, status=None, error=''):
+        """status 为 None 表示请求抛出异常，此时 error 为异常信息"""
+        with self.lock:
+            stats = self.routes.setdefault(route, {
+                'timings': [], 'statuses': Counter(), 'errors': 0, 'first_error': '',
+            })
+            stats['timings'].append(elapsed_ms)
+            stats['statuses'][status if status is not None else 'exception'] += 1
+            if status is None or status >= 400:
+                stats['errors'] += 1
+                if not stats['first_error']:
+                    stats['first_error'] = error_text(error or f'HTTP {status}')
+
+    def rows(self, wall):
+        """每个路由一行统计结果，按请求数从多到少排列"""
+        rows = []
+        for route, stats in self.routes.items():
+            timings = sorted(stats['timings'])
+            statuses = sorted(stats['statuses'].items(), key=lambda item: str(item[0]))
+            rows.append({
+                'route': route,
+                'requests': len(timings),
+                'errors': stats['errors'],
+                'statuses': {str(status): count for status, count in statuses},
+                'first_error': stats['first_error'],
+                'throughput_rps': round(len(timings) / wall, 2) if wall else 0.0,
+                'p50_ms': percentile(timings, 50),
+                'p95_ms': percentile(timings, 95),
+                'p99_ms': percentile(timings, 99),
+                'max_ms': round(timings[-1], 2),
+            })
+        rows.sort(key=lambda row: (-row['requests'], row['route']))
+        return rows
+
+
+def create_session(user):
+    """
+    直接写入登录会话（与 Client.force_login 相同的方式）
+
+    登录页有验证码，模拟销售无法走表单登录；会话写入同一个数据库后，
+    进程内客户端和真实HTTP请求都可以复用。
+    """
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore()
+    session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return session.session_key
+
+
+class Transport:
+    """发送请求并把每个请求的耗时、状态码和错误记录到 recorder，返回状态码（异常时为 None）"""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def request(self, method, url, data=None):
+        started = time.perf_counter()
+        status, error = None, ''
+        try:
+            status, body = self.send(method, url, data)
+            if status >= 400:
+                error = f'HTTP {status}: {response_summary(body)}'
+        except Exception as exc:
+            error = f'{type(exc).__name__}: {exc}'
+        self.recorder.record(route_name(url), (time.perf_counter() - started) * 1000, status, error)
+        return status
+
+    def get(self, url):
+        return self.request('GET', url)
+
+    def post(self, url, data):
+        return self.request('POST', url, data)
+
+    def send(self, method, url, data):
+        """返回 (状态码, 响应正文)"""
+        raise NotImplementedError
+
+
+class InProcessTransport(Transport):
+    """使用 Django 测试客户端在进程内发送请求"""
+
+    def __init__(self, recorder, session_key):
+        super().__init__(recorder)
+        self.client = Client()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+
+    def send(self, method, url, data):
+        if method == 'POST':
+            response = self.client.post(url, data)
+        else:
+            response = self.client.get(url)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, body.decode('utf-8', 'replace')
+
+    def close(self):
+        connection.close()
+
+
+class HttpTransport(Transport):
+    """通过真实HTTP请求访问运行中的服务（如 start.sh 启动的 gunicorn）"""
+
+    def __init__(self, recorder, session_key, base_url):
+        import requests
+
+        super().__init__(recorder)
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.session.cookies.set(settings.SESSION_COOKIE_NAME, session_key)
+
+    def send(self, method, url, data):
+        if method != 'POST':
+            response = self.session.get(self.base_url + url, allow_redirects=False, timeout=30)
+            return response.status_code, response.text
+
+        # 先访问页面拿到 csrftoken
+        if 'csrftoken' not in self.session.cookies:
+            self.get('/my-customers/')
+        headers = {
+            'X-CSRFToken': self.session.cookies.get('csrftoken', ''),
+            'Referer': self.base_url + url,
+        }
+        response = self.session.post(
+            self.base_url + url, data=data, headers=headers, allow_redirects=False, timeout=30
+        )
+        return response.status_code, response.text
+
+    def close(self):
+        self.session.close()
+
+
+class SimulatedRep:
+    """模拟单个销售的操作"""
+
+    def __init__(self, user, transport, customer_ids, pool_ids, rng):
+        self.user = user
+        self.transport = transport
+        self.customer_ids = customer_ids
+        self.pool_ids = pool_ids
+        self.rng = rng
+
+    def pending_reminders(self):
+        return self.transport.get('/api/pending-reminders/')
+
+    def my_customers_page(self):
+        pages = max(1, len(self.customer_ids) // 100)
+        return self.transport.get(f'/my-customers/?page={self.rng.randint(1, pages)}')
+
+    def search(self):
+        return self.transport.get(f'/my-customers/?search={self.rng.choice(SEARCH_TERMS)}')
+
+    def edit_customer(self):
+        if not self.customer_ids:
+            return self.pending_reminders()
+        pk = self.rng.choice(self.customer_ids)
+        status = self.transport.get(f'/customer/{pk}/')
+        if status != 200:
+            return status
+
+        customer = Customer.objects.filter(pk=pk).first()
+        if customer is None:
+            return 404
+        next_time = timezone.localtime() + timedelta(days=self.rng.randint(1, 14))
+        data = {
+            'name': customer.name,
+            'phone': customer.phone,
+            'status': self.rng.choice(['wait_followup', 'wait_visit', customer.status]),
+            'city_auto': customer.city_auto,
+            'region_manual': customer.region_manual,
+            'province': customer.province,
+            'sales_rep': self.user.pk,
+            'next_contact_time': next_time.strftime('%Y-%m-%dT%H:%M'),
+            'notes': customer.notes,
+            'extra_data': customer.extra_data.get('note', '') if isinstance(customer.extra_data, dict) else '',
+        }
+        if customer.is_key_customer:
+            data['is_key_customer'] = 'on'
+        return self.transport.post(f'/customer/{pk}/', data)
+
+    def claim_high_seas(self):
+        if not self.pool_ids:
+            return self.pending_reminders()
+        pk = self.pool_ids.pop()
+        return self.transport.post('/high-seas/', {'claim': '1', 'customer_ids': [pk]})
+
+
+class Command(BaseCommand):
+    help = '模拟多个销售并发操作，统计各路由的延迟分位数和吞吐量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='并发模拟的销售人数（默认10）')
+        parser.add_argument('--duration', type=int, default=30, help='压测时长，秒（默认30）')
+        parser.add_argument(
+            '--think-time',
+            type=float,
+            default=0.5,
+            help='每次操作之间的平均间隔，秒（默认0.5，设为0即不间断）'
+        )
+        parser.add_argument(
+            '--url',
+            help='压测运行中的服务，如 http://127.0.0.1:3000（需与本命令使用同一数据库）；不指定则进程内压测'
+        )
+        parser.add_argument('--seed', type=int, default=None, help='随机种子')
+        parser.add_argument('--output', help='结果JSON文件路径')
+
+    def handle(self, *args, **options):
+        reps = ensure_reps(options['users'])
+        if not Customer.objects.exists():
+            raise CommandError('数据库中没有客户，请先运行 generate_customers 生成模拟数据')
+
+        pool_ids = list(
+            Customer.objects.filter(sales_rep__isnull=True).values_list('pk', flat=True)[:options['users'] * 1000]
+        )
+        rng = random.Random(options['seed'])
+        rng.shuffle(pool_ids)
+
+        recorder = RouteRecorder()
+        simulated = []
+        for index, user in enumerate(reps):
+            session_key = create_session(user)
+            if options['url']:
+                transport = HttpTransport(recorder, session_key, options['url'])
+            else:
+                transport = InProcessTransport(recorder, session_key)
+            customer_ids = list(Customer.objects.filter(sales_rep=user).values_list('pk', flat=True)[:5000])
+            simulated.append(SimulatedRep(
+                user,
+                transport,
+                customer_ids,
+                pool_ids[index::len(reps)],
+                random.Random(rng.random()),
+            ))
+
+        mode = options['url'] or '进程内'
+        self.stdout.write(f'开始压测: {len(simulated)} 个销售并发, 时长 {options["duration"]} 秒, 目标 {mode}')
+
+        deadline = time.monotonic() + options['duration']
+        actions = [name for name, _ in ACTION_WEIGHTS]
+        weights = [weight for _, weight in ACTION_WEIGHTS]
+
+        def run(rep):
+            try:
+                while time.monotonic() < deadline:
+                    action = rep.rng.choices(actions, weights)[0]
+                    started = time.perf_counter()
+                    try:
+                        getattr(rep, action)()
+                    except Exception as exc:
+                        # 请求本身的异常已由 transport 按路由记录，这里是请求之外的失败（如读取客户数据）
+                        recorder.record(
+                            f'{action} (本地)', (time.perf_counter() - started) * 1000,
+                            error=f'{type(exc).__name__}: {exc}',
+                        )
+                    if options['think_time']:
+                        time.sleep(rep.rng.expovariate(1 / options['think_time']))
+            finally:
+                rep.transport.close()
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=run, args=(rep,)) for rep in simulated]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.monotonic() - started
+
+        rows = recorder.rows(wall)
+        total = sum(row['requests'] for row in rows)
+        self.stdout.write(f'\n{"路由":<20}{"请求数":>8}{"错误":>6}{"吞吐(req/s)":>13}{"p50":>10}{"p95":>10}{"p99":>10}  状态码')
+        for row in rows:
+            statuses = ' '.join(f'{status}×{count}' for status, count in row['statuses'].items())
+            self.stdout.write(
+                f"{row['route']:<22}{row['requests']:>8}{row['errors']:>6}{row['throughput_rps']:>13}"
+                f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}  {statuses}"
+            )
+            if row['first_error']:
+                self.stdout.write(self.style.ERROR(f"  首个错误: {row['first_error']}"))
+        self.stdout.write(self.style.SUCCESS(f'\n总计 {total} 个请求, 总吞吐 {total / wall:.2f} req/s'))
+
+        if options['output']:
+            report = {
+                'generated_at': timezone.now().isoformat(),
+                'target': mode,
+                'database': connection.vendor,
+                'users': len(simulated),
+                'duration_s': round(wall, 2),
+                'think_time_s': options['think_time'],
+                'total_requests': total,
+                'total_throughput_rps': round(total / wall, 2),
+                'routes': rows,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f'结果已写入 {options["output"]}')
+
+
+def percentile(sorted_values, pct):
+    """最近秩法计算分位数（输入需已排序）"""
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return round(sorted_values[rank], 2)
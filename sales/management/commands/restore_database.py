@@ -0,0 +1,45 @@
+import os
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.backup import restore_backup, verify_backup
+
+
+class Command(BaseCommand):
+    help = (
+        '从 backup_database 或备份接口生成的备份文件恢复数据库（整库替换）；'
+        '恢复前先完整检查备份，检查不通过不会修改数据库。恢复前请先停止 Web 服务'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('backup_file', help='备份文件路径（.sqlite3.gz 或 .pgdump）')
+        parser.add_argument('--check-only', action='store_true', help='只检查备份完整性，不恢复')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='不询问确认，直接恢复')
+
+    def handle(self, *args, **options):
+        path = options['backup_file']
+        if not os.path.isfile(path):
+            raise CommandError(f'备份文件不存在: {path}')
+
+        if options['check_only']:
+            try:
+                verify_backup(path)
+            except ValueError as e:
+                raise CommandError(f'备份检查失败: {e}')
+            self.stdout.write(self.style.SUCCESS(f'备份检查通过: {path}'))
+            return
+
+        if options['interactive']:
+            confirm = input(f'将用 {os.path.basename(path)} 替换当前数据库的全部数据，输入 yes 继续: ')
+            if confirm != 'yes':
+                raise CommandError('已取消恢复')
+
+        try:
+            restore_backup(path)
+        except ValueError as e:
+            raise CommandError(f'备份检查失败，数据库未修改: {e}')
+        except (OSError, RuntimeError, sqlite3.Error) as e:
+            raise CommandError(f'恢复失败: {e}')
+        self.stdout.write(self.style.SUCCESS(f'恢复完成: {path}'))
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0003_customer_is_key_customer_customer_notes_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomFieldValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value_text', models.CharField(blank=True, default='', max_length=255, verbose_name='文本值')),
+                ('value_number', models.DecimalField(blank=True, decimal_places=4, max_digits=20, null=True, verbose_name='数字值')),
+                ('value_date', models.DateField(blank=True, null=True, verbose_name='日期值')),
+                ('value_datetime', models.DateTimeField(blank=True, null=True, verbose_name='日期时间值')),
+                ('custom_field', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='values', to='sales.customfield', verbose_name='自定义字段')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='custom_values', to='sales.customer', verbose_name='客户')),
+            ],
+            options={
+                'verbose_name': '自定义字段取值',
+                'verbose_name_plural': '自定义字段取值',
+                'indexes': [models.Index(fields=['custom_field', 'value_number'], name='cfv_field_number_idx'), models.Index(fields=['custom_field', 'value_date'], name='cfv_field_date_idx'), models.Index(fields=['custom_field', 'value_datetime'], name='cfv_field_datetime_idx'), models.Index(fields=['custom_field', 'value_text'], name='cfv_field_text_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='customfieldvalue',
+            constraint=models.UniqueConstraint(fields=('customer', 'custom_field'), name='uniq_customer_custom_field'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0004_customfieldvalue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('status', '状态'), ('sales_rep', '负责人'), ('next_contact_time', '下次联系时间')], max_length=20, verbose_name='变更字段')),
+                ('old_value', models.CharField(blank=True, default='', max_length=64, verbose_name='原值')),
+                ('new_value', models.CharField(blank=True, default='', max_length=64, verbose_name='新值')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='发生时间')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='sales.customer', verbose_name='客户')),
+            ],
+            options={
+                'verbose_name': '客户变更记录',
+                'verbose_name_plural': '客户变更记录',
+                'indexes': [models.Index(fields=['customer', 'created_at'], name='cevent_customer_time_idx'), models.Index(fields=['created_at'], name='cevent_time_idx')],
+            },
+        ),
+    ]
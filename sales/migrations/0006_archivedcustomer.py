@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('sales', '0005_customerevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customerevent',
+            name='customer',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='events', to='sales.customer', verbose_name='客户'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedCustomer',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='客户ID')),
+                ('name', models.CharField(max_length=100, verbose_name='客户姓名')),
+                ('phone', models.CharField(db_index=True, max_length=20, verbose_name='电话号码')),
+                ('status', models.CharField(choices=[('wait_contact', '待沟通'), ('wait_followup', '待跟进'), ('wait_visit', '待到访'), ('visited', '已到访'), ('signed', '已签约'), ('no_intent', '无意向'), ('unreachable', '未接通')], max_length=20, verbose_name='状态')),
+                ('source', models.CharField(blank=True, max_length=100, verbose_name='线索来源')),
+                ('city_auto', models.CharField(blank=True, max_length=50, verbose_name='自动定位城市')),
+                ('region_manual', models.CharField(blank=True, max_length=100, verbose_name='手动填写地域')),
+                ('contact_count', models.PositiveIntegerField(default=0, verbose_name='联系次数')),
+                ('next_contact_time', models.DateTimeField(blank=True, null=True, verbose_name='下次联系时间')),
+                ('created_at', models.DateTimeField(verbose_name='创建时间')),
+                ('last_contact_at', models.DateTimeField(verbose_name='最后联系时间')),
+                ('is_key_customer', models.BooleanField(default=False, verbose_name='重点客户')),
+                ('notes', models.TextField(blank=True, default='', verbose_name='备注信息')),
+                ('province', models.CharField(blank=True, default='', max_length=50, verbose_name='省份')),
+                ('extra_data', models.JSONField(blank=True, default=dict, verbose_name='扩展数据')),
+                ('archived_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='归档时间')),
+                ('sales_rep', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_customers', to=settings.AUTH_USER_MODEL, verbose_name='销售代表')),
+            ],
+            options={
+                'verbose_name': '归档客户',
+                'verbose_name_plural': '归档客户',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,82 @@
+import re
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+# 迁移编写时 sales.phones.normalize_phone 的副本：历史迁移不引用应用代码，
+# 以后修改规范化规则不会改变这个迁移的结果
+_NON_DIGITS = re.compile(r'\D+')
+COUNTRY_PREFIXES = ('0086', '86')
+MOBILE_LENGTH = 11
+
+
+def normalize_phone(raw):
+    if raw is None:
+        return ''
+    if isinstance(raw, float) and raw.is_integer():
+        raw = int(raw)
+    digits = _NON_DIGITS.sub('', str(raw))
+    for prefix in COUNTRY_PREFIXES:
+        if (
+            len(digits) == len(prefix) + MOBILE_LENGTH
+            and digits.startswith(prefix)
+            and digits[len(prefix)] == '1'
+        ):
+            return digits[len(prefix):]
+    return digits[:20]
+
+
+def backfill_phone_keys(apps, schema_editor):
+    """
+    按主键顺序回填规范化号码
+
+    同一号码只有主键最小的客户写入 phone_key，其余重复客户保持为空，
+    之后由 dedupe_customers 命令合并。
+    """
+    for model_name, keep_first in (('Customer', True), ('ArchivedCustomer', False)):
+        model = apps.get_model('sales', model_name)
+        seen = set()
+        last_pk = 0
+        while True:
+            batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'phone')[:BATCH_SIZE])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            updated = []
+            for customer in batch:
+                key = normalize_phone(customer.phone)
+                if not key or (keep_first and key in seen):
+                    continue
+                seen.add(key)
+                customer.phone_key = key
+                updated.append(customer)
+            model.objects.bulk_update(updated, ['phone_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0006_archivedcustomer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='phone_key',
+            field=models.CharField(editable=False, max_length=20, null=True, verbose_name='规范化电话'),
+        ),
+        migrations.AddField(
+            model_name='archivedcustomer',
+            name='phone_key',
+            field=models.CharField(db_index=True, max_length=20, null=True, verbose_name='规范化电话'),
+        ),
+        migrations.RunPython(backfill_phone_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='customer',
+            name='phone_key',
+            field=models.CharField(editable=False, max_length=20, null=True, unique=True, verbose_name='规范化电话'),
+        ),
+    ]
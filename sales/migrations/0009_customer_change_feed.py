@@ -0,0 +1,48 @@
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def backfill_updated_at(apps, schema_editor):
+    """已有客户的修改时间取最后联系时间（此前每次保存都会更新）"""
+    for model_name in ('Customer', 'ArchivedCustomer'):
+        apps.get_model('sales', model_name).objects.update(updated_at=F('last_contact_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0008_customer_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='修改时间'),
+        ),
+        migrations.AddField(
+            model_name='archivedcustomer',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='修改时间'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['updated_at', 'id'], name='customer_updated_idx'),
+        ),
+        migrations.CreateModel(
+            name='CustomerTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customer_id', models.BigIntegerField(verbose_name='客户ID')),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='删除时间')),
+            ],
+            options={
+                'verbose_name': '客户删除记录',
+                'verbose_name_plural': '客户删除记录',
+                'indexes': [models.Index(fields=['deleted_at', 'id'], name='ctombstone_time_idx')],
+            },
+        ),
+    ]
@@ -1,6 +1,102 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from decimal import Decimal, InvalidOperation
+from datetime import date, timezone as dt_timezone
+
+from .caching import bump_generations
+from .phones import normalize_phone
+
+
+class CustomerQuerySet(models.QuerySet):
+    """批量写入时让受影响销售的列表页缓存失效"""
+    
+    def affected_sales_reps(self):
+        return set(self.order_by().values_list('sales_rep_id', flat=True).distinct())
+    
+    def update(self, **kwargs):
+        # 批量修改同样更新修改时间（auto_now 只在 save() 时生效），变更订阅据此增量同步
+        kwargs.setdefault('updated_at', timezone.now())
+        if 'phone' in kwargs and not hasattr(kwargs['phone'], 'resolve_expression'):
+            kwargs['phone_key'] = normalize_phone(kwargs['phone']) or None
+        # 状态、负责人、下次联系时间的修改需要先读出旧值，写入变更记录
+        tracked = CustomerEvent.tracked_updates(kwargs)
+        columns = ['sales_rep_id'] + [
+            CustomerEvent.TRACKED_COLUMNS[field] for field in tracked if field != 'sales_rep'
+        ]
+        with transaction.atomic(using=self.db):
+            if tracked:
+                before = list(self.order_by().values_list('pk', *columns))
+                owners = {row[1] for row in before}
+            else:
+                owners = self.affected_sales_reps()
+            # 修改 extra_data 时与 save() 一样同步自定义字段取值，先记下受影响的客户
+            custom_fields = list(CustomField.objects.all()) if 'extra_data' in kwargs else []
+            synced_pks = list(self.order_by().values_list('pk', flat=True)) if custom_fields else []
+            # 新负责人：普通取值直接记录，表达式（如 bulk_update 的 CASE）在修改后再查
+            new_owner_expression = False
+            for name in ('sales_rep', 'sales_rep_id'):
+                if name not in kwargs:
+                    continue
+                if hasattr(kwargs[name], 'resolve_expression'):
+                    new_owner_expression = True
+                else:
+                    owners.add(getattr(kwargs[name], 'pk', kwargs[name]))
+            
+            rows = super().update(**kwargs)
+            if new_owner_expression and rows:
+                owners |= self.affected_sales_reps()
+            
+            if tracked and rows:
+                now = timezone.now()
+                events = []
+                for pk, *values in before:
+                    old_values = dict(zip(columns, values))
+                    events.extend(CustomerEvent.changes(pk, {
+                        field: CustomerEvent.serialize(old_values[CustomerEvent.TRACKED_COLUMNS[field]])
+                        for field in tracked
+                    }, tracked, now))
+                CustomerEvent.objects.bulk_create(events, batch_size=1000)
+            
+            if synced_pks and rows:
+                self.sync_custom_field_values(synced_pks, kwargs['extra_data'], custom_fields)
+        if rows:
+            bump_generations(owners)
+        return rows
+    
+    update.alters_data = True
+    
+    def sync_custom_field_values(self, pks, extra_data, custom_fields, batch_size=1000):
+        """按批重建 update() 修改了 extra_data 的客户的类型化取值；表达式（如 bulk_update 的 CASE）修改后再查"""
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start + batch_size]
+            if hasattr(extra_data, 'resolve_expression'):
+                customers = list(Customer.objects.filter(pk__in=batch).only('pk', 'extra_data'))
+            else:
+                customers = [Customer(pk=pk, extra_data=extra_data) for pk in batch]
+            CustomFieldValue.sync_customers(customers, custom_fields=custom_fields)
+    
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            rows = list(self.order_by().values_list('pk', 'sales_rep_id'))
+            result = super().delete()
+            if result[0]:
+                CustomerTombstone.record([pk for pk, _ in rows])
+        if result[0]:
+            bump_generations({sales_rep_id for _, sales_rep_id in rows})
+        return result
+    
+    delete.alters_data = True
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.phone_key = normalize_phone(obj.phone) or None
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            bump_generations({obj.sales_rep_id for obj in objs})
+        return objs
 
 
 class Customer(models.Model):
@@ -16,9 +112,24 @@ class Customer(models.Model):
         ('unreachable', '未接通'),
     ]
     
+    # 状态 -> 显示名称 / 徽章样式，列表页每行直接查表，代替模板中的 if/elif 链
+    STATUS_LABELS = dict(STATUS_CHOICES)
+    STATUS_BADGE_CLASSES = {
+        'wait_contact': 'bg-info',
+        'wait_followup': 'bg-warning text-dark',
+        'wait_visit': 'bg-primary',
+        'visited': 'bg-success',
+        'signed': 'bg-dark',
+        'no_intent': 'bg-secondary',
+        'unreachable': 'bg-danger',
+    }
+    
     # 基础字段
-    name = models.CharField('客户姓名', max_length=100)
+    # 后台按姓名前缀搜索（PostgreSQL 上同时建有 LIKE 前缀匹配可用的索引）
+    name = models.CharField('客户姓名', max_length=100, db_index=True)
     phone = models.CharField('电话号码', max_length=20, unique=True)
+    # 规范化后的号码（见 phones.normalize_phone），保存时自动生成，用于去重
+    phone_key = models.CharField('规范化电话', max_length=20, unique=True, null=True, editable=False)
     
     # 销售关系(None=公海, 非None=私海)
     sales_rep = models.ForeignKey(
@@ -45,6 +156,8 @@ class Customer(models.Model):
     # 时间戳(使用default=timezone.now允许导入历史时间)
     created_at = models.DateTimeField('创建时间', default=timezone.now)
     last_contact_at = models.DateTimeField('最后联系时间', auto_now=True)
+    # 修改时间：任何写入（含批量修改）都会更新，用于变更订阅（见 changefeed.py）
+    updated_at = models.DateTimeField('修改时间', auto_now=True)
     
     # 重点客户标记
     is_key_customer = models.BooleanField('重点客户', default=False)
@@ -58,16 +171,32 @@ class Customer(models.Model):
     # 扩展字段(支持自定义字段)
     extra_data = models.JSONField('扩展数据', default=dict, blank=True)
     
+    objects = CustomerQuerySet.as_manager()
+    
     class Meta:
         verbose_name = '客户'
         verbose_name_plural = '客户'
         ordering = ['-created_at']
+        indexes = [
+            # 列表页和后台的默认排序（-created_at, -id），倒序扫描索引即可分页，不必全表排序
+            models.Index(fields=['created_at', 'id'], name='customer_created_idx'),
+            # 变更订阅按 (修改时间, id) 从游标位置顺序读取
+            models.Index(fields=['updated_at', 'id'], name='customer_updated_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         """
         保存客户信息，自动增加沟通次数
         当 next_contact_time 被修改时，contact_count 自动加 1
         """
+        self.phone_key = normalize_phone(self.phone) or None
+        
+        # 新建客户只有带扩展数据时才需要同步自定义字段取值
+        extra_data_changed = bool(self.extra_data)
+        # 变更前后的负责人，用于让列表页缓存失效
+        owners = {self.sales_rep_id}
+        events = []
+        
         # 如果是更新操作（已有 pk）
         if self.pk:
             try:
@@ -81,17 +210,68 @@ class Customer(models.Model):
                 # 如果时间被修改了（不同的值，且新值不为 None）
                 if old_time != new_time and new_time is not None:
                     self.contact_count += 1
+                
+                extra_data_changed = old_instance.extra_data != self.extra_data
+                owners.add(old_instance.sales_rep_id)
+                
+                # 规范化前遗留的重复客户（phone_key 为空）号码仍被其他客户占用时保持为空，
+                # 由 dedupe_customers 合并，否则保存会违反唯一约束
+                if (
+                    old_instance.phone_key is None
+                    and self.phone_key
+                    and Customer.objects.filter(phone_key=self.phone_key).exclude(pk=self.pk).exists()
+                ):
+                    self.phone_key = None
+                events = CustomerEvent.changes(
+                    self.pk, CustomerEvent.values_of(old_instance), CustomerEvent.values_of(self)
+                )
             except Customer.DoesNotExist:
                 # 如果旧实例不存在，不做处理
                 pass
         
         # 调用父类的 save 方法
         super().save(*args, **kwargs)
+        
+        # extra_data 变化时同步写入类型化取值表
+        if extra_data_changed:
+            CustomFieldValue.sync_customers([self])
+        
+        # 状态、负责人、下次联系时间的变更记录（一条批量插入）
+        if events:
+            CustomerEvent.objects.bulk_create(events)
+        
+        bump_generations(owners)
+    
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            CustomerTombstone.record([pk])
+        bump_generations({self.sales_rep_id})
+        return result
+    
+    @property
+    def status_label(self):
+        return self.STATUS_LABELS.get(self.status, self.status)
+    
+    @property
+    def status_badge_class(self):
+        return self.STATUS_BADGE_CLASSES.get(self.status, 'bg-secondary')
     
     def __str__(self):
         return f"{self.name} ({self.phone})"
 
 
+def release_customers(sender, instance, **kwargs):
+    """
+    删除用户前把其客户退回公海（pre_delete 信号，覆盖后台删除用户等所有途径）
+
+    外键的 SET_NULL 直接改表，不经过 CustomerQuerySet.update，
+    负责人变更记录、修改时间（变更订阅）和列表页缓存都不会更新。
+    """
+    Customer.objects.filter(sales_rep_id=instance.pk).update(sales_rep=None)
+
+
 class CustomField(models.Model):
     """自定义字段定义模型"""
     
@@ -138,3 +318,336 @@ class CustomField(models.Model):
     def __str__(self):
         return f"{self.label} ({self.field_name})"
 
+
+
+class CustomFieldValue(models.Model):
+    """
+    自定义字段类型化取值（EAV索引表）
+    
+    与 Customer.extra_data 同步写入，数字/日期按真实类型存储，
+    用于自定义字段的范围筛选和排序，例如:
+    Customer.objects.filter(custom_values__custom_field__field_name='custom_budget',
+                            custom_values__value_number__gte=100000)
+    """
+    
+    # 数字值保留4位小数，整数部分最多15位：列精度 max_digits=20 允许16位，
+    # 但 SQLite 按浮点数存储，读出时只有15位有效数字，16位整数会被舍入成超出列精度的值
+    NUMBER_DECIMAL_PLACES = 4
+    NUMBER_INTEGER_DIGITS = 15
+    NUMBER_LIMIT = Decimal(10) ** NUMBER_INTEGER_DIGITS
+    
+    # 字段类型 -> 取值列
+    VALUE_COLUMNS = {
+        'number': 'value_number',
+        'date': 'value_date',
+        'datetime': 'value_datetime',
+    }
+    
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        verbose_name='客户',
+        related_name='custom_values'
+    )
+    custom_field = models.ForeignKey(
+        CustomField,
+        on_delete=models.CASCADE,
+        verbose_name='自定义字段',
+        related_name='values'
+    )
+    
+    # 类型化取值（文本列始终写入，便于排序和前缀匹配）
+    value_text = models.CharField('文本值', max_length=255, blank=True, default='')
+    value_number = models.DecimalField('数字值', max_digits=20, decimal_places=4, null=True, blank=True)
+    value_date = models.DateField('日期值', null=True, blank=True)
+    value_datetime = models.DateTimeField('日期时间值', null=True, blank=True)
+    
+    class Meta:
+        verbose_name = '自定义字段取值'
+        verbose_name_plural = '自定义字段取值'
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'custom_field'], name='uniq_customer_custom_field'),
+        ]
+        indexes = [
+            models.Index(fields=['custom_field', 'value_number'], name='cfv_field_number_idx'),
+            models.Index(fields=['custom_field', 'value_date'], name='cfv_field_date_idx'),
+            models.Index(fields=['custom_field', 'value_datetime'], name='cfv_field_datetime_idx'),
+            models.Index(fields=['custom_field', 'value_text'], name='cfv_field_text_idx'),
+        ]
+    
+    @classmethod
+    def value_column(cls, field_type):
+        """返回字段类型对应的取值列名，用于筛选和排序"""
+        return cls.VALUE_COLUMNS.get(field_type, 'value_text')
+    
+    @classmethod
+    def parse_number(cls, text):
+        """解析数字值并按列精度舍入；无法解析、NaN/Infinity 和超出15位整数的值返回 None（只保留文本值）"""
+        try:
+            number = Decimal(text.strip())
+            if not number.is_finite():
+                return None
+            number = number.quantize(Decimal(1).scaleb(-cls.NUMBER_DECIMAL_PLACES))
+        except InvalidOperation:
+            return None
+        return number if abs(number) < cls.NUMBER_LIMIT else None
+    
+    @classmethod
+    def from_raw(cls, customer, custom_field, raw):
+        """把 extra_data 中的原始值转换为类型化取值，空值返回 None"""
+        if raw is None or raw == '' or raw == []:
+            return None
+        
+        if isinstance(raw, list):
+            text = ','.join(str(item) for item in raw)
+        else:
+            text = str(raw)
+        
+        value = cls(customer=customer, custom_field=custom_field, value_text=text[:255])
+        
+        if custom_field.field_type == 'number':
+            value.value_number = cls.parse_number(text)
+        elif custom_field.field_type == 'date':
+            try:
+                value.value_date = date.fromisoformat(text.strip()[:10])
+            except ValueError:
+                pass
+        elif custom_field.field_type == 'datetime':
+            try:
+                parsed = parse_datetime(text.strip())
+            except ValueError:
+                parsed = None
+            if parsed is not None and timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed)
+            value.value_datetime = parsed
+        
+        return value
+    
+    @classmethod
+    def sync_customers(cls, customers, custom_fields=None):
+        """
+        根据 extra_data 重建一批客户的类型化取值
+        
+        先删除这些客户的旧取值，再一次性 bulk_create，
+        custom_fields 可由调用方传入以避免批量处理时重复查询。
+        """
+        customers = [customer for customer in customers if customer.pk]
+        if not customers:
+            return 0
+        
+        if custom_fields is None:
+            custom_fields = list(CustomField.objects.all())
+        if not custom_fields:
+            return 0
+        
+        values = []
+        for customer in customers:
+            extra_data = customer.extra_data if isinstance(customer.extra_data, dict) else {}
+            for custom_field in custom_fields:
+                value = cls.from_raw(customer, custom_field, extra_data.get(custom_field.field_name))
+                if value is not None:
+                    values.append(value)
+        
+        cls.objects.filter(customer__in=[customer.pk for customer in customers]).delete()
+        cls.objects.bulk_create(values)
+        return len(values)
+    
+    def __str__(self):
+        return f"{self.customer_id} - {self.custom_field_id}: {self.value_text}"
+
+
+class CustomerEvent(models.Model):
+    """
+    客户变更事件（只追加，不修改）
+    
+    状态、负责人、下次联系时间变化时各记录一条，包括 Customer.save() 和
+    Customer.objects.update() 批量修改。客户的初始状态从 created_at 开始计算，不单独记录。
+    按 (客户, 时间) 索引用于客户详情页的时间线，按时间索引用于统计分析的范围扫描。
+    """
+    
+    FIELD_CHOICES = [
+        ('status', '状态'),
+        ('sales_rep', '负责人'),
+        ('next_contact_time', '下次联系时间'),
+    ]
+    
+    # 记录的字段 -> 对应的数据库列
+    TRACKED_COLUMNS = {
+        'status': 'status',
+        'sales_rep': 'sales_rep_id',
+        'next_contact_time': 'next_contact_time',
+    }
+    
+    # 不建数据库外键约束：客户归档（移出主表）后变更记录仍然保留，删除客户时仍由 Django 级联删除
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        verbose_name='客户',
+        related_name='events'
+    )
+    field = models.CharField('变更字段', max_length=20, choices=FIELD_CHOICES)
+    old_value = models.CharField('原值', max_length=64, blank=True, default='')
+    new_value = models.CharField('新值', max_length=64, blank=True, default='')
+    created_at = models.DateTimeField('发生时间', default=timezone.now)
+    
+    class Meta:
+        verbose_name = '客户变更记录'
+        verbose_name_plural = '客户变更记录'
+        indexes = [
+            models.Index(fields=['customer', 'created_at'], name='cevent_customer_time_idx'),
+            models.Index(fields=['created_at'], name='cevent_time_idx'),
+        ]
+    
+    @staticmethod
+    def serialize(value):
+        """把字段值转换为存储的字符串（空值为空字符串）"""
+        if value is None:
+            return ''
+        if isinstance(value, models.Model):
+            return str(value.pk)
+        if hasattr(value, 'isoformat'):
+            # 带时区的时间统一存为UTC，避免同一时刻因时区不同被记为变更
+            if getattr(value, 'tzinfo', None) is not None:
+                value = value.astimezone(dt_timezone.utc)
+            return value.isoformat()
+        return str(value)
+    
+    @classmethod
+    def tracked_updates(cls, kwargs):
+        """从 update() 参数中取出需要记录的字段: {字段: 新值字符串}，表达式不记录"""
+        tracked = {}
+        for name, value in kwargs.items():
+            field = 'sales_rep' if name == 'sales_rep_id' else name
+            if field in cls.TRACKED_COLUMNS and not hasattr(value, 'resolve_expression'):
+                tracked[field] = cls.serialize(value)
+        return tracked
+    
+    @classmethod
+    def changes(cls, customer_id, old_values, new_values, at=None):
+        """比较修改前后的值（{字段: 字符串}），返回未保存的事件列表"""
+        at = at or timezone.now()
+        return [
+            cls(customer_id=customer_id, field=field, old_value=old_values[field], new_value=new_value, created_at=at)
+            for field, new_value in new_values.items()
+            if old_values[field] != new_value
+        ]
+    
+    @classmethod
+    def values_of(cls, customer):
+        return {
+            field: cls.serialize(getattr(customer, column))
+            for field, column in cls.TRACKED_COLUMNS.items()
+        }
+    
+    @classmethod
+    def timeline(cls, customer, limit=50):
+        """客户最近的变更记录（新的在前），附带用于显示的 old_display / new_display"""
+        events = list(cls.objects.filter(customer=customer).order_by('-created_at', '-id')[:limit])
+        
+        rep_ids = {
+            int(value) for event in events if event.field == 'sales_rep'
+            for value in (event.old_value, event.new_value) if value
+        }
+        usernames = dict(User.objects.filter(pk__in=rep_ids).values_list('pk', 'username')) if rep_ids else {}
+        
+        for event in events:
+            event.old_display = event.display(event.old_value, usernames)
+            event.new_display = event.display(event.new_value, usernames)
+        return events
+    
+    def display(self, value, usernames):
+        if self.field == 'status':
+            return Customer.STATUS_LABELS.get(value, value or '-')
+        if self.field == 'sales_rep':
+            return usernames.get(int(value), '已删除用户') if value else '公海'
+        if not value:
+            return '-'
+        return timezone.localtime(parse_datetime(value)).strftime('%Y-%m-%d %H:%M')
+    
+    def __str__(self):
+        return f"{self.customer_id} {self.field}: {self.old_value} -> {self.new_value}"
+
+
+class ArchivedCustomer(models.Model):
+    """
+    归档客户（冷数据）
+    
+    已签约/无意向且长期没有变化的客户从 Customer 表移到这里，字段与 Customer 保持一致，
+    并保留原客户ID，客户详情页、搜索和导出在主表中找不到时继续查这张表。
+    """
+    
+    # 原 Customer 的主键
+    id = models.BigIntegerField('客户ID', primary_key=True)
+    
+    name = models.CharField('客户姓名', max_length=100)
+    phone = models.CharField('电话号码', max_length=20, db_index=True)
+    phone_key = models.CharField('规范化电话', max_length=20, null=True, db_index=True)
+    sales_rep = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='销售代表',
+        related_name='archived_customers'
+    )
+    status = models.CharField('状态', max_length=20, choices=Customer.STATUS_CHOICES)
+    source = models.CharField('线索来源', max_length=100, blank=True)
+    city_auto = models.CharField('自动定位城市', max_length=50, blank=True)
+    region_manual = models.CharField('手动填写地域', max_length=100, blank=True)
+    contact_count = models.PositiveIntegerField('联系次数', default=0)
+    next_contact_time = models.DateTimeField('下次联系时间', null=True, blank=True)
+    created_at = models.DateTimeField('创建时间')
+    # 归档时原样保留，不自动更新
+    last_contact_at = models.DateTimeField('最后联系时间')
+    updated_at = models.DateTimeField('修改时间')
+    is_key_customer = models.BooleanField('重点客户', default=False)
+    notes = models.TextField('备注信息', blank=True, default='')
+    province = models.CharField('省份', max_length=50, blank=True, default='')
+    extra_data = models.JSONField('扩展数据', default=dict, blank=True)
+    
+    archived_at = models.DateTimeField('归档时间', default=timezone.now, db_index=True)
+    
+    class Meta:
+        verbose_name = '归档客户'
+        verbose_name_plural = '归档客户'
+        ordering = ['-created_at']
+    
+    @staticmethod
+    def customer_columns():
+        """Customer 表的全部列（含 id、sales_rep_id），归档和恢复时逐列复制"""
+        return [field.attname for field in Customer._meta.concrete_fields]
+    
+    def to_customer(self):
+        """转换为未保存的 Customer 实例（保留原ID）"""
+        return Customer(**{column: getattr(self, column) for column in self.customer_columns()})
+    
+    def __str__(self):
+        return f"{self.name} ({self.phone}) [已归档]"
+
+
+class CustomerTombstone(models.Model):
+    """
+    客户删除记录（只追加）
+    
+    变更订阅据此通知下游删除客户。归档只是把客户移到归档表，不写删除记录；
+    合并重复客户时被删除的客户会写入。
+    """
+    
+    customer_id = models.BigIntegerField('客户ID')
+    deleted_at = models.DateTimeField('删除时间', default=timezone.now)
+    
+    class Meta:
+        verbose_name = '客户删除记录'
+        verbose_name_plural = '客户删除记录'
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='ctombstone_time_idx'),
+        ]
+    
+    @classmethod
+    def record(cls, customer_ids):
+        now = timezone.now()
+        cls.objects.bulk_create([cls(customer_id=pk, deleted_at=now) for pk in customer_ids], batch_size=1000)
+    
+    def __str__(self):
+        return f"{self.customer_id} 删除于 {self.deleted_at}"
@@ -0,0 +1,200 @@
+"""
+电话号码规范化与去重
+
+Customer.phone 保存录入时的原始号码，Customer.phone_key 保存规范化后的号码（唯一索引）：
+只保留数字，去掉中国手机号前的 +86 / 0086 / 86 国家码，
+"+86 138-0000-0000"、"13800000000"、"138 0000 0000" 都规范化为 13800000000。
+
+所有导入途径（批量添加、Excel导入、后台导入）都先整批规范化号码，再用一条查询找出已存在的号码，
+不再逐行查询。历史数据中的重复客户由 dedupe_customers 命令分批合并。
+"""
+
+import re
+
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+from django.utils import timezone
+
+from monsterabc_crm.sqlite import retry_on_locked
+
+
+_NON_DIGITS = re.compile(r'\D+')
+
+# 国家码前缀（长的在前）
+COUNTRY_PREFIXES = ('0086', '86')
+MOBILE_LENGTH = 11
+
+# SQLite 单条语句的参数个数有限，IN 查询按此分段
+LOOKUP_BATCH_SIZE = 500
+
+
+def normalize_phone(raw):
+    """返回规范化后的号码，无法识别时返回空字符串"""
+    if raw is None:
+        return ''
+    # Excel 中的纯数字号码可能被读成浮点数
+    if isinstance(raw, float) and raw.is_integer():
+        raw = int(raw)
+    digits = _NON_DIGITS.sub('', str(raw))
+    for prefix in COUNTRY_PREFIXES:
+        if (
+            len(digits) == len(prefix) + MOBILE_LENGTH
+            and digits.startswith(prefix)
+            and digits[len(prefix)] == '1'
+        ):
+            return digits[len(prefix):]
+    return digits[:20]
+
+
+def normalize_phones(values):
+    """整批规范化号码，返回与输入顺序一致的列表"""
+    return [normalize_phone(value) for value in values]
+
+
+def existing_customers(keys):
+    """按规范化号码查出已存在的客户: {phone_key: Customer}"""
+    from .models import Customer
+
+    keys = list({key for key in keys if key})
+    customers = {}
+    for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+        customers.update(
+            Customer.objects.in_bulk(keys[start:start + LOOKUP_BATCH_SIZE], field_name='phone_key')
+        )
+    return customers
+
+
+def archived_phone_keys(keys):
+    """按规范化号码查出已归档客户使用的号码（集合）；归档客户恢复时保留原号码，新客户不能再使用"""
+    from .models import ArchivedCustomer
+
+    keys = list({key for key in keys if key})
+    archived = set()
+    for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+        archived.update(
+            ArchivedCustomer.objects.filter(phone_key__in=keys[start:start + LOOKUP_BATCH_SIZE]).order_by()
+            .values_list('phone_key', flat=True)
+        )
+    return archived
+
+
+def new_phone_keys(phones):
+    """
+    整批去重：返回与 phones 顺序一致的规范化号码列表，
+    空号码、批内重复、数据库中（含归档表）已存在的号码对应 None（应跳过）
+    """
+    keys = normalize_phones(phones)
+    existing = set(existing_customers(keys)) | archived_phone_keys(keys)
+    result = []
+    for key in keys:
+        if not key or key in existing:
+            result.append(None)
+        else:
+            existing.add(key)
+            result.append(key)
+    return result
+
+
+# 合并重复客户时，保留记录为空则使用重复记录的值
+FILL_BLANK_FIELDS = ['source', 'city_auto', 'region_manual', 'province']
+MERGE_FIELDS = FILL_BLANK_FIELDS + [
+    'phone_key', 'sales_rep', 'notes', 'contact_count', 'next_contact_time',
+    'is_key_customer', 'created_at', 'extra_data',
+]
+
+
+def merge_into(keeper, duplicate):
+    """把重复客户的信息合并到保留的客户（只修改内存中的对象）"""
+    for field in FILL_BLANK_FIELDS:
+        if not getattr(keeper, field):
+            setattr(keeper, field, getattr(duplicate, field))
+    if keeper.sales_rep_id is None:
+        keeper.sales_rep_id = duplicate.sales_rep_id
+    if keeper.next_contact_time is None:
+        keeper.next_contact_time = duplicate.next_contact_time
+    if duplicate.notes and duplicate.notes not in keeper.notes:
+        keeper.notes = '\n'.join(note for note in (keeper.notes, duplicate.notes) if note)
+    keeper.contact_count += duplicate.contact_count
+    keeper.is_key_customer = keeper.is_key_customer or duplicate.is_key_customer
+    keeper.created_at = min(keeper.created_at, duplicate.created_at)
+    # 扩展数据以保留记录为准，缺少的键从重复记录补充
+    keeper.extra_data = {**(duplicate.extra_data or {}), **(keeper.extra_data or {})}
+
+
+@transaction.atomic
+def merge_batch(candidates):
+    """
+    合并一批没有规范化号码的客户（按主键顺序），返回 (合并删除的数量, 新设置号码的数量)
+
+    号码已被其他客户占用的合并到该客户，否则这条客户成为该号码的保留记录。
+    保留记录的负责人、下次联系时间因合并变化时写入变更记录，并让相关销售的列表页缓存失效。
+    """
+    from .caching import bump_generations
+    from .models import Customer, CustomerEvent
+
+    keys = normalize_phones(customer.phone for customer in candidates)
+    keepers = existing_customers(keys)
+    changed = {}
+    moved = {}
+    # 保留记录合并前的被跟踪字段值: {pk: {字段: 字符串}}
+    before = {}
+    keyed = 0
+    for customer, key in zip(candidates, keys):
+        if not key:
+            continue
+        keeper = keepers.get(key)
+        if keeper is None:
+            customer.phone_key = key
+            keepers[key] = changed[customer.pk] = customer
+            keyed += 1
+            continue
+        before.setdefault(keeper.pk, CustomerEvent.values_of(keeper))
+        merge_into(keeper, customer)
+        changed[keeper.pk] = keeper
+        moved[customer.pk] = keeper.pk
+
+    if moved:
+        # 变更记录转到保留的客户名下，然后删除重复客户
+        CustomerEvent.objects.filter(customer_id__in=moved).update(customer_id=Case(
+            *[When(customer_id=old, then=Value(new)) for old, new in moved.items()],
+            output_field=IntegerField(),
+        ))
+        Customer.objects.filter(pk__in=moved).delete()
+    if changed:
+        # 自定义字段取值由 CustomerQuerySet.update 随 extra_data 同步
+        Customer.objects.bulk_update(list(changed.values()), MERGE_FIELDS)
+    if before:
+        # bulk_update 的字段值是 CASE 表达式，CustomerQuerySet.update 不会为它记录变更
+        now = timezone.now()
+        events = []
+        for pk, old_values in before.items():
+            events.extend(CustomerEvent.changes(pk, old_values, CustomerEvent.values_of(changed[pk]), now))
+        CustomerEvent.objects.bulk_create(events)
+        # 合并只会给没有负责人的保留记录补上负责人，原负责人为空时公海（全局代数）总会失效
+        bump_generations({changed[pk].sales_rep_id for pk in before})
+    return len(moved), keyed
+
+
+def merge_duplicate_customers(batch_size=1000, progress=None):
+    """
+    分批合并整张表中规范化后号码相同的客户，返回 (合并删除的数量, 新设置号码的数量)
+
+    每个号码只有一个客户持有 phone_key（唯一索引），其余重复客户的 phone_key 为空，
+    因此只需按主键顺序扫描 phone_key 为空的客户。
+    """
+    from .models import Customer
+
+    merged = keyed = 0
+    last_pk = 0
+    while True:
+        candidates = list(
+            Customer.objects.filter(phone_key__isnull=True, pk__gt=last_pk).order_by('pk')[:batch_size]
+        )
+        if not candidates:
+            return merged, keyed
+        last_pk = candidates[-1].pk
+        batch_merged, batch_keyed = retry_on_locked(merge_batch)(candidates)
+        merged += batch_merged
+        keyed += batch_keyed
+        if progress:
+            progress(last_pk, merged, keyed)
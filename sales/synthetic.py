@@ -0,0 +1,160 @@
+"""
+模拟数据生成
+
+用于在本地复现生产规模的数据量，供基准测试和压测使用。
+生成的姓名、号码、状态、联系时间分布尽量贴近真实线索数据。
+"""
+
+import random
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Customer, CustomField, CustomFieldValue
+from .phones import new_phone_keys
+
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤'
+GIVEN_CHARS = '伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超秀兰霞平刚桂英华玉萍红娥玲芬鹏辉建国志强俊峰晨曦思雨梓涵浩宇子轩欣怡一诺雨泽佳琪文博嘉怡'
+PHONE_PREFIXES = [
+    '130', '131', '132', '133', '135', '136', '137', '138', '139',
+    '150', '151', '152', '153', '155', '156', '157', '158', '159',
+    '166', '170', '173', '175', '176', '177', '178',
+    '180', '181', '182', '183', '185', '186', '187', '188', '189',
+    '191', '198', '199',
+]
+SOURCES = ['抖音', '美团', '百度推广', '小红书', '快手', '朋友圈广告', '转介绍', '展会', '官网表单']
+CITIES = [
+    ('北京', '北京'), ('上海', '上海'), ('广州', '广东'), ('深圳', '广东'), ('杭州', '浙江'),
+    ('成都', '四川'), ('武汉', '湖北'), ('西安', '陕西'), ('南京', '江苏'), ('重庆', '重庆'),
+    ('长沙', '湖南'), ('郑州', '河南'), ('济南', '山东'), ('合肥', '安徽'), ('福州', '福建'),
+]
+# 状态分布（越靠前的阶段线索越多）
+STATUS_WEIGHTS = [
+    ('wait_contact', 35), ('wait_followup', 20), ('wait_visit', 8), ('visited', 5),
+    ('signed', 3), ('no_intent', 14), ('unreachable', 15),
+]
+
+
+def fake_name(rng):
+    """随机中文姓名（两字或三字）"""
+    given = ''.join(rng.choice(GIVEN_CHARS) for _ in range(rng.choice((1, 2, 2))))
+    return rng.choice(SURNAMES) + given
+
+
+def fake_phone(index):
+    """
+    按序号生成手机号
+
+    号段轮换，后8位用与10^8互质的乘数打散，序号不超过10^8时不会重复。
+    """
+    prefix = PHONE_PREFIXES[index % len(PHONE_PREFIXES)]
+    return f'{prefix}{(index * 7919) % 100000000:08d}'
+
+
+def fake_next_contact_time(rng, now):
+    """下次联系时间：约四成未安排，其余集中在近期，少量已逾期"""
+    roll = rng.random()
+    if roll < 0.4:
+        return None
+    if roll < 0.5:
+        offset = -rng.randint(1, 14 * 24 * 60)
+    elif roll < 0.65:
+        offset = rng.randint(0, 12 * 60)
+    else:
+        offset = rng.randint(12 * 60, 30 * 24 * 60)
+    return (now + timedelta(minutes=offset)).replace(second=0, microsecond=0)
+
+
+def fake_custom_value(rng, custom_field, now):
+    """按自定义字段类型生成取值（与 CustomerForm.save 的存储格式一致）"""
+    if custom_field.field_type == 'number':
+        return str(rng.randint(1, 500) * 1000)
+    if custom_field.field_type == 'date':
+        return str((now - timedelta(days=rng.randint(0, 365))).date())
+    if custom_field.field_type == 'datetime':
+        return str(timezone.localtime(now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))))
+    if custom_field.field_type == 'select' and custom_field.options:
+        return rng.choice(custom_field.options)
+    if custom_field.field_type == 'multiselect' and custom_field.options:
+        return rng.sample(custom_field.options, rng.randint(1, len(custom_field.options)))
+    return rng.choice(['高意向', '预算充足', '需要二次跟进', '对比竞品中', '等待家人商量'])
+
+
+def ensure_reps(count):
+    """确保存在指定数量的模拟销售账号，返回用户列表"""
+    reps = []
+    for i in range(1, count + 1):
+        rep, created = User.objects.get_or_create(
+            username=f'bench_rep{i:02d}',
+            defaults={'is_staff': True}
+        )
+        if created:
+            rep.set_unusable_password()
+            rep.save(update_fields=['password'])
+        reps.append(rep)
+    return reps
+
+
+def generate_customers(count, reps, batch_size=5000, seed=None, start_index=None, progress=None):
+    """
+    批量生成客户
+
+    约三成进入公海，其余均匀分配给 reps；每批一次 bulk_create，
+    并把“最后联系时间”回拨到创建时间，使自动回收任务有真实的工作量。
+    返回实际写入的数量（与已有号码重复的行会被跳过）。
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    custom_fields = list(CustomField.objects.filter(is_active=True))
+    statuses = [status for status, _ in STATUS_WEIGHTS]
+    weights = [weight for _, weight in STATUS_WEIGHTS]
+
+    if start_index is None:
+        start_index = Customer.objects.count()
+
+    created = 0
+    for batch_start in range(start_index, start_index + count, batch_size):
+        batch_end = min(batch_start + batch_size, start_index + count)
+        customers = []
+        for index in range(batch_start, batch_end):
+            city, province = rng.choice(CITIES)
+            extra_data = {
+                custom_field.field_name: fake_custom_value(rng, custom_field, now)
+                for custom_field in custom_fields
+                if rng.random() < 0.6
+            }
+            customers.append(Customer(
+                name=fake_name(rng),
+                phone=fake_phone(index),
+                sales_rep=rng.choice(reps) if reps and rng.random() >= 0.3 else None,
+                status=rng.choices(statuses, weights)[0],
+                source=rng.choice(SOURCES),
+                city_auto=city,
+                province=province,
+                contact_count=rng.randint(0, 12),
+                next_contact_time=fake_next_contact_time(rng, now),
+                created_at=now - timedelta(minutes=rng.randint(0, 365 * 24 * 60)),
+                is_key_customer=rng.random() < 0.05,
+                notes=rng.choice(['', '', '', '客户比较关注价格', '周末方便接电话', '已发送资料']),
+                extra_data=extra_data,
+            ))
+
+        # 跳过与已有数据冲突的号码
+        phone_keys = new_phone_keys(customer.phone for customer in customers)
+        batch = [customer for customer, phone_key in zip(customers, phone_keys) if phone_key]
+        Customer.objects.bulk_create(batch)
+
+        Customer.objects.filter(pk__in=[customer.pk for customer in batch]).update(
+            last_contact_at=F('created_at')
+        )
+        if custom_fields:
+            CustomFieldValue.sync_customers(batch, custom_fields=custom_fields)
+
+        created += len(batch)
+        if progress:
+            progress(created)
+
+    return created
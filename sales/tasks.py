@@ -1,14 +1,17 @@
-from apscheduler.schedulers.background import BackgroundScheduler
 from django.utils import timezone
 from datetime import timedelta, datetime
-import requests
+import fcntl
 import logging
+import os
+
+from monsterabc_crm.sqlite import retry_on_locked
 
 logger = logging.getLogger(__name__)
 
 
 def check_contact_reminders():
-    """检查需要联系的客户并发送提醒"""
+    """检查需要联系的客户并发送提醒，返回提醒数量和企业微信发送成功/失败数（见 jobstats.py）"""
+    import requests
     from .models import Customer
     
     # 获取当前时间(精确到分钟)
@@ -27,7 +30,9 @@ def check_contact_reminders():
     WECOM_WEBHOOK_KEY = "4ff08824-5bbe-44c7-bfdf-c25ce27a4170"
     webhook_url = f"https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key={WECOM_WEBHOOK_KEY}"
     
+    stats = {'items': 0, 'webhook_ok': 0, 'webhook_failed': 0}
     for customer in customers:
+        stats['items'] += 1
         # 格式: "@销售代表 下次联系时间 客户姓名 状态"
         sales_rep_name = customer.sales_rep.username if customer.sales_rep else "无"
         status_display = customer.get_status_display()
@@ -51,13 +56,19 @@ def check_contact_reminders():
             }, timeout=5)
             
             if response.status_code == 200:
+                stats['webhook_ok'] += 1
                 logger.info(f"[企业微信] 提醒发送成功: {message}")
             else:
+                stats['webhook_failed'] += 1
                 logger.error(f"[企业微信] 提醒发送失败,状态码: {response.status_code}")
         except Exception as e:
+            stats['webhook_failed'] += 1
             logger.error(f"[企业微信] 提醒发送失败: {e}")
+    
+    return stats
 
 
+@retry_on_locked
 def recycle_unreachable_leads():
     """自动回收无法联系的线索到公海"""
     from .models import Customer
@@ -79,10 +90,57 @@ def recycle_unreachable_leads():
         logger.info(f"[自动回收] 成功回收 {count} 个无法联系的线索到公海")
     else:
         logger.info("[自动回收] 没有需要回收的线索")
+    return {'items': count}
+
+
+def delete_in_batches(queryset, batch_size=5000):
+    """按主键分批删除，避免一次删除大量数据长时间占用写锁"""
+    model = queryset.model
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += retry_on_locked(model.objects.filter(pk__in=pks).delete)()[0]
+
+
+def cleanup_expired_sessions():
+    """清理过期的登录会话和验证码"""
+    from django.contrib.sessions.models import Session
+    from captcha.models import CaptchaStore
+    
+    now = timezone.now()
+    sessions = delete_in_batches(Session.objects.filter(expire_date__lt=now))
+    captchas = delete_in_batches(CaptchaStore.objects.filter(expiration__lte=now))
+    logger.info(f"[过期清理] 清理过期会话 {sessions} 条, 过期验证码 {captchas} 条")
+    return {'items': sessions + captchas}
+
+
+def archive_cold_leads():
+    """把超过一年未变化的已签约/无意向客户移到归档表"""
+    from .archive import archive_cold_customers
+    
+    archived = archive_cold_customers()
+    logger.info(f"[冷数据归档] 归档 {archived} 个客户")
+    return {'items': archived}
+
+
+def backup_database():
+    """在线备份数据库并删除过期备份"""
+    from django.conf import settings
+    from .backup import create_backup, prune_backups
+    
+    path = create_backup(settings.BACKUP_DIR)
+    removed = prune_backups(settings.BACKUP_DIR, settings.BACKUP_RETENTION_DAYS)
+    logger.info(f"[数据库备份] 备份到 {path}, 删除过期备份 {len(removed)} 个")
+    return {'items': 1}
 
 
 def start_scheduler():
     """启动调度器"""
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from .jobstats import track_jobs
+    
     scheduler = BackgroundScheduler()
     
     # 任务1: 每分钟检查联系提醒
@@ -104,7 +162,73 @@ def start_scheduler():
         replace_existing=True
     )
     
+    # 任务3: 每天凌晨3点清理过期会话和验证码
+    scheduler.add_job(
+        cleanup_expired_sessions,
+        'cron',
+        hour=3,
+        minute=0,
+        id='cleanup_expired_sessions',
+        replace_existing=True
+    )
+    
+    # 任务4: 每天凌晨4点归档冷数据
+    scheduler.add_job(
+        archive_cold_leads,
+        'cron',
+        hour=4,
+        minute=0,
+        id='archive_cold_leads',
+        replace_existing=True
+    )
+    
+    # 任务5: 每天凌晨3点半备份数据库
+    scheduler.add_job(
+        backup_database,
+        'cron',
+        hour=3,
+        minute=30,
+        id='backup_database',
+        replace_existing=True
+    )
+    
+    # 记录每个任务的启动延迟、耗时和处理数量（管理员接口 /api/scheduler-stats/）
+    track_jobs(scheduler)
+    
     scheduler.start()
     logger.info("[调度器] 后台任务调度器已启动")
     logger.info("[调度器] - 联系提醒: 每分钟执行一次")
     logger.info("[调度器] - 线索回收: 每天02:00执行")
+    logger.info("[调度器] - 过期会话清理: 每天03:00执行")
+    logger.info("[调度器] - 数据库备份: 每天03:30执行")
+    logger.info("[调度器] - 冷数据归档: 每天04:00执行")
+
+
+SCHEDULER_LOCK_FILE = '/tmp/monsterabc_crm_scheduler.lock'
+_scheduler_lock = None
+
+
+def start_scheduler_once():
+    """
+    在 Web 进程中启动调度器（由 wsgi.py / asgi.py 调用）
+    
+    多个 worker 通过文件锁保证只有一个进程启动调度器；
+    manage.py 命令和测试不会导入 wsgi/asgi，因此不启动调度器，也不加载 APScheduler。
+    设置环境变量 CRM_SCHEDULER=0 可禁用（例如多台服务器时只在一台上运行）。
+    """
+    global _scheduler_lock
+    if os.environ.get('CRM_SCHEDULER', '1') == '0' or _scheduler_lock is not None:
+        return False
+    
+    try:
+        # 尝试获取独占锁
+        lock_fd = open(SCHEDULER_LOCK_FILE, 'w')
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        # 锁已被其他进程持有,跳过启动
+        return False
+    
+    # 保持锁直到进程结束
+    _scheduler_lock = lock_fd
+    start_scheduler()
+    return True
@@ -1,3 +1,2168 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import json
+import os
+import runpy
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from contextlib import closing
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from captcha.models import CaptchaStore
+from django.contrib import admin
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import QuerySet
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from openpyxl import Workbook, load_workbook
+import tablib
+
+from monsterabc_crm.middleware import ReplicaRoutingMiddleware, get_query_stats, reset_query_stats
+from monsterabc_crm.routers import PrimaryReplicaRouter, read_from_replica
+from monsterabc_crm.sqlite import retry_on_locked
+from .forms import CustomerForm
+from .models import ArchivedCustomer, Customer, CustomerEvent, CustomerTombstone, CustomField, CustomFieldValue
+from .admin import CustomerResource, EstimatedCountPaginator, estimated_count
+from .geo import fill_locations, locate_phone, prefix_table
+from .archive import archive_cold_customers, cold_customers, restore_customer
+from .phones import merge_duplicate_customers, new_phone_keys, normalize_phone, normalize_phones
+from .backup import create_backup, prune_backups, restore_sqlite, verify_backup
+from .changefeed import change_page, change_rows
+from .caching import get_generation
+from .bulk import (
+    HEARTBEAT_TIMEOUT, apply_in_chunks, cancel_bulk_job, get_bulk_job, job_key, run_bulk_job, start_bulk_job,
+    update_job,
+)
+from .distribution import distribute_leads, plan_quotas
+from .jobstats import cached_job_stats, get_job_stats, record_run, reset_job_stats, timed_job, track_jobs
+from .tasks import backup_database, cleanup_expired_sessions, start_scheduler_once
+from .management.commands.benchmark_concurrency import parse_levels, run_clients, summarize
+from .management.commands.benchmark_startup import parse_importtime
+from .management.commands.loadtest_crm import InProcessTransport, RouteRecorder, create_session
+
+
+def seed_customers(count, reps, start=0):
+    """批量生成客户数据：轮流分配给销售和公海，覆盖各种状态和联系时间"""
+    now = timezone.now()
+    statuses = [value for value, _ in Customer.STATUS_CHOICES]
+    owners = list(reps) + [None]
+    customers = []
+    for i in range(start, start + count):
+        customers.append(Customer(
+            name=f'客户{i}',
+            phone=f'139{i:08d}',
+            sales_rep=owners[i % len(owners)],
+            status=statuses[i % len(statuses)],
+            source='抖音' if i % 2 else '美团',
+            city_auto=['北京', '上海', '广州', '成都'][i % 4],
+            province=['北京', '上海', '广东', '四川'][i % 4],
+            next_contact_time=now + timedelta(hours=(i % 72) - 24),
+            is_key_customer=(i % 5 == 0),
+            notes=f'备注{i}',
+            extra_data={'custom_field_1': f'关键信息{i}'},
+        ))
+    Customer.objects.bulk_create(customers)
+
+
+def build_import_file(rows, start=0):
+    """生成导入用的Excel文件"""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['姓名', '电话', '状态', '负责人', '线索渠道', '自动定位城市', '手动填写地域'])
+    for i in range(start, start + rows):
+        ws.append([f'导入客户{i}', f'137{i:08d}', '', '', '抖音', '北京', '朝阳'])
+    output = BytesIO()
+    wb.save(output)
+    return SimpleUploadedFile(
+        'customers.xlsx',
+        output.getvalue(),
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+
+
+# 测试使用进程内缓存，不读写、不清空开发或生产实例共用的文件缓存
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'monsterabc-crm-tests',
+    }
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CrmTestCase(TestCase):
+    """使用数据库的测试基类：缓存换成进程内缓存，每个测试开始时清空"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+class QueryBudgetTestCase(CrmTestCase):
+    """
+    查询预算测试基类
+
+    每个页面在小数据量和大数据量下各请求一次，要求查询次数不超过预算，
+    且不随数据量增长（出现 N+1 时两次结果会不同）。
+    """
+
+    SMALL = 30
+    LARGE = 300
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.rep = User.objects.create_user('rep1', 'rep1@example.com', 'pass', is_staff=True)
+        cls.other_rep = User.objects.create_user('rep2', 'rep2@example.com', 'pass', is_staff=True)
+        CustomField.objects.create(field_name='custom_field_1', label='关键信息', field_type='text')
+
+    def count_queries(self, method, url, data=None, expected_status=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data or {})
+        if expected_status is not None:
+            self.assertEqual(response.status_code, expected_status, url)
+        else:
+            self.assertLess(response.status_code, 400, url)
+        return len(ctx), ctx
+
+    def assertQueryBudget(self, user, budget, url, method='get', data=None, expected_status=None):
+        """在两个数据量下请求同一地址，断言查询次数恒定且不超过预算"""
+        self.client.force_login(user)
+        # 预热一次，使两次测量都处于稳定状态（会话已写入缓存、页码未变化时不再写会话）
+        self.count_queries(method, url, data, expected_status)
+
+        seed_customers(self.SMALL, [self.rep, self.other_rep])
+        small, _ = self.count_queries(method, url, data, expected_status)
+
+        seed_customers(self.LARGE, [self.rep, self.other_rep], start=self.SMALL)
+        large, ctx = self.count_queries(method, url, data, expected_status)
+
+        queries = '\n'.join(query['sql'] for query in ctx.captured_queries)
+        self.assertEqual(small, large, f'{url} 查询次数随数据量增长: {small} -> {large}\n{queries}')
+        self.assertLessEqual(large, budget, f'{url} 超出查询预算 {budget}: {large}\n{queries}')
+
+
+class PageQueryBudgetTests(QueryBudgetTestCase):
+    """sales/urls.py 中各页面的查询预算"""
+
+    def test_login_page(self):
+        count, _ = self.count_queries('get', '/')
+        self.assertLessEqual(count, 2)
+
+    def test_logout(self):
+        self.client.force_login(self.rep)
+        count, _ = self.count_queries('get', '/logout/', expected_status=302)
+        self.assertLessEqual(count, 4)
+
+    def test_dashboard_admin(self):
+        self.assertQueryBudget(self.admin, 4, '/dashboard/')
+
+    def test_dashboard_rep(self):
+        self.assertQueryBudget(self.rep, 4, '/dashboard/')
+
+    def test_my_customers_admin(self):
+        self.assertQueryBudget(self.admin, 8, '/my-customers/')
+
+    def test_my_customers_rep_filtered(self):
+        self.assertQueryBudget(self.rep, 8, '/my-customers/?status=wait_contact&city=北京&sort_by=next_contact_time')
+
+    def test_customer_add(self):
+        self.assertQueryBudget(self.rep, 5, '/customer/add/')
+
+    def test_customer_detail(self):
+        seed_customers(1, [self.rep], start=9000)
+        customer = Customer.objects.get(phone='13900009000')
+        self.assertQueryBudget(self.rep, 6, f'/customer/{customer.pk}/')
+
+    def test_high_seas(self):
+        self.assertQueryBudget(self.admin, 5, '/high-seas/')
+
+    def test_high_seas_rep_search(self):
+        self.assertQueryBudget(self.rep, 5, '/high-seas/?search=客户')
+
+    def test_visited(self):
+        self.assertQueryBudget(self.admin, 4, '/visited/')
+
+    def test_signed(self):
+        self.assertQueryBudget(self.admin, 4, '/signed/')
+
+    def test_key_customers(self):
+        self.assertQueryBudget(self.rep, 5, '/key-customers/')
+
+    def test_settings(self):
+        self.assertQueryBudget(self.admin, 4, '/settings/')
+
+    def test_customer_list_api(self):
+        self.assertQueryBudget(self.rep, 4, '/api/customers/mine/?fields=id,name,sales_rep_name&limit=200')
+
+    def test_pending_reminders_api(self):
+        self.assertQueryBudget(self.rep, 6, '/api/pending-reminders/')
+
+    def test_query_stats_api(self):
+        self.assertQueryBudget(self.admin, 3, '/api/query-stats/')
+
+
+class ImportExportQueryBudgetTests(QueryBudgetTestCase):
+    """导入导出接口的查询预算"""
+
+    def test_export_all(self):
+        self.assertQueryBudget(self.admin, 3, '/api/export/')
+
+    def test_export_signed(self):
+        self.assertQueryBudget(self.admin, 3, '/api/export/?type=signed')
+
+    def test_import_cost_independent_of_table_size(self):
+        """同样大小的导入文件，查询次数不随已有数据量增长"""
+        self.client.force_login(self.admin)
+
+        seed_customers(self.SMALL, [self.rep])
+        small, _ = self.count_queries(
+            'post', '/api/import/', {'excel_file': build_import_file(10)}, expected_status=302
+        )
+
+        seed_customers(self.LARGE, [self.rep], start=self.SMALL)
+        large, _ = self.count_queries(
+            'post', '/api/import/', {'excel_file': build_import_file(10, start=100)}, expected_status=302
+        )
+
+        self.assertEqual(small, large)
+        self.assertEqual(Customer.objects.filter(name__startswith='导入客户').count(), 20)
+
+
+class AdminQueryBudgetTests(QueryBudgetTestCase):
+    """后台列表页的查询预算"""
+
+    def test_customer_changelist(self):
+        self.assertQueryBudget(self.admin, 10, '/admin/sales/customer/')
+
+    def test_high_seas_changelist(self):
+        self.assertQueryBudget(self.admin, 10, '/admin/sales/highseascustomer/')
+
+    def test_custom_field_changelist(self):
+        self.assertQueryBudget(self.admin, 8, '/admin/sales/customfield/')
+
+
+class CustomFieldValueTests(CrmTestCase):
+    """自定义字段类型化取值表"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rep = User.objects.create_user('cfv_rep', password='x', is_staff=True)
+        cls.budget = CustomField.objects.create(field_name='custom_budget', label='预算', field_type='number')
+        cls.visit_date = CustomField.objects.create(field_name='custom_visit', label='到访日期', field_type='date')
+        cls.tags = CustomField.objects.create(
+            field_name='custom_tags', label='标签', field_type='multiselect', options=['A', 'B']
+        )
+
+    def value(self, customer, custom_field):
+        return CustomFieldValue.objects.filter(customer=customer, custom_field=custom_field).first()
+
+    def test_save_syncs_typed_values(self):
+        customer = Customer.objects.create(name='客户', phone='13800000000', extra_data={
+            'custom_budget': '12000.5', 'custom_visit': '2026-03-01', 'custom_tags': ['A', 'B'],
+        })
+        self.assertEqual(self.value(customer, self.budget).value_number, Decimal('12000.5'))
+        self.assertEqual(self.value(customer, self.visit_date).value_date.isoformat(), '2026-03-01')
+        self.assertEqual(self.value(customer, self.tags).value_text, 'A,B')
+
+        customer.extra_data = {'custom_budget': '80000'}
+        customer.save()
+        self.assertEqual(CustomFieldValue.objects.filter(customer=customer).count(), 1)
+        self.assertEqual(
+            list(Customer.objects.filter(
+                custom_values__custom_field=self.budget, custom_values__value_number__gte=50000
+            )),
+            [customer],
+        )
+
+    def test_queryset_update_syncs_typed_values(self):
+        customers = [
+            Customer.objects.create(name=f'客户{i}', phone=f'1380000000{i}', extra_data={'custom_budget': '100'})
+            for i in range(3)
+        ]
+        Customer.objects.filter(pk__in=[c.pk for c in customers[:2]]).update(extra_data={'custom_budget': '90000'})
+        self.assertEqual(
+            set(Customer.objects.filter(custom_values__custom_field=self.budget,
+                                        custom_values__value_number__gte=50000)),
+            set(customers[:2]),
+        )
+
+        # bulk_update 以 CASE 表达式修改，修改后按新值同步
+        customers[0].extra_data = {'custom_tags': ['B']}
+        customers[2].extra_data = {}
+        Customer.objects.bulk_update([customers[0], customers[2]], ['extra_data'])
+        self.assertEqual(list(CustomFieldValue.objects.filter(customer=customers[0]).values_list(
+            'custom_field', 'value_text')), [(self.tags.pk, 'B')])
+        self.assertFalse(CustomFieldValue.objects.filter(customer=customers[2]).exists())
+        self.assertEqual(self.value(customers[1], self.budget).value_number, Decimal('90000'))
+
+    def test_unrepresentable_numbers_keep_text_only(self):
+        for i, raw in enumerate(('1e15', '-9999999999999999', '999999999999999.99995', 'NaN', 'Infinity', 'abc')):
+            customer = Customer.objects.create(name=raw, phone=f'1380000000{i}', extra_data={'custom_budget': raw})
+            value = self.value(customer, self.budget)
+            self.assertIsNone(value.value_number, raw)
+            self.assertEqual(value.value_text, raw)
+        customer = Customer.objects.create(name='边界', phone='13900000000',
+                                           extra_data={'custom_budget': '-999999999999999.99994'})
+        self.assertLess(self.value(customer, self.budget).value_number, -999999999999999)
+
+    def test_form_rejects_numbers_outside_column_precision(self):
+        data = {'name': '客户', 'phone': '13800000000', 'status': 'wait_contact'}
+        for raw in ('1e15', '1234567890123456', '1.00001', 'NaN', 'Infinity'):
+            form = CustomerForm({**data, 'custom_budget': raw})
+            self.assertFalse(form.is_valid(), raw)
+            self.assertIn('custom_budget', form.errors)
+        form = CustomerForm({**data, 'custom_budget': '999999999999999.9999'})
+        self.assertTrue(form.is_valid(), form.errors)
+        customer = form.save()
+        self.assertGreater(self.value(customer, self.budget).value_number, 999999999999999)
+
+    def test_backfill_command(self):
+        Customer.objects.bulk_create([
+            Customer(name=f'客户{i}', phone=f'1380000000{i}', extra_data={'custom_budget': str(i * 100)})
+            for i in range(5)
+        ] + [Customer(name='超大', phone='13800000009', extra_data={'custom_budget': '1e30'})])
+        self.assertFalse(CustomFieldValue.objects.exists())
+
+        output = StringIO()
+        call_command('backfill_custom_field_values', batch_size=2, stdout=output)
+        self.assertIn('写入 6 条', output.getvalue())
+        numbers = CustomFieldValue.objects.filter(custom_field=self.budget).values_list('value_number', flat=True)
+        self.assertEqual(sorted(numbers, key=lambda n: (n is None, n)), [0, 100, 200, 300, 400, None])
+
+        # 重复执行结果不变
+        call_command('backfill_custom_field_values', stdout=StringIO())
+        self.assertEqual(CustomFieldValue.objects.count(), 6)
+
+
+class SQLiteTuningTests(SimpleTestCase):
+    """SQLite 连接调优和写锁重试"""
+
+    databases = {'default'}
+
+    # 在与测试进程相同的配置下运行的脚本（manage.py shell -c），共享同一个 SQLite 文件
+    SETUP_SCRIPT = """
+from django.contrib.auth.models import User
+from sales.models import Customer
+User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+Customer.objects.bulk_create(
+    Customer(name=f'客户{i}', phone=f'138{i:08d}', source=f'w{i % 3}') for i in range(600)
+)
+"""
+    # 管理员在“我的客户”页反复批量修改自己那一组客户（handle_bulk_action）
+    WRITER_SCRIPT = """
+import os
+from django.contrib.auth.models import User
+from django.test import Client
+from sales.models import Customer
+group = 'w' + os.environ['CRM_TEST_WORKER']
+client = Client()
+client.force_login(User.objects.get(username='admin'))
+ids = list(Customer.objects.filter(source=group).values_list('pk', flat=True))
+for round_number in range(20):
+    status = ('wait_followup', 'visited')[round_number % 2]
+    response = client.post('/my-customers/', {'action': 'bulk_edit', 'customer_ids': ids, 'status': status})
+    assert response.status_code == 302, response.status_code
+"""
+    # 管理员上传 Excel 导入新客户（_import_customer_rows，单个事务）
+    IMPORT_SCRIPT = """
+from io import BytesIO
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client
+from openpyxl import Workbook
+wb = Workbook()
+wb.active.append(['姓名', '电话'])
+for i in range(1000):
+    wb.active.append([f'导入客户{i}', f'137{i:08d}'])
+output = BytesIO()
+wb.save(output)
+client = Client()
+client.force_login(User.objects.get(username='admin'))
+response = client.post('/api/import/', {'excel_file': SimpleUploadedFile('customers.xlsx', output.getvalue())})
+messages = [str(message) for message in get_messages(response.wsgi_request)]
+assert messages == ['成功导入 1000 条客户数据'], messages
+"""
+    # 导入和批量修改进行中持续读取，不应报 database is locked
+    READER_SCRIPT = """
+import time
+from sales.models import Customer
+deadline = time.monotonic() + 5
+while time.monotonic() < deadline:
+    Customer.objects.filter(status='visited').count()
+"""
+
+    def manage(self, directory, script=None, worker=''):
+        """启动使用临时 SQLite 文件的 manage.py 进程（script 为空时执行 migrate）"""
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='monsterabc_crm.settings',
+            CRM_DB_ENGINE='sqlite',
+            CRM_DB_NAME=os.path.join(directory, 'crm.sqlite3'),
+            CRM_CACHE_DIR=os.path.join(directory, 'cache'),
+            CRM_SCHEDULER='0',
+            CRM_TEST_WORKER=worker,
+        )
+        command = ['migrate', '--noinput', '-v', '0'] if script is None else ['shell', '-c', script]
+        return subprocess.Popen(
+            [sys.executable, 'manage.py', *command], cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        )
+
+    def wait(self, process):
+        output, _ = process.communicate(timeout=120)
+        self.assertEqual(process.returncode, 0, output)
+
+    def test_concurrent_import_and_bulk_edits(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('仅适用于SQLite')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.wait(self.manage(directory))
+        self.wait(self.manage(directory, self.SETUP_SCRIPT))
+
+        # 多个进程同时写入（相当于多个 gunicorn worker），另有一个进程持续读取
+        processes = [self.manage(directory, self.IMPORT_SCRIPT), self.manage(directory, self.READER_SCRIPT)]
+        processes += [self.manage(directory, self.WRITER_SCRIPT, str(worker)) for worker in range(3)]
+        for process in processes:
+            self.wait(process)
+
+        with closing(sqlite3.connect(os.path.join(directory, 'crm.sqlite3'))) as database:
+            self.assertEqual(database.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(database.execute(
+                "SELECT COUNT(*) FROM sales_customer WHERE phone LIKE '137%'"
+            ).fetchone()[0], 1000)
+            # 每组最后一轮改为 visited
+            self.assertEqual(database.execute(
+                "SELECT source, status, COUNT(*) FROM sales_customer WHERE source != '' GROUP BY source, status"
+            ).fetchall(), [('w0', 'visited', 200), ('w1', 'visited', 200), ('w2', 'visited', 200)])
+
+    def test_pragmas_applied_to_django_connections(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('仅适用于SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    @mock.patch('monsterabc_crm.sqlite.time.sleep')
+    def test_retry_on_locked(self, sleep):
+        calls = []
+
+        @retry_on_locked(attempts=3)
+        def bulk_write():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        self.assertEqual(bulk_write(), 'done')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    @mock.patch('monsterabc_crm.sqlite.time.sleep')
+    def test_retry_gives_up_on_other_errors(self, sleep):
+        @retry_on_locked
+        def bulk_write():
+            raise OperationalError('no such table: sales_customer')
+
+        with self.assertRaises(OperationalError):
+            bulk_write()
+        sleep.assert_not_called()
+
+
+class ProductionSettingsTests(SimpleTestCase):
+    """生产环境配置"""
+
+    def load(self, **env):
+        with mock.patch.dict(os.environ, env):
+            for name in ('CRM_SECRET_KEY', 'CRM_ALLOWED_HOSTS'):
+                if name not in env:
+                    os.environ.pop(name, None)
+            return runpy.run_module('monsterabc_crm.settings_production')
+
+    def test_secret_key_and_hosts_are_required(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'CRM_SECRET_KEY'):
+            self.load(CRM_ALLOWED_HOSTS='crm.example.com')
+        with self.assertRaisesMessage(ImproperlyConfigured, 'CRM_ALLOWED_HOSTS'):
+            self.load(CRM_SECRET_KEY='production-key')
+        with self.assertRaisesMessage(ImproperlyConfigured, 'CRM_ALLOWED_HOSTS'):
+            self.load(CRM_SECRET_KEY='production-key', CRM_ALLOWED_HOSTS=' , ')
+
+        production = self.load(CRM_SECRET_KEY='production-key', CRM_ALLOWED_HOSTS='crm.example.com, 10.0.0.5')
+        self.assertEqual(production['SECRET_KEY'], 'production-key')
+        self.assertEqual(production['ALLOWED_HOSTS'], ['crm.example.com', '10.0.0.5'])
+        self.assertFalse(production['DEBUG'])
+
+
+@override_settings(READ_REPLICA_DATABASE='replica', READ_REPLICA_VIEWS=['my_customers'])
+class ReplicaRoutingTests(SimpleTestCase):
+    """读写分离路由"""
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_reads_default_to_primary(self):
+        self.assertEqual(self.router.db_for_read(Customer), 'default')
+
+    def test_business_reads_go_to_replica_in_context(self):
+        with read_from_replica():
+            self.assertEqual(self.router.db_for_read(Customer), 'replica')
+            # 会话、用户等始终读主库
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_write(Customer), 'default')
+
+    @override_settings(READ_REPLICA_DATABASE=None)
+    def test_no_replica_configured(self):
+        with read_from_replica():
+            self.assertEqual(self.router.db_for_read(Customer), 'default')
+
+    def run_request(self, request):
+        """经过中间件执行视图，返回(响应, 视图中 Customer 的读库)"""
+        seen = {}
+
+        def view(request):
+            seen['db'] = self.router.db_for_read(Customer)
+            if request.method == 'POST':
+                self.router.db_for_write(Customer)
+            return HttpResponse()
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        request.resolver_match = resolve(request.path)
+        response = middleware(request)
+        # 请求结束后恢复读主库
+        self.assertEqual(self.router.db_for_read(Customer), 'default')
+        return response, seen['db']
+
+    def test_read_only_view_uses_replica(self):
+        response, db = self.run_request(self.factory.get('/my-customers/'))
+        self.assertEqual(db, 'replica')
+        self.assertNotIn(ReplicaRoutingMiddleware.COOKIE_NAME, response.cookies)
+
+    def test_other_views_use_primary(self):
+        _, db = self.run_request(self.factory.get('/customer/add/'))
+        self.assertEqual(db, 'default')
+
+    def test_write_pins_user_to_primary(self):
+        response, db = self.run_request(self.factory.post('/my-customers/'))
+        self.assertEqual(db, 'default')
+        cookie = response.cookies[ReplicaRoutingMiddleware.COOKIE_NAME]
+
+        request = self.factory.get('/my-customers/')
+        request.COOKIES[ReplicaRoutingMiddleware.COOKIE_NAME] = cookie.value
+        _, db = self.run_request(request)
+        self.assertEqual(db, 'default')
+
+    def test_expired_pin_returns_to_replica(self):
+        request = self.factory.get('/my-customers/')
+        request.COOKIES[ReplicaRoutingMiddleware.COOKIE_NAME] = '1'
+        _, db = self.run_request(request)
+        self.assertEqual(db, 'replica')
+
+    def streaming_view(self, seen):
+        """正文每一块生成时记下 Customer 的读库"""
+        def rows():
+            for _ in range(2):
+                seen.append(self.router.db_for_read(Customer))
+                yield b'row\n'
+
+        async def arows():
+            for chunk in rows():
+                yield chunk
+
+        def view(request):
+            return StreamingHttpResponse(arows() if request.GET.get('async') else rows())
+
+        return view
+
+    def test_streaming_body_is_read_from_replica(self):
+        seen = []
+        view = self.streaming_view(seen)
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        request = self.factory.get('/my-customers/')
+        request.resolver_match = resolve(request.path)
+        response = middleware(request)
+        self.assertEqual(self.router.db_for_read(Customer), 'default')
+
+        self.assertEqual(b''.join(response.streaming_content), b'row\nrow\n')
+        self.assertEqual(seen, ['replica', 'replica'])
+        # 块与块之间及正文结束后仍读主库
+        self.assertEqual(self.router.db_for_read(Customer), 'default')
+
+    async def test_async_streaming_body_is_read_from_replica(self):
+        seen = []
+        view = self.streaming_view(seen)
+
+        async def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        request = self.factory.get('/my-customers/', {'async': '1'})
+        request.resolver_match = resolve(request.path)
+        response = await middleware(request)
+
+        self.assertEqual([chunk async for chunk in response.streaming_content], [b'row\n', b'row\n'])
+        self.assertEqual(seen, ['replica', 'replica'])
+        self.assertEqual(self.router.db_for_read(Customer), 'default')
+
+
+class SessionWriteTests(CrmTestCase):
+    """会话只在内容变化时写数据库，过期会话和验证码定期清理"""
+
+    def setUp(self):
+        super().setUp()
+        self.rep = User.objects.create_user('session_rep', password='x', is_staff=True)
+        self.client.force_login(self.rep)
+
+    def session_writes(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        return [
+            q['sql'] for q in ctx.captured_queries
+            if 'django_session' in q['sql'] and not q['sql'].lstrip().upper().startswith('SELECT')
+        ]
+
+    def test_repeated_page_view_does_not_write_session(self):
+        self.assertTrue(self.session_writes('/my-customers/?page=2'))
+        self.assertEqual(self.session_writes('/my-customers/?page=2'), [])
+        self.assertTrue(self.session_writes('/my-customers/?page=1'))
+
+    def test_reminder_poll_writes_only_for_new_reminders(self):
+        Customer.objects.create(
+            name='提醒客户', phone='13800000001', sales_rep=self.rep,
+            next_contact_time=timezone.now() + timedelta(minutes=2),
+        )
+        self.session_writes('/api/pending-reminders/')
+        self.assertEqual(self.session_writes('/api/pending-reminders/'), [])
+        self.assertEqual(self.client.get('/api/pending-reminders/').json()['reminders'], [])
+
+    def test_cleanup_removes_only_expired_rows(self):
+        now = timezone.now()
+        Session.objects.create(session_key='expired', session_data='', expire_date=now - timedelta(days=1))
+        CaptchaStore.objects.create(challenge='A', response='a', expiration=now - timedelta(minutes=1))
+        CaptchaStore.objects.create(challenge='B', response='b', expiration=now + timedelta(minutes=5))
+
+        cleanup_expired_sessions()
+
+        self.assertFalse(Session.objects.filter(session_key='expired').exists())
+        # 当前登录会话保留
+        self.assertTrue(Session.objects.filter(session_key=self.client.session.session_key).exists())
+        self.assertEqual(list(CaptchaStore.objects.values_list('challenge', flat=True)), ['B'])
+
+
+class ListPageCacheTests(CrmTestCase):
+    """列表页查询结果缓存及写入后失效"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('cache_admin', 'admin@example.com', 'pass')
+        cls.rep = User.objects.create_user('cache_rep1', password='x', is_staff=True)
+        cls.other_rep = User.objects.create_user('cache_rep2', password='x', is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        seed_customers(20, [self.rep, self.other_rep])
+
+    def customer_queries(self, user, url='/my-customers/'):
+        """请求列表页，返回(页面中的客户ID, 查询客户表的次数)"""
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        ids = [customer.pk for customer in response.context['customers']]
+        queries = [q for q in ctx.captured_queries if 'FROM "sales_customer"' in q['sql']]
+        return ids, len(queries)
+
+    def test_repeated_request_served_from_cache(self):
+        ids, queries = self.customer_queries(self.rep)
+        self.assertEqual(queries, 2)
+        cached_ids, queries = self.customer_queries(self.rep)
+        self.assertEqual(queries, 0)
+        self.assertEqual(cached_ids, ids)
+
+    def test_filters_are_cached_separately(self):
+        self.customer_queries(self.rep)
+        ids, queries = self.customer_queries(self.rep, '/my-customers/?status=signed')
+        self.assertEqual(queries, 2)
+        self.assertEqual(set(ids), set(
+            Customer.objects.filter(sales_rep=self.rep, status='signed').values_list('pk', flat=True)
+        ))
+
+    def test_bulk_update_invalidates_only_affected_reps(self):
+        self.customer_queries(self.rep)
+        self.customer_queries(self.other_rep)
+
+        Customer.objects.filter(sales_rep=self.other_rep).update(status='signed')
+
+        _, queries = self.customer_queries(self.rep)
+        self.assertEqual(queries, 0)
+        _, queries = self.customer_queries(self.other_rep)
+        self.assertEqual(queries, 2)
+
+    def test_claim_invalidates_claiming_rep(self):
+        self.customer_queries(self.rep)
+        pool_customer = Customer.objects.filter(sales_rep__isnull=True).first()
+
+        self.client.post('/high-seas/', {'claim': '1', 'customer_ids': [pool_customer.pk]})
+
+        ids, _ = self.customer_queries(self.rep)
+        self.assertIn(pool_customer.pk, ids)
+
+    def test_save_invalidates_previous_and_new_owner(self):
+        customer = Customer.objects.filter(sales_rep=self.rep).first()
+        self.customer_queries(self.rep)
+        self.customer_queries(self.other_rep)
+
+        customer.sales_rep = self.other_rep
+        customer.save()
+
+        self.assertNotIn(customer.pk, self.customer_queries(self.rep)[0])
+        self.assertIn(customer.pk, self.customer_queries(self.other_rep)[0])
+
+    def test_admin_pages_invalidated_by_any_write(self):
+        self.customer_queries(self.admin, '/key-customers/')
+        customer = Customer.objects.filter(sales_rep=self.other_rep).first()
+        customer.is_key_customer = True
+        customer.save()
+
+        ids, _ = self.customer_queries(self.admin, '/key-customers/')
+        self.assertIn(customer.pk, ids)
+
+
+class CustomerListApiTests(CrmTestCase):
+    """客户列表JSON接口"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('api_admin', 'admin@example.com', 'pass')
+        cls.rep = User.objects.create_user('api_rep1', password='x', is_staff=True)
+        cls.other_rep = User.objects.create_user('api_rep2', password='x', is_staff=True)
+        seed_customers(60, [cls.rep, cls.other_rep])
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.rep)
+
+    def fetch_all(self, url, **params):
+        """沿 next_cursor 翻完所有页，返回全部结果和请求次数"""
+        results, pages, cursor = [], 0, None
+        while True:
+            query = dict(params, **({'cursor': cursor} if cursor else {}))
+            data = self.client.get(url, query).json()
+            results.extend(data['results'])
+            pages += 1
+            cursor = data['next_cursor']
+            if not cursor:
+                return results, pages
+
+    def test_lists_respect_permissions(self):
+        results, pages = self.fetch_all('/api/customers/mine/', limit=7, fields='id')
+        expected = Customer.objects.filter(sales_rep=self.rep).count()
+        self.assertEqual(len(results), expected)
+        self.assertEqual(len({row['id'] for row in results}), expected)
+        self.assertEqual(pages, -(-expected // 7))
+
+        results, _ = self.fetch_all('/api/customers/high-seas/', fields='id,sales_rep')
+        self.assertEqual(len(results), Customer.objects.filter(sales_rep__isnull=True).count())
+        self.assertTrue(all(row['sales_rep'] is None for row in results))
+
+        results, _ = self.fetch_all('/api/customers/signed/', fields='id,status')
+        self.assertTrue(results)
+        self.assertEqual({row['status'] for row in results}, {'signed'})
+
+    def test_filters_and_sorting(self):
+        results, _ = self.fetch_all(
+            '/api/customers/mine/', status='wait_contact', sort_by='name', sort_order='asc', limit=3,
+            fields='name,status',
+        )
+        expected = list(Customer.objects.filter(sales_rep=self.rep, status='wait_contact')
+                        .order_by('name', 'pk').values_list('name', flat=True))
+        self.assertEqual([row['name'] for row in results], expected)
+
+    def test_field_projection_limits_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/api/customers/mine/', {'fields': 'id,phone,sales_rep_name'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'phone', 'sales_rep_name'})
+        self.assertEqual(data['results'][0]['sales_rep_name'], 'api_rep1')
+        sql = [q['sql'] for q in ctx.captured_queries if 'FROM "sales_customer"' in q['sql']]
+        self.assertEqual(len(sql), 1)
+        self.assertNotIn('"notes"', sql[0])
+        self.assertNotIn('"extra_data"', sql[0])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/customers/mine/', {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/customers/mine/', {'cursor': 'bad'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/customers/mine/', {'sort_by': 'phone'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/customers/unknown/').status_code, 404)
+
+    def test_malformed_cursors_are_rejected(self):
+        def cursor(*payload):
+            return base64.urlsafe_b64encode(json.dumps(list(payload)).encode('utf-8')).decode('ascii')
+
+        cases = [
+            ('created_at', cursor(None, 1)),
+            ('created_at', cursor(123, 1)),
+            ('created_at', cursor('2026-01-01T00:00:00', None)),
+            ('created_at', cursor('2026-01-01T00:00:00', [1])),
+            ('created_at', cursor('2026-01-01T00:00:00', 2 ** 70)),
+            ('created_at', cursor('2026-13-01T00:00:00', 1)),
+            ('contact_count', cursor('abc', 1)),
+            ('contact_count', cursor([1], 1)),
+            ('contact_count', cursor(True, 1)),
+            ('name', cursor(['abc'], 1)),
+            ('id', cursor(1.5, 1)),
+            ('created_at', cursor('2026-01-01T00:00:00')),
+            ('created_at', base64.urlsafe_b64encode(b'{"a": 1}').decode('ascii')),
+            ('created_at', '\u4e2d\u6587'),
+        ]
+        for sort_by, value in cases:
+            response = self.client.get('/api/customers/mine/', {'sort_by': sort_by, 'cursor': value})
+            self.assertEqual(response.status_code, 400, (sort_by, value))
+
+        # 合法游标中的排序字段值按字段类型转换
+        response = self.client.get('/api/customers/mine/', {
+            'sort_by': 'contact_count', 'sort_order': 'asc', 'cursor': cursor('0', 0),
+        })
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_not_modified_until_data_changes(self):
+        response = self.client.get('/api/customers/mine/')
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/customers/mine/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in ctx.captured_queries if 'sales_customer' in q['sql']])
+
+        Customer.objects.filter(sales_rep=self.rep).update(status='visited')
+        response = self.client.get('/api/customers/mine/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class InlineThread:
+    """测试中同步执行后台任务（测试事务中的数据对其他线程不可见）"""
+
+    def __init__(self, target, args=(), **kwargs):
+        self.args = args
+
+    def start(self):
+        run_bulk_job(*self.args)
+
+
+class FilteredBulkActionTests(CrmTestCase):
+    """按筛选条件分块批量修改/删除"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('bulk_admin', 'admin@example.com', 'pass')
+        cls.rep = User.objects.create_user('bulk_rep1', password='x', is_staff=True)
+        cls.other_rep = User.objects.create_user('bulk_rep2', password='x', is_staff=True)
+        seed_customers(70, [cls.rep, cls.other_rep])
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def test_chunks_use_one_combined_update_each(self):
+        customers = Customer.objects.filter(status='wait_contact')
+        expected = customers.count()
+        with CaptureQueriesContext(connection) as ctx:
+            processed, affected, cancelled = apply_in_chunks(
+                customers, 'update', {'status': 'signed', 'sales_rep_id': self.rep.pk}, chunk_size=3
+            )
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "sales_customer"')]
+        self.assertEqual((processed, affected, cancelled), (expected, expected, False))
+        self.assertEqual(len(updates), -(-expected // 3))
+        self.assertFalse(Customer.objects.filter(status='wait_contact').exists())
+
+    def test_stop_between_chunks(self):
+        calls = []
+        processed, affected, cancelled = apply_in_chunks(
+            Customer.objects.all(), 'delete', chunk_size=10, should_stop=lambda: calls.append(1) or len(calls) > 2
+        )
+        self.assertEqual((processed, affected, cancelled), (20, 20, True))
+        self.assertEqual(Customer.objects.count(), 50)
+
+    def test_filtered_bulk_edit_reports_exact_count(self):
+        # 只在提交时替换线程（异步视图的执行也依赖线程池）
+        with mock.patch('sales.bulk.threading.Thread', InlineThread):
+            response = self.client.post(
+                '/my-customers/?status=wait_followup&search=139',
+                {'action': 'bulk_edit', 'apply_to': 'filtered', 'sales_rep': '0'},
+            )
+        self.assertEqual(response.status_code, 302)
+        job_id = response['Location'].split('bulk_job=')[1]
+        self.assertIn('status=wait_followup', response['Location'])
+
+        job = self.client.get(f'/api/bulk-jobs/{job_id}/').json()
+        total = Customer.objects.filter(status='wait_followup').count()
+        self.assertEqual((job['status'], job['total'], job['affected']), ('done', total, total))
+        self.assertFalse(Customer.objects.filter(status='wait_followup', sales_rep__isnull=False).exists())
+
+    def test_filtered_bulk_delete_on_high_seas(self):
+        pool_signed = Customer.objects.filter(sales_rep__isnull=True, status='signed').count()
+        with mock.patch('sales.bulk.threading.Thread', InlineThread):
+            response = self.client.post('/high-seas/?status=signed', {'action': 'bulk_delete', 'apply_to': 'filtered'})
+        job_id = response['Location'].split('bulk_job=')[1]
+
+        self.assertEqual(self.client.get(f'/api/bulk-jobs/{job_id}/').json()['affected'], pool_signed)
+        self.assertFalse(Customer.objects.filter(sales_rep__isnull=True, status='signed').exists())
+        self.assertTrue(Customer.objects.filter(status='signed').exists())
+
+    def test_cancelled_job(self):
+        with mock.patch('sales.bulk.threading.Thread'):
+            job_id = start_bulk_job(self.admin, Customer.objects.all(), 'delete')
+        response = self.client.post(f'/api/bulk-jobs/{job_id}/cancel/')
+        self.assertEqual(response.json(), {'cancelled': True})
+
+        run_bulk_job(job_id, Customer.objects.all(), 'delete')
+
+        job = self.client.get(f'/api/bulk-jobs/{job_id}/').json()
+        self.assertEqual((job['status'], job['processed']), ('cancelled', 0))
+        self.assertEqual(Customer.objects.count(), 70)
+        self.assertFalse(cancel_bulk_job('missing'))
+
+    def test_selected_ids_report_affected_rows(self):
+        ids = list(Customer.objects.values_list('pk', flat=True)[:5]) + [999999]
+        response = self.client.post(
+            '/my-customers/', {'action': 'bulk_edit', 'customer_ids': ids, 'status': 'visited'}, follow=True
+        )
+        self.assertContains(response, '成功修改 5 个客户')
+
+    def test_reps_cannot_use_job_api(self):
+        self.client.force_login(self.rep)
+        self.assertEqual(self.client.get('/api/bulk-jobs/abc/').status_code, 302)
+
+    def test_job_without_progress_is_reported_interrupted(self):
+        # 模拟 worker 被重启：线程没有运行，缓存中的状态停留在 running
+        with mock.patch('sales.bulk.threading.Thread'):
+            job_id = start_bulk_job(self.admin, Customer.objects.all(), 'update', {'status': 'visited'})
+        self.assertEqual(get_bulk_job(job_id)['status'], 'running')
+
+        later = timezone.now() + timedelta(seconds=HEARTBEAT_TIMEOUT + 1)
+        with mock.patch('sales.bulk.timezone.now', return_value=later):
+            job = self.client.get(f'/api/bulk-jobs/{job_id}/').json()
+        self.assertEqual(job['status'], 'interrupted')
+        self.assertIn('后台任务已中断', job['error'])
+
+        # 仍在更新进度的任务不受影响
+        update_job(job_id, processed=10)
+        with mock.patch('sales.bulk.timezone.now', return_value=timezone.now() + timedelta(seconds=60)):
+            self.assertEqual(get_bulk_job(job_id)['status'], 'running')
+
+
+class QuotaPlanTests(SimpleTestCase):
+    """分配数量计算"""
+
+    def test_round_robin_gives_remainder_to_least_loaded(self):
+        self.assertEqual(plan_quotas(10, {1: 5, 2: 0, 3: 2}), {1: 3, 2: 4, 3: 3})
+
+    def test_weighted(self):
+        self.assertEqual(plan_quotas(10, {1: 0, 2: 0}, 'weighted', weights={1: 3, 2: 1}), {1: 8, 2: 2})
+        # 未填写权重默认为1
+        self.assertEqual(plan_quotas(9, {1: 0, 2: 0}, 'weighted', weights={1: 2}), {1: 6, 2: 3})
+
+    def test_capacity_levels_load_and_respects_caps(self):
+        self.assertEqual(plan_quotas(6, {1: 0, 2: 4, 3: 10}, 'capacity'), {1: 5, 2: 1, 3: 0})
+        quotas = plan_quotas(100, {1: 0, 2: 4}, 'capacity', capacity={1: 3, 2: 6})
+        self.assertEqual(quotas, {1: 3, 2: 2})
+        self.assertEqual(plan_quotas(5, {1: 8, 2: 0}, 'capacity', capacity=4), {1: 0, 2: 4})
+
+
+class LeadDistributionTests(CrmTestCase):
+    """线索分配"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('dist_admin', 'admin@example.com', 'pass')
+        cls.reps = [User.objects.create_user(f'dist_rep{i}', password='x', is_staff=True) for i in range(3)]
+        seed_customers(90, [])
+
+    def test_one_update_per_rep(self):
+        pool = Customer.objects.filter(sales_rep__isnull=True)
+        with CaptureQueriesContext(connection) as ctx:
+            assigned = distribute_leads(pool, [rep.pk for rep in self.reps])
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "sales_customer"')]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(sorted(assigned.values()), [30, 30, 30])
+        for rep in self.reps:
+            self.assertEqual(Customer.objects.filter(sales_rep=rep).count(), 30)
+
+    def test_only_filtered_leads_are_assigned(self):
+        signed = Customer.objects.filter(status='signed')
+        expected = signed.count()
+        assigned = distribute_leads(signed, [self.reps[0].pk, self.reps[1].pk], 'weighted',
+                                    weights={self.reps[0].pk: 1, self.reps[1].pk: 0})
+        self.assertEqual(assigned, {self.reps[0].pk: expected, self.reps[1].pk: 0})
+        self.assertEqual(Customer.objects.filter(sales_rep__isnull=False).count(), expected)
+
+    def test_high_seas_distribute_filtered(self):
+        self.client.force_login(self.admin)
+        expected = Customer.objects.filter(status='wait_contact').count()
+        response = self.client.post('/high-seas/?status=wait_contact', {
+            'action': 'distribute',
+            'apply_to': 'filtered',
+            'strategy': 'capacity',
+            'rep_ids': [self.reps[0].pk, self.reps[1].pk],
+            'rep_value_%d' % self.reps[0].pk: '2',
+        }, follow=True)
+        self.assertContains(response, f'成功分配 {expected} 个客户')
+        self.assertEqual(Customer.objects.filter(sales_rep=self.reps[0]).count(), 2)
+        self.assertEqual(Customer.objects.filter(sales_rep=self.reps[1]).count(), expected - 2)
+
+    def test_offboarding_rebalances_portfolio(self):
+        leaving, busy, idle = self.reps
+        Customer.objects.all().update(sales_rep=leaving)
+        first_ten = Customer.objects.filter(pk__in=Customer.objects.order_by('pk').values('pk')[:10])
+        first_ten.update(sales_rep=busy)
+        busy_open = Customer.objects.filter(sales_rep=busy).exclude(status__in=['signed', 'no_intent']).count()
+
+        self.client.force_login(self.admin)
+        self.client.post('/settings/', {'delete_user': '1', 'user_id': leaving.pk, 'reassign': 'capacity'})
+
+        self.assertFalse(User.objects.filter(pk=leaving.pk).exists())
+        self.assertFalse(Customer.objects.filter(sales_rep__isnull=True).exists())
+        # 负载低的销售先分配，两人分到的数量之差等于原有未结案客户数之差
+        received_busy = Customer.objects.filter(sales_rep=busy).count() - 10
+        received_idle = Customer.objects.filter(sales_rep=idle).count()
+        self.assertEqual(received_busy + received_idle, 80)
+        self.assertLessEqual(abs((received_idle - received_busy) - busy_open), 1)
+
+
+class CustomerEventTests(CrmTestCase):
+    """客户变更记录"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('event_admin', 'admin@example.com', 'pass')
+        cls.rep = User.objects.create_user('event_rep', password='x', is_staff=True)
+        seed_customers(20, [])
+
+    def test_save_records_changed_fields_only(self):
+        customer = Customer.objects.order_by('pk').first()
+        customer.status = 'signed' if customer.status != 'signed' else 'visited'
+        customer.sales_rep = self.rep
+        customer.notes = '只改备注不记录'
+        customer.save()
+
+        fields = set(customer.events.values_list('field', flat=True))
+        self.assertEqual(fields, {'status', 'sales_rep'})
+        owner_event = customer.events.get(field='sales_rep')
+        self.assertEqual((owner_event.old_value, owner_event.new_value), ('', str(self.rep.pk)))
+
+        # 同一时刻换成其他时区表示不算变更
+        customer.next_contact_time = timezone.localtime(customer.next_contact_time)
+        customer.save()
+        self.assertFalse(customer.events.filter(field='next_contact_time').exists())
+
+    def test_new_customer_has_no_events(self):
+        customer = Customer.objects.create(name='新客户', phone='13700000000')
+        self.assertFalse(customer.events.exists())
+
+    def test_deleting_rep_records_return_to_pool(self):
+        leaving = User.objects.create_user('event_leaving', password='x', is_staff=True)
+        released = list(Customer.objects.order_by('pk')[:3].values_list('pk', flat=True))
+        Customer.objects.filter(pk__in=released[:2]).update(sales_rep=leaving)
+        Customer.objects.filter(pk=released[2]).update(sales_rep=self.rep)
+        CustomerEvent.objects.all().delete()
+
+        self.client.force_login(self.admin)
+        self.client.post('/settings/', {'delete_user': '1', 'user_id': leaving.pk, 'reassign': 'pool'})
+        # 后台删除用户走 pre_delete 信号
+        rep_pk = self.rep.pk
+        self.rep.delete()
+
+        events = CustomerEvent.objects.filter(field='sales_rep').order_by('customer_id')
+        self.assertEqual([(e.customer_id, e.old_value, e.new_value) for e in events], [
+            (released[0], str(leaving.pk), ''),
+            (released[1], str(leaving.pk), ''),
+            (released[2], str(rep_pk), ''),
+        ])
+
+    def test_queryset_update_records_one_batched_insert(self):
+        qs = Customer.objects.filter(status='wait_contact')
+        unchanged = Customer.objects.filter(status='signed').count()
+        expected = qs.count()
+        with CaptureQueriesContext(connection) as ctx:
+            Customer.objects.filter(status__in=['wait_contact', 'signed']).update(status='signed', notes='x')
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "sales_customerevent"')]
+        self.assertEqual(len(inserts), 1)
+        # 原本就是已签约的客户没有变化，不记录
+        self.assertEqual(CustomerEvent.objects.filter(field='status').count(), expected)
+        self.assertEqual(CustomerEvent.objects.filter(new_value='signed').count(), expected)
+        self.assertTrue(unchanged)
+
+    def test_distribution_and_bulk_paths_record_events(self):
+        pool = Customer.objects.filter(sales_rep__isnull=True)
+        total = pool.count()
+        distribute_leads(pool, [self.rep.pk])
+        self.assertEqual(CustomerEvent.objects.filter(field='sales_rep', new_value=str(self.rep.pk)).count(), total)
+
+        apply_in_chunks(Customer.objects.all(), 'update', {'sales_rep': None}, chunk_size=7)
+        self.assertEqual(CustomerEvent.objects.filter(field='sales_rep', new_value='').count(), total)
+
+    def test_timeline_on_detail_page(self):
+        customer = Customer.objects.order_by('pk').first()
+        customer.sales_rep = self.rep
+        customer.save()
+        Customer.objects.filter(pk=customer.pk).update(sales_rep=None)
+        self.rep.delete()
+
+        events = CustomerEvent.timeline(customer.pk)
+        self.assertEqual([(e.old_display, e.new_display) for e in events], [('已删除用户', '公海'), ('公海', '已删除用户')])
+
+        self.client.force_login(self.admin)
+        response = self.client.get(f'/customer/{customer.pk}/')
+        self.assertContains(response, '变更记录')
+        self.assertContains(response, '已删除用户 → 公海')
+
+
+class ArchiveTests(CrmTestCase):
+    """冷数据归档"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('archive_admin', 'admin@example.com', 'pass')
+        cls.rep = User.objects.create_user('archive_rep', password='x', is_staff=True)
+        CustomField.objects.create(field_name='custom_field_1', label='关键信息')
+        seed_customers(28, [cls.rep])
+        old = timezone.now() - timedelta(days=400)
+        Customer.objects.update(last_contact_at=old)
+
+    def test_fields_match_customer(self):
+        archived_columns = {field.attname for field in ArchivedCustomer._meta.concrete_fields}
+        self.assertLessEqual(set(ArchivedCustomer.customer_columns()), archived_columns)
+
+    def test_archive_moves_cold_closed_customers_in_batches(self):
+        cold = Customer.objects.filter(status__in=['signed', 'no_intent'])
+        cold_pks = set(cold.values_list('pk', flat=True))
+        customer = cold.first()
+        customer.status = customer.status
+        customer.save()  # 最近修改过的不归档
+        CustomerEvent.objects.create(customer=customer, field='status', old_value='visited', new_value='signed')
+
+        self.assertEqual(archive_cold_customers(batch_size=3), len(cold_pks) - 1)
+        self.assertEqual(set(ArchivedCustomer.objects.values_list('pk', flat=True)), cold_pks - {customer.pk})
+        self.assertFalse(Customer.objects.filter(pk__in=cold_pks - {customer.pk}).exists())
+        self.assertFalse(CustomFieldValue.objects.filter(customer_id__in=cold_pks - {customer.pk}).exists())
+        self.assertEqual(Customer.objects.count() + ArchivedCustomer.objects.count(), 28)
+        self.assertEqual(archive_cold_customers(), 0)
+
+    def test_detail_search_and_export_fall_through(self):
+        archive_cold_customers()
+        archived = ArchivedCustomer.objects.filter(sales_rep=self.rep).first()
+        CustomerEvent.objects.create(customer_id=archived.pk, field='status', old_value='visited', new_value='signed')
+
+        self.client.force_login(self.rep)
+        response = self.client.get(f'/customer/{archived.pk}/')
+        self.assertContains(response, '该客户已归档')
+        self.assertContains(response, '已到访 → 已签约')
+
+        response = self.client.get('/my-customers/', {'search': archived.phone})
+        self.assertContains(response, '已归档客户（1）')
+
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/export/', {'archived': '1'})
+        workbook = load_workbook(BytesIO(response.content))
+        self.assertEqual(workbook.active.max_row - 1, 28)
+        response = self.client.get('/api/export/')
+        self.assertEqual(load_workbook(BytesIO(response.content)).active.max_row - 1, Customer.objects.count())
+
+    def test_editing_archived_customer_restores_it(self):
+        archive_cold_customers()
+        archived = ArchivedCustomer.objects.filter(sales_rep=self.rep).first()
+
+        self.client.force_login(self.rep)
+        response = self.client.post(f'/customer/{archived.pk}/', {
+            'name': archived.name,
+            'phone': archived.phone,
+            'status': 'visited',
+            'sales_rep': self.rep.pk,
+        })
+        self.assertEqual(response.status_code, 302)
+        customer = Customer.objects.get(pk=archived.pk)
+        self.assertEqual(customer.status, 'visited')
+        self.assertFalse(ArchivedCustomer.objects.filter(pk=archived.pk).exists())
+
+    def test_archive_keeps_events(self):
+        customer = Customer.objects.filter(status='signed').first()
+        CustomerEvent.objects.create(customer=customer, field='status', old_value='visited', new_value='signed')
+        archive_cold_customers()
+        self.assertTrue(ArchivedCustomer.objects.filter(pk=customer.pk).exists())
+        self.assertEqual(CustomerEvent.objects.filter(customer_id=customer.pk).count(), 1)
+
+    def test_invalid_or_forbidden_edit_keeps_archived_customer(self):
+        archive_cold_customers()
+        archived = ArchivedCustomer.objects.filter(sales_rep=self.rep).first()
+        self.client.force_login(self.rep)
+        for data in (
+            {'name': '', 'phone': archived.phone, 'status': 'visited', 'sales_rep': self.rep.pk},
+            {'name': archived.name, 'phone': archived.phone, 'status': 'visited', 'sales_rep': self.admin.pk},
+        ):
+            response = self.client.post(f'/customer/{archived.pk}/', data)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(ArchivedCustomer.objects.filter(pk=archived.pk).exists())
+            self.assertFalse(Customer.objects.filter(pk=archived.pk).exists())
+
+    def test_archived_phone_cannot_be_reused(self):
+        archive_cold_customers()
+        archived = ArchivedCustomer.objects.filter(sales_rep=self.rep).first()
+        self.client.force_login(self.rep)
+        response = self.client.post('/customer/add/', {
+            'name': '新客户', 'phone': f'+86 {archived.phone}', 'status': 'wait_contact', 'sales_rep': self.rep.pk,
+        })
+        self.assertContains(response, '该电话号码的客户已归档')
+        self.assertEqual(new_phone_keys([archived.phone, '13700000000']), [None, '13700000000'])
+
+    def test_editing_archived_customer_whose_phone_is_taken_shows_error(self):
+        archive_cold_customers()
+        archived = ArchivedCustomer.objects.filter(sales_rep=self.rep).first()
+        # 修复前已有客户使用了归档客户的号码
+        Customer.objects.create(name='占用号码', phone=archived.phone)
+        self.client.force_login(self.rep)
+        response = self.client.post(f'/customer/{archived.pk}/', {
+            'name': archived.name, 'phone': archived.phone, 'status': 'visited', 'sales_rep': self.rep.pk,
+        })
+        self.assertContains(response, '该电话号码的客户已存在')
+        self.assertTrue(ArchivedCustomer.objects.filter(pk=archived.pk).exists())
+
+        # 换成新号码后恢复时原号码仍然冲突，返回表单错误而不是500
+        response = self.client.post(f'/customer/{archived.pk}/', {
+            'name': archived.name, 'phone': '13700000000', 'status': 'visited', 'sales_rep': self.rep.pk,
+        })
+        self.assertContains(response, '该电话号码已被其他客户使用')
+        self.assertTrue(ArchivedCustomer.objects.filter(pk=archived.pk).exists())
+
+    def test_restore_rebuilds_custom_field_values(self):
+        archive_cold_customers()
+        archived = ArchivedCustomer.objects.first()
+        customer = restore_customer(archived.pk)
+        self.assertEqual(customer.extra_data, archived.extra_data)
+        self.assertTrue(CustomFieldValue.objects.filter(customer=customer).exists())
+        self.assertNotIn(customer.pk, cold_customers().values_list('pk', flat=True))
+
+
+class PhoneNormalizeTests(SimpleTestCase):
+    """电话号码规范化"""
+
+    def test_formats_share_one_key(self):
+        self.assertEqual(
+            set(normalize_phones(['+86 138-0000-0000', '13800000000', '138 0000 0000', '0086 13800000000', 13800000000.0])),
+            {'13800000000'},
+        )
+
+    def test_non_mobile_numbers_keep_digits(self):
+        self.assertEqual(normalize_phone('010-8888 6666'), '01088886666')
+        self.assertEqual(normalize_phone('86123'), '86123')
+        self.assertEqual(normalize_phone(' - '), '')
+        self.assertEqual(normalize_phone(None), '')
+
+
+class PhoneDedupeTests(CrmTestCase):
+    """规范化电话去重与合并"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('phone_admin', 'admin@example.com', 'pass')
+        cls.rep = User.objects.create_user('phone_rep', password='x', is_staff=True)
+        Customer.objects.create(name='已有客户', phone='+86 138-0000-0000')
+
+    def test_phone_key_is_unique(self):
+        self.assertEqual(Customer.objects.get().phone_key, '13800000000')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Customer.objects.create(name='重复', phone='138 0000 0000')
+
+    def test_new_phone_keys_constant_queries(self):
+        # 主表和归档表各一条查询
+        with self.assertNumQueries(2):
+            keys = new_phone_keys(['13800000000', '139-0000-0001', '+8613900000001', '', '13900000002'])
+        self.assertEqual(keys, [None, '13900000001', None, None, '13900000002'])
+
+    def test_batch_add_skips_normalized_duplicates(self):
+        self.client.force_login(self.rep)
+        self.client.post('/my-customers/', {'action': 'batch_add', 'batch_data': json.dumps([
+            {'name': 'A', 'phone': '13800000000'},
+            {'name': 'B', 'phone': '139 0000 0001'},
+            {'name': 'C', 'phone': '+86 13900000001'},
+        ])})
+        self.assertEqual(Customer.objects.count(), 2)
+        self.assertTrue(Customer.objects.filter(phone_key='13900000001', name='B').exists())
+
+    def test_excel_import_updates_by_normalized_phone(self):
+        wb = Workbook()
+        ws = wb.active
+        ws.append(['姓名', '电话'])
+        ws.append(['新名字', 13800000000])
+        ws.append(['新客户', '139-0000-0003'])
+        ws.append(['新客户重复', '+86 139 0000 0003'])
+        output = BytesIO()
+        wb.save(output)
+        upload = SimpleUploadedFile('customers.xlsx', output.getvalue())
+
+        self.client.force_login(self.admin)
+        self.client.post('/api/import/', {'excel_file': upload})
+        self.assertEqual(Customer.objects.count(), 2)
+        self.assertEqual(Customer.objects.get(phone_key='13900000003').phone, '139-0000-0003')
+
+    def test_admin_resource_matches_normalized_phone(self):
+        dataset = tablib.Dataset(headers=['姓名', '电话'])
+        dataset.append(['新名字', '138 0000 0000'])
+        dataset.append(['新客户', '13900000004'])
+        dataset.append(['新客户重复', '+86 139-0000-0004'])
+        result = CustomerResource().import_data(dataset, raise_errors=True)
+        self.assertEqual((result.totals['new'], result.totals['update']), (1, 2))
+        self.assertEqual(Customer.objects.count(), 2)
+        self.assertEqual(Customer.objects.get(phone_key='13800000000').name, '新名字')
+
+    def test_form_rejects_normalized_duplicate(self):
+        self.client.force_login(self.rep)
+        response = self.client.post('/customer/add/', {'name': '重复', 'phone': '138 0000 0000', 'status': 'wait_contact'})
+        self.assertContains(response, '该电话号码的客户已存在')
+
+    def test_merge_duplicates(self):
+        keeper = Customer.objects.get()
+        # 模拟规范化前遗留的重复数据：重复客户没有 phone_key
+        duplicates = [
+            Customer(name='重复1', phone='138 0000 0000', sales_rep=self.rep, source='抖音', contact_count=2,
+                     notes='周末联系', extra_data={'custom_field_1': 'x'}),
+            Customer(name='重复2', phone='13800000000', contact_count=1),
+            Customer(name='孤立', phone='+86 13900000009'),
+            Customer(name='孤立重复', phone='13900000009'),
+        ]
+        # 绕过 CustomerQuerySet.bulk_create，不生成 phone_key
+        QuerySet.bulk_create(Customer.objects.all(), duplicates)
+        CustomerEvent.objects.create(customer=duplicates[0], field='status', old_value='wait_contact', new_value='visited')
+        # 重复客户在 bulk_create 时已让代数失效，这里只看合并本身
+        generation = get_generation(self.rep.pk)
+
+        merged, keyed = merge_duplicate_customers(batch_size=2)
+        self.assertEqual((merged, keyed), (3, 1))
+        # 保留记录得到负责人：写变更记录，该销售的列表页缓存失效
+        self.assertGreater(get_generation(self.rep.pk), generation)
+
+        keeper.refresh_from_db()
+        self.assertEqual(keeper.sales_rep, self.rep)
+        self.assertEqual(keeper.source, '抖音')
+        self.assertEqual(keeper.contact_count, 3)
+        self.assertEqual(keeper.notes, '周末联系')
+        self.assertEqual(keeper.extra_data, {'custom_field_1': 'x'})
+        self.assertEqual(
+            sorted(keeper.events.values_list('field', 'old_value', 'new_value')),
+            [('sales_rep', '', str(self.rep.pk)), ('status', 'wait_contact', 'visited')],
+        )
+        self.assertEqual(Customer.objects.get(phone_key='13900000009').name, '孤立')
+        self.assertFalse(Customer.objects.filter(phone_key__isnull=True).exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PhoneKeyMigrationTests(TransactionTestCase):
+    """迁移 0007 回填 phone_key 后，遗留的重复客户仍能保存和编辑"""
+
+    migrate_from = [('sales', '0006_archivedcustomer')]
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        executor = MigrationExecutor(connection)
+        self.migrate_to = executor.loader.graph.leaf_nodes('sales')
+        executor.migrate(self.migrate_from)
+        old_apps = executor.loader.project_state(self.migrate_from).apps
+        OldCustomer = old_apps.get_model('sales', 'Customer')
+        OldCustomer.objects.create(name='原客户', phone='13800000000')
+        OldCustomer.objects.create(name='遗留重复', phone='+86 138-0000-0000')
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.migrate_to)
+
+    def tearDown(self):
+        # 保证后续测试使用最新的表结构
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        super().tearDown()
+
+    def test_leftover_duplicate_can_be_saved_and_merged(self):
+        keeper = Customer.objects.get(name='原客户')
+        leftover = Customer.objects.get(name='遗留重复')
+        self.assertEqual((keeper.phone_key, leftover.phone_key), ('13800000000', None))
+
+        leftover.notes = '迁移后编辑'
+        leftover.save()
+        leftover.refresh_from_db()
+        self.assertIsNone(leftover.phone_key)
+
+        # 不改号码时表单可以编辑；改成别人的号码仍被拒绝
+        data = {'name': '遗留重复', 'phone': leftover.phone, 'status': 'wait_contact'}
+        self.assertTrue(CustomerForm(data, instance=leftover).is_valid())
+        form = CustomerForm({**data, 'phone': '138 0000 0000'}, instance=Customer.objects.create(
+            name='其他客户', phone='13900000000',
+        ))
+        self.assertIn('该电话号码的客户已存在', form.errors['phone'])
+
+        self.assertEqual(merge_duplicate_customers(), (1, 0))
+        keeper.refresh_from_db()
+        self.assertEqual(keeper.notes, '迁移后编辑')
+
+
+class PhoneLocationTests(CrmTestCase):
+    """离线手机号段归属地"""
+
+    def test_lookup(self):
+        self.assertEqual(locate_phone('+86 138-0000-0000'), ('北京', '北京'))
+        self.assertEqual(locate_phone('13912345678'), ('江苏', '常州'))
+        self.assertEqual(locate_phone('18999999999'), ('新疆', '乌鲁木齐'))
+        self.assertIsNone(locate_phone('010-8888 6666'))
+        self.assertIsNone(locate_phone(''))
+
+    def test_lookup_throughput(self):
+        table = prefix_table()
+        keys = [f'1{3 + i % 7}{i * 7919 % 10 ** 9:09d}' for i in range(100000)]
+        started = time.perf_counter()
+        for key in keys:
+            table.lookup(key)
+        self.assertLess(time.perf_counter() - started, 1.0, '号段查询低于每秒10万次')
+
+    def test_fill_keeps_existing_values(self):
+        customer = Customer(phone='13912345678', province='上海')
+        self.assertEqual(fill_locations([customer]), 1)
+        self.assertEqual((customer.province, customer.city_auto), ('上海', '常州'))
+
+    def test_batch_add_fills_location(self):
+        rep = User.objects.create_user('geo_rep', password='x', is_staff=True)
+        self.client.force_login(rep)
+        self.client.post('/my-customers/', {'action': 'batch_add', 'batch_data': json.dumps([
+            {'name': 'A', 'phone': '13912345678'},
+            {'name': 'B', 'phone': '13800000001', 'city_auto': '天津'},
+        ])})
+        self.assertEqual(
+            set(Customer.objects.values_list('name', 'province', 'city_auto')),
+            {('A', '江苏', '常州'), ('B', '北京', '天津')},
+        )
+
+    def test_backfill_command(self):
+        Customer.objects.create(name='A', phone='13912345678')
+        Customer.objects.create(name='B', phone='19912345678')
+        call_command('backfill_phone_locations', batch_size=1, stdout=StringIO())
+        self.assertEqual(Customer.objects.get(name='A').city_auto, '常州')
+        self.assertEqual(Customer.objects.get(name='B').city_auto, '')
+
+
+class StartupImportTests(SimpleTestCase):
+    """冷启动导入耗时"""
+
+    def test_parse_importtime(self):
+        modules = parse_importtime(
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |     _json\n'
+            'import time:       300 |        420 |   json\n'
+        )
+        self.assertEqual(modules, {'_json': (120, 120), 'json': (300, 420)})
+
+    def test_startup_within_budget_without_lazy_modules(self):
+        output = StringIO()
+        # 测试环境负载不稳定，这里只用宽松的耗时预算，重点检查延迟导入的模块没有在启动时加载
+        call_command('benchmark_startup', repeat=1, budget_ms=5000, stdout=output)
+        self.assertIn('启动耗时均在预算', output.getvalue())
+
+    def test_scheduler_can_be_disabled(self):
+        with mock.patch('sales.tasks.start_scheduler') as start:
+            with mock.patch.dict(os.environ, {'CRM_SCHEDULER': '0'}):
+                self.assertFalse(start_scheduler_once())
+        start.assert_not_called()
+
+
+class AsyncViewTests(CrmTestCase):
+    """异步视图与异步中间件链（ASGI 部署）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('async_admin', 'admin@example.com', 'pass')
+        cls.rep = User.objects.create_user('async_rep', password='x', is_staff=True)
+        seed_customers(9, [cls.rep])
+
+    def setUp(self):
+        super().setUp()
+        reset_query_stats()
+
+    async def login(self, user):
+        await sync_to_async(self.async_client.force_login)(user)
+
+    async def test_reminders_are_returned_once(self):
+        await self.login(self.rep)
+        await Customer.objects.acreate(
+            name='提醒客户', phone='13800000001', sales_rep=self.rep,
+            next_contact_time=timezone.now() + timedelta(minutes=2),
+        )
+        response = await self.async_client.get('/api/pending-reminders/')
+        self.assertEqual([r['customer_name'] for r in response.json()['reminders']], ['提醒客户'])
+        response = await self.async_client.get('/api/pending-reminders/')
+        self.assertEqual(response.json()['reminders'], [])
+
+        # 异步请求中的查询也被统计到
+        stats = {row['url_name']: row for row in get_query_stats()}
+        self.assertGreater(stats['pending_reminders_api']['avg_queries'], 0)
+
+    async def test_login_and_admin_checks(self):
+        response = await self.async_client.get('/api/pending-reminders/')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(settings.LOGIN_URL, response['Location'])
+
+        await self.login(self.rep)
+        self.assertEqual((await self.async_client.get('/api/bulk-jobs/abc/')).status_code, 302)
+        self.assertEqual((await self.async_client.get('/api/export/')).status_code, 302)
+
+    async def test_job_status(self):
+        await self.login(self.admin)
+        await cache.aset(job_key('async'), {'id': 'async', 'status': 'running'})
+        response = await self.async_client.get('/api/bulk-jobs/async/')
+        self.assertEqual(response.json()['status'], 'running')
+        self.assertEqual((await self.async_client.get('/api/bulk-jobs/missing/')).status_code, 404)
+
+    async def test_csv_export_streams_in_chunks(self):
+        await self.login(self.admin)
+        with mock.patch('sales.views.EXPORT_CHUNK_SIZE', 4):
+            response = await self.async_client.get('/api/export/', {'format': 'csv', 'type': 'signed'})
+            self.assertTrue(response.streaming)
+            chunks = [chunk async for chunk in response.streaming_content]
+
+        rows = list(csv.reader(b''.join(chunks).decode('utf-8-sig').splitlines()))
+        signed = [name async for name in Customer.objects.filter(status='signed').values_list('name', flat=True)]
+        self.assertEqual(rows[0][:2], ['姓名', '电话'])
+        self.assertEqual(sorted(row[0] for row in rows[1:]), sorted(signed))
+        self.assertGreater(len(chunks), 1)
+
+        # 发送正文期间的分批查询也计入统计
+        stats = {row['url_name']: row for row in get_query_stats()}
+        self.assertGreaterEqual(stats['export_customers_api']['avg_queries'], len(chunks))
+
+    def test_csv_export_streams_synchronously_under_wsgi(self):
+        # WSGI 部署下异步迭代器会被 Django 整个读入内存后再发送（并发出警告）
+        self.client.force_login(self.admin)
+        with mock.patch('sales.views.EXPORT_CHUNK_SIZE', 4), warnings.catch_warnings():
+            warnings.simplefilter('error')
+            with CaptureQueriesContext(connection) as view_queries:
+                response = self.client.get('/api/export/', {'format': 'csv'})
+            self.assertTrue(response.streaming)
+            self.assertFalse(response.is_async)
+            # 正文发送完之前不记录
+            self.assertNotIn('export_customers_api', [row['url_name'] for row in get_query_stats()])
+            with CaptureQueriesContext(connection) as stream_queries:
+                chunks = list(response.streaming_content)
+
+        rows = list(csv.reader(b''.join(chunks).decode('utf-8-sig').splitlines()))
+        self.assertEqual(len(rows) - 1, Customer.objects.count())
+        self.assertGreater(len(chunks), 1)
+
+        # 发送正文期间的查询也计入统计
+        self.assertGreater(len(stream_queries), 0)
+        stats = {row['url_name']: row for row in get_query_stats()}
+        self.assertEqual(stats['export_customers_api']['requests'], 1)
+        self.assertEqual(stats['export_customers_api']['avg_queries'], len(view_queries) + len(stream_queries))
+
+    def test_unread_streaming_response_is_recorded_on_close(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/export/', {'format': 'csv'})
+        response.close()
+        stats = {row['url_name']: row for row in get_query_stats()}
+        self.assertEqual(stats['export_customers_api']['requests'], 1)
+
+    def test_benchmark_summary(self):
+        result = summarize([30.0, 10.0, 20.0], errors=1, elapsed=2)
+        self.assertEqual((result['requests'], result['errors'], result['rps']), (4, 1, 1.5))
+        self.assertEqual((result['p50_ms'], result['max_ms']), (20.0, 30.0))
+        self.assertEqual(parse_levels('10, 50'), [10, 50])
+        with self.assertRaises(CommandError):
+            parse_levels('0')
+
+    def test_benchmark_reports_status_and_first_error_per_path(self):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                status, body = (200, b'{}') if self.path == '/ok/' else (500, b'<title>ValueError at /fail/</title>')
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            result = run_clients(server.server_address[1], ['/ok/', '/fail/'], '', 2, 2, 5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual((result['requests'], result['errors']), (4, 2))
+        self.assertEqual(result['paths']['/ok/']['statuses'], {'200': 2})
+        self.assertEqual(result['paths']['/fail/']['statuses'], {'500': 2})
+        self.assertEqual(result['paths']['/fail/']['first_error'], 'HTTP 500: ValueError at /fail/')
+        self.assertEqual(result['first_error'], 'HTTP 500: ValueError at /fail/')
+
+
+class LoadTestTests(CrmTestCase):
+    """压测命令按路由名记录每个请求的状态码和首个错误"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rep = User.objects.create_user('load_rep', password='x')
+        seed_customers(3, [cls.rep])
+
+    def test_requests_are_recorded_per_route(self):
+        recorder = RouteRecorder()
+        transport = InProcessTransport(recorder, create_session(self.rep))
+        customer = Customer.objects.first()
+
+        self.assertEqual(transport.get('/api/pending-reminders/'), 200)
+        self.assertEqual(transport.get(f'/customer/{customer.pk}/'), 200)
+        self.assertEqual(transport.get('/customer/999999/'), 404)
+        with mock.patch.object(transport.client, 'get', side_effect=RuntimeError('boom')):
+            self.assertIsNone(transport.get('/my-customers/?page=2'))
+
+        rows = {row['route']: row for row in recorder.rows(wall=1)}
+        self.assertEqual(set(rows), {'pending_reminders_api', 'customer_detail', 'my_customers'})
+        detail = rows['customer_detail']
+        self.assertEqual((detail['requests'], detail['errors']), (2, 1))
+        self.assertEqual(detail['statuses'], {'200': 1, '404': 1})
+        self.assertTrue(detail['first_error'].startswith('HTTP 404'))
+        self.assertEqual(rows['my_customers']['statuses'], {'exception': 1})
+        self.assertEqual(rows['my_customers']['first_error'], 'RuntimeError: boom')
+        self.assertEqual(rows['pending_reminders_api']['errors'], 0)
+
+
+class AdminPerformanceTests(CrmTestCase):
+    """后台客户列表的大数据量设置"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('perf_admin', 'admin@example.com', 'pass')
+        cls.rep = User.objects.create_user('perf_rep', password='x', is_staff=True)
+        seed_customers(30, [cls.rep])
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, url, data=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, data or {})
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in ctx.captured_queries]
+
+    def test_facets_are_cached_and_full_count_skipped(self):
+        for url in ('/admin/sales/customer/', '/admin/sales/highseascustomer/'):
+            response, queries = self.changelist_queries(url)
+            self.assertEqual(sum('DISTINCT' in sql for sql in queries), 2)
+            self.assertContains(response, '抖音')
+
+            response, queries = self.changelist_queries(url)
+            self.assertFalse([sql for sql in queries if 'DISTINCT' in sql])
+            self.assertContains(response, '抖音')
+            # 只有筛选后的一次 COUNT
+            self.assertEqual(sum('COUNT(' in sql for sql in queries), 1)
+
+    def test_search_by_prefix_and_normalized_phone(self):
+        customer = Customer.objects.get(name='客户7')
+        _, queries = self.changelist_queries('/admin/sales/customer/', {'q': '+86 139-0000-0007'})
+        self.assertIn('"phone_key" =', ''.join(queries))
+        response = self.client.get('/admin/sales/customer/', {'q': '+86 139-0000-0007'})
+        self.assertEqual(list(response.context['cl'].result_list), [customer])
+
+        response = self.client.get('/admin/sales/customer/', {'q': '客户2'})
+        names = {c.name for c in response.context['cl'].result_list}
+        self.assertEqual(names, {'客户2', '客户20', '客户21', '客户22', '客户23', '客户24',
+                                 '客户25', '客户26', '客户27', '客户28', '客户29'})
+        # 前缀匹配，不再匹配姓名中间的内容
+        response = self.client.get('/admin/sales/customer/', {'q': '户2'})
+        self.assertEqual(len(response.context['cl'].result_list), 0)
+
+    def test_sales_rep_uses_autocomplete_for_admins(self):
+        customer = Customer.objects.filter(sales_rep=self.rep).first()
+        response = self.client.get(f'/admin/sales/customer/{customer.pk}/change/')
+        self.assertContains(response, 'admin-autocomplete')
+
+        # 销售只能选择自己，使用普通下拉框
+        request = RequestFactory().get('/admin/sales/customer/')
+        request.user = self.rep
+        self.assertEqual(admin.site._registry[Customer].get_autocomplete_fields(request), [])
+
+    def test_paginator_uses_estimate_above_threshold(self):
+        queryset = Customer.objects.all()
+        with mock.patch('sales.admin.estimated_count', return_value=2_000_000):
+            self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 2_000_000)
+        with mock.patch('sales.admin.estimated_count', return_value=50):
+            self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 30)
+
+        estimate = estimated_count(queryset)
+        if connection.vendor == 'postgresql':
+            self.assertIsInstance(estimate, int)
+        else:
+            self.assertIsNone(estimate)
+
+
+class BulkResourceImportTests(CrmTestCase):
+    """后台导入的批量模式"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('resource_admin', 'admin@example.com', 'pass')
+        cls.rep = User.objects.create_user('resource_rep', password='x', is_staff=True)
+        Customer.objects.create(name='老客户', phone='13800000000', sales_rep=cls.rep)
+
+    def dataset(self, count, start=0):
+        dataset = tablib.Dataset(headers=['姓名', '电话', '线索渠道'])
+        for i in range(start, start + count):
+            dataset.append([f'导入{i}', f'137{i:08d}', '抖音'])
+        return dataset
+
+    def import_queries(self, dataset, user):
+        with CaptureQueriesContext(connection) as ctx:
+            result = CustomerResource().import_data(dataset, raise_errors=True, user=user)
+        return result, len(ctx)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        # SQLite 单条语句参数个数有限，行数较多时 bulk_create 会自动再分成几条 INSERT
+        _, small = self.import_queries(self.dataset(5), self.admin)
+        result, large = self.import_queries(self.dataset(50, start=5), self.admin)
+        self.assertEqual(small, large)
+        self.assertEqual(result.totals['new'], 50)
+        self.assertEqual(Customer.objects.filter(name__startswith='导入', sales_rep__isnull=True).count(), 55)
+        # 跳过逐行差异
+        self.assertFalse(any(row.diff for row in result.rows))
+
+    def test_assignment_rules_and_duplicates(self):
+        dataset = tablib.Dataset(headers=['姓名', '电话'])
+        dataset.append(['改名', '+86 138 0000 0000'])
+        dataset.append(['新客户', '13900000001'])
+        dataset.append(['新客户重复', '139-0000-0001'])
+
+        other = User.objects.create_user('resource_rep2', password='x', is_staff=True)
+        result = CustomerResource().import_data(dataset, raise_errors=True, user=other)
+        self.assertEqual((result.totals['new'], result.totals['update']), (1, 2))
+        self.assertEqual(Customer.objects.count(), 2)
+        existing = Customer.objects.get(phone_key='13800000000')
+        self.assertEqual((existing.name, existing.sales_rep), ('改名', other))
+        created = Customer.objects.get(phone_key='13900000001')
+        self.assertEqual((created.name, created.sales_rep), ('新客户重复', other))
+        self.assertEqual(created.province, locate_phone('13900000001')[0])
+        # 换负责人记入变更记录
+        self.assertTrue(CustomerEvent.objects.filter(customer=existing, field='sales_rep').exists())
+
+        CustomerResource().import_data(dataset, raise_errors=True, user=self.admin)
+        self.assertFalse(Customer.objects.filter(sales_rep__isnull=False).exists())
+
+    def test_admin_import_writes_log_entries_in_bulk(self):
+        self.client.force_login(self.admin)
+        upload = SimpleUploadedFile('customers.csv', self.dataset(5).export('csv').encode('utf-8'))
+        response = self.client.get('/admin/sales/customer/import/')
+        csv_format = next(value for value, label in response.context['form'].fields['format'].choices if label == 'csv')
+        response = self.client.post('/admin/sales/customer/import/', {
+            'resource': '0', 'import_file': upload, 'format': csv_format,
+        })
+        confirm = response.context['confirm_form']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/admin/sales/customer/process_import/', {
+                name: confirm[name].value() for name in confirm.fields
+            })
+        self.assertEqual(response.status_code, 302)
+        log_inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "django_admin_log"')]
+        self.assertEqual(len(log_inserts), 1)
+        ids = {int(pk) for pk in LogEntry.objects.values_list('object_id', flat=True)}
+        self.assertEqual(ids, set(Customer.objects.filter(name__startswith='导入').values_list('pk', flat=True)))
+
+
+@override_settings(CHANGE_FEED_LAG_SECONDS=0)
+class ChangeFeedTests(CrmTestCase):
+    """客户变更订阅（增量同步）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('feed_admin', 'admin@example.com', 'pass')
+        cls.rep = User.objects.create_user('feed_rep', password='x')
+        seed_customers(6, [cls.rep])
+
+    def sync(self, cursor=None, limit=1000):
+        """像下游一样翻页读到底，返回 (变更行, 游标)"""
+        rows = []
+        has_more = True
+        while has_more:
+            changes, cursor, has_more = change_page(cursor, limit)
+            rows += change_rows(changes)
+        return rows, cursor
+
+    def test_every_write_path_updates_modified_time(self):
+        old = timezone.now() - timedelta(days=30)
+        Customer.objects.update(updated_at=old)
+        customers = list(Customer.objects.order_by('pk'))
+
+        Customer.objects.filter(pk=customers[0].pk).update(status='signed')
+        customers[1].notes = '批量修改'
+        Customer.objects.bulk_update([customers[1]], ['notes'])
+        customers[2].save()
+        self.assertEqual(set(Customer.objects.filter(updated_at__gt=old).values_list('pk', flat=True)),
+                         {customer.pk for customer in customers[:3]})
+
+    def test_deletes_leave_tombstones_but_archiving_does_not(self):
+        customers = list(Customer.objects.order_by('pk'))
+        deleted = [customers[0].pk, customers[1].pk]
+        customers[0].delete()
+        Customer.objects.filter(pk=customers[1].pk).delete()
+        Customer.objects.filter(pk=customers[2].pk).update(
+            status='signed', last_contact_at=timezone.now() - timedelta(days=400)
+        )
+        self.assertEqual(archive_cold_customers(), 1)
+        self.assertEqual(sorted(CustomerTombstone.objects.values_list('customer_id', flat=True)),
+                         deleted)
+
+    def test_pages_return_only_changes_after_cursor(self):
+        rows, cursor = self.sync(limit=4)
+        self.assertEqual(len(rows), 6)
+        self.assertEqual({row['op'] for row in rows}, {'upsert'})
+
+        # 没有变化时不返回任何数据，游标不变
+        self.assertEqual(self.sync(cursor), ([], cursor))
+
+        customers = list(Customer.objects.order_by('pk'))
+        customers[0].notes = '第一次'
+        customers[0].save()
+        customers[0].notes = '第二次'
+        customers[0].save()
+        deleted = customers[1].pk
+        customers[1].delete()
+        Customer.objects.create(name='新客户', phone='13800000009')
+        rows, cursor = self.sync(cursor, limit=1)
+        self.assertEqual([(row['op'], row['id']) for row in rows], [
+            ('upsert', customers[0].pk),
+            ('delete', deleted),
+            ('upsert', Customer.objects.get(phone='13800000009').pk),
+        ])
+        # 多次修改只返回一次最新数据
+        self.assertEqual(rows[0]['notes'], '第二次')
+        self.assertEqual(self.sync(cursor), ([], cursor))
+
+    def test_deleting_rep_reports_released_customers(self):
+        _, cursor = self.sync()
+        owned = set(Customer.objects.filter(sales_rep=self.rep).values_list('pk', flat=True))
+
+        self.client.force_login(self.admin)
+        self.client.post('/settings/', {'delete_user': '1', 'user_id': self.rep.pk, 'reassign': 'pool'})
+
+        self.assertFalse(User.objects.filter(pk=self.rep.pk).exists())
+        rows, cursor = self.sync(cursor)
+        self.assertEqual({row['id'] for row in rows}, owned)
+        self.assertEqual({row['sales_rep_id'] for row in rows}, {None})
+
+        # 后台等其他途径删除用户同样会报告
+        other = User.objects.create_user('feed_rep2', password='x')
+        customer = Customer.objects.create(name='新负责人', phone='13800000010', sales_rep=other)
+        _, cursor = self.sync(cursor)
+        other.delete()
+        rows, _ = self.sync(cursor)
+        self.assertEqual([(row['id'], row['sales_rep_id']) for row in rows], [(customer.pk, None)])
+
+    @override_settings(CHANGE_FEED_LAG_SECONDS=300)
+    def test_recent_changes_wait_for_lag(self):
+        self.assertEqual(self.sync(), ([], None))
+
+    async def content(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+
+    async def test_api_streams_ndjson_and_csv_pages(self):
+        await sync_to_async(self.async_client.force_login)(self.admin)
+        response = await self.async_client.get('/api/changes/', {'limit': 4})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['X-Has-More'], '1')
+        first = [json.loads(line) for line in (await self.content(response)).splitlines()]
+        self.assertEqual(len(first), 4)
+        self.assertEqual(list(first[0])[:3], ['op', 'changed_at', 'id'])
+
+        await (await Customer.objects.order_by('pk').afirst()).adelete()
+        response = await self.async_client.get('/api/changes/', {'cursor': response['X-Next-Cursor'], 'format': 'csv'})
+        self.assertEqual(response['X-Has-More'], '0')
+        rows = list(csv.DictReader(StringIO(await self.content(response))))
+        self.assertEqual([row['op'] for row in rows], ['upsert', 'upsert', 'delete'])
+        self.assertEqual(rows[-1]['name'], '')
+
+        response = await self.async_client.get('/api/changes/', {'cursor': 'bad'})
+        self.assertEqual(response.status_code, 400)
+        await sync_to_async(self.async_client.force_login)(self.rep)
+        self.assertEqual((await self.async_client.get('/api/changes/')).status_code, 302)
+
+    def test_api_streams_synchronously_under_wsgi(self):
+        self.client.force_login(self.admin)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            response = self.client.get('/api/changes/', {'format': 'csv'})
+            self.assertFalse(response.is_async)
+            rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual(len(rows), 6)
+
+    def test_command_saves_cursor_after_export(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = os.path.join(tmp, 'cursor')
+            output = os.path.join(tmp, 'changes.ndjson')
+            call_command('export_changes', state_file=state_file, output=output, page_size=4, stdout=StringIO())
+            with open(output, encoding='utf-8') as f:
+                self.assertEqual(len(f.readlines()), 6)
+
+            Customer.objects.filter(pk=Customer.objects.order_by('pk').first().pk).update(status='signed')
+            stdout = StringIO()
+            call_command('export_changes', state_file=state_file, format='csv', stdout=stdout, stderr=StringIO())
+            rows = list(csv.DictReader(StringIO(stdout.getvalue())))
+            self.assertEqual([row['status'] for row in rows], ['signed'])
+
+            with open(state_file, 'w', encoding='utf-8') as f:
+                f.write('bad')
+            with self.assertRaises(CommandError):
+                call_command('export_changes', state_file=state_file, stdout=StringIO())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DatabaseBackupTests(TransactionTestCase):
+    """数据库在线备份与恢复（备份读取已提交的数据，测试不在事务中执行）"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('backup_admin', 'admin@example.com', 'pass')
+        self.rep = User.objects.create_user('backup_rep', password='x')
+        seed_customers(5, [self.rep])
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def extract(self, path):
+        """解压 SQLite 备份，返回解压后的文件路径"""
+        extracted = os.path.join(self.directory, 'extracted.sqlite3')
+        with gzip.open(path, 'rb') as source, open(extracted, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        return extracted
+
+    async def test_api_streams_full_database_snapshot(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('仅适用于SQLite')
+        await sync_to_async(self.async_client.force_login)(self.admin)
+        response = await self.async_client.get('/api/backup/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Content-Disposition'], r'crm_backup_\d{8}_\d{6}\.sqlite3\.gz')
+        path = os.path.join(self.directory, 'download.sqlite3.gz')
+        with open(path, 'wb') as f:
+            async for chunk in response.streaming_content:
+                f.write(chunk)
+        self.assertEqual(os.path.getsize(path), int(response['Content-Length']))
+
+        # 不只是客户，用户和扩展数据等全部数据都在快照中
+        with closing(sqlite3.connect(self.extract(path))) as database:
+            self.assertEqual(database.execute('SELECT COUNT(*) FROM sales_customer').fetchone()[0], 5)
+            self.assertEqual(
+                database.execute("SELECT username FROM auth_user WHERE is_superuser").fetchone()[0], 'backup_admin'
+            )
+            self.assertEqual(database.execute('PRAGMA integrity_check').fetchone()[0], 'ok')
+
+        await sync_to_async(self.async_client.force_login)(self.rep)
+        self.assertEqual((await self.async_client.get('/api/backup/')).status_code, 302)
+
+    def test_api_serves_file_response_under_wsgi(self):
+        if connection.vendor == 'postgresql' and not shutil.which(os.path.join(settings.PG_BIN_DIR, 'pg_dump')):
+            self.skipTest('未安装 pg_dump')
+        self.client.force_login(self.admin)
+        # WSGI 部署下由 FileResponse 逐块发送，不能先把整个快照读入内存（Django 会发出警告）
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            response = self.client.get('/api/backup/')
+            self.assertIsInstance(response, FileResponse)
+            filename = response['Content-Disposition'].split('filename=')[1].strip('"')
+            path = os.path.join(self.directory, filename)
+            with open(path, 'wb') as f:
+                for chunk in response.streaming_content:
+                    f.write(chunk)
+            response.close()
+        self.assertEqual(os.path.getsize(path), int(response['Content-Length']))
+        verify_backup(path)
+
+    @override_settings(BACKUP_PAGES_PER_STEP=1)
+    def test_snapshot_copied_in_steps_restores_into_empty_database(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('仅适用于SQLite')
+        path = create_backup(self.directory)
+        verify_backup(path)
+
+        with closing(sqlite3.connect(':memory:')) as restored:
+            restore_sqlite(self.extract(path), restored)
+            self.assertEqual(
+                sorted(row[0] for row in restored.execute('SELECT phone FROM sales_customer')),
+                sorted(Customer.objects.values_list('phone', flat=True)),
+            )
+
+    def test_restore_rejects_damaged_backup(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('仅适用于SQLite')
+        path = create_backup(self.directory)
+        with open(path, 'rb') as f:
+            data = f.read()
+        damaged = os.path.join(self.directory, 'crm_backup_damaged.sqlite3.gz')
+        with open(damaged, 'wb') as f:
+            f.write(data[:len(data) // 2])
+
+        call_command('restore_database', path, check_only=True, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('restore_database', damaged, check_only=True, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('restore_database', damaged, interactive=False, stdout=StringIO())
+        self.assertEqual(Customer.objects.count(), 5)
+
+    def test_backup_inside_transaction_is_refused(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('仅适用于SQLite')
+        with transaction.atomic(), self.assertRaises(CommandError):
+            call_command('backup_database', output_dir=self.directory, stdout=StringIO())
+
+    def test_command_keeps_backups_within_retention(self):
+        if connection.vendor == 'postgresql' and not shutil.which(os.path.join(settings.PG_BIN_DIR, 'pg_dump')):
+            self.skipTest('未安装 pg_dump')
+        old = os.path.join(self.directory, 'crm_backup_20200101_000000.sqlite3.gz')
+        older = os.path.join(self.directory, 'crm_backup_20190101_000000.sqlite3.gz')
+        for age_days, path in ((40, old), (400, older)):
+            with open(path, 'wb') as f:
+                f.write(b'old')
+            mtime = time.time() - age_days * 86400
+            os.utime(path, (mtime, mtime))
+        other = os.path.join(self.directory, 'notes.txt')
+        open(other, 'w').close()
+
+        call_command('backup_database', output_dir=self.directory, retention_days=30, stdout=StringIO())
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual(len(names), 2)
+        self.assertIn('notes.txt', names)
+        verify_backup(os.path.join(self.directory, next(name for name in names if name != 'notes.txt')))
+
+        # 只剩过期备份时保留最新的一份
+        for name in names:
+            if name != 'notes.txt':
+                os.remove(os.path.join(self.directory, name))
+        for path in (old, older):
+            with open(path, 'wb') as f:
+                f.write(b'old')
+            os.utime(path, (time.time() - 400 * 86400,) * 2)
+        os.utime(old, (time.time() - 40 * 86400,) * 2)
+        # 保留天数为 0 表示不清理（定时任务和命令一致）
+        with override_settings(BACKUP_DIR=self.directory, BACKUP_RETENTION_DAYS=0):
+            backup_database()
+        self.assertTrue(os.path.exists(old) and os.path.exists(older))
+        self.assertEqual(sorted(prune_backups(self.directory, 30)), sorted([old, older]))
+
+
+class JobStatsTests(CrmTestCase):
+    """后台任务运行统计"""
+
+    def setUp(self):
+        super().setUp()
+        reset_job_stats()
+        self.addCleanup(reset_job_stats)
+
+    def test_listener_records_runs_failures_and_misfires(self):
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        def reminders():
+            return {'items': 3, 'webhook_ok': 2, 'webhook_failed': 1}
+
+        def broken():
+            raise RuntimeError('数据库不可用')
+
+        scheduler = BackgroundScheduler()
+        now = timezone.now()
+        scheduler.add_job(reminders, 'date', run_date=now, id='check_contact_reminders')
+        scheduler.add_job(broken, 'date', run_date=now, id='recycle_unreachable_leads')
+        scheduler.add_job(reminders, 'date', run_date=now - timedelta(minutes=5), id='archive_cold_leads',
+                          misfire_grace_time=1)
+        track_jobs(scheduler)
+        scheduler.start()
+        try:
+            deadline = time.monotonic() + 10
+            while len(get_job_stats()) < 3 and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            scheduler.shutdown()
+
+        stats = {row['job_id']: row for row in get_job_stats()}
+        reminders_stats = stats['check_contact_reminders']
+        self.assertEqual(reminders_stats['runs'], 1)
+        self.assertEqual(
+            (reminders_stats['items'], reminders_stats['webhook_ok'], reminders_stats['webhook_failed']), (3, 2, 1)
+        )
+        self.assertIsNotNone(reminders_stats['avg_duration_ms'])
+        self.assertGreaterEqual(reminders_stats['max_lag_ms'], 0)
+        self.assertEqual(reminders_stats['last_run']['status'], 'ok')
+
+        failed = stats['recycle_unreachable_leads']
+        self.assertEqual((failed['runs'], failed['failures']), (1, 1))
+        self.assertIn('数据库不可用', failed['last_run']['error'])
+
+        missed = stats['archive_cold_leads']
+        self.assertEqual((missed['runs'], missed['misfires']), (0, 1))
+        self.assertEqual(missed['last_run']['status'], 'misfires')
+
+        # 汇总写入缓存，其他 worker 的管理员接口也能读到
+        self.assertEqual(len(cached_job_stats()['jobs']), 3)
+
+    def test_late_start_is_logged_as_warning(self):
+        job = timed_job('cleanup_expired_sessions', lambda: {'items': 7})
+        scheduled_at = timezone.now() - timedelta(seconds=settings.SCHEDULER_LAG_ALERT_SECONDS + 60)
+        with self.assertLogs('sales.jobstats', level='INFO') as logs:
+            record_run('cleanup_expired_sessions', scheduled_at, counters=job())
+        self.assertTrue(any(record.levelname == 'WARNING' and '启动延迟' in record.getMessage()
+                            for record in logs.records))
+        row = get_job_stats()[0]
+        self.assertEqual(row['items'], 7)
+        self.assertGreater(row['max_lag_ms'], settings.SCHEDULER_LAG_ALERT_SECONDS * 1000)
+
+    def test_stats_api_is_admin_only(self):
+        admin_user = User.objects.create_superuser('stats_admin', 'stats_admin@example.com', 'pass')
+        rep = User.objects.create_user('stats_rep', password='x', is_staff=True)
+        job = timed_job('check_contact_reminders', lambda: {'items': 1})
+        record_run('check_contact_reminders', timezone.now(), counters=job())
+
+        self.client.force_login(rep)
+        self.assertEqual(self.client.get('/api/scheduler-stats/').status_code, 302)
+
+        self.client.force_login(admin_user)
+        response = self.client.get('/api/scheduler-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['jobs'][0]['job_id'], 'check_contact_reminders')
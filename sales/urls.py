@@ -18,6 +18,15 @@ urlpatterns = [
     path('settings/', views.settings_view, name='settings'),
     
     # API endpoints
+    path('api/customers/<str:list_name>/', views.customer_list_api, name='customer_list_api'),
     path('api/pending-reminders/', views.get_pending_reminders_api, name='pending_reminders_api'),
+    path('api/export/', views.export_customers_api, name='export_customers_api'),
+    path('api/changes/', views.customer_changes_api, name='customer_changes_api'),
+    path('api/import/', views.import_customers_api, name='import_customers_api'),
+    path('api/backup/', views.backup_data_api, name='backup_data_api'),
+    path('api/bulk-jobs/<str:job_id>/', views.bulk_job_status_api, name='bulk_job_status_api'),
+    path('api/bulk-jobs/<str:job_id>/cancel/', views.bulk_job_cancel_api, name='bulk_job_cancel_api'),
+    path('api/query-stats/', views.query_stats_api, name='query_stats_api'),
+    path('api/scheduler-stats/', views.scheduler_stats_api, name='scheduler_stats_api'),
 ]
 
@@ -1,20 +1,176 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth import login, logout
-from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.utils import timezone
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.views.decorators.http import condition
+from django.db import IntegrityError, transaction
 from django.db.models import Q
-from django.core.paginator import Paginator
 from datetime import datetime, timedelta
-from openpyxl import Workbook, load_workbook
+from asgiref.sync import sync_to_async
+import base64
+import csv
+import hashlib
 from io import BytesIO
 import json
+import os
+import sqlite3
+import tempfile
 
 from .forms import CaptchaAuthenticationForm, CustomerForm, ImportForm, UserManagementForm
-from .models import Customer
-from .decorators import admin_required, sales_required
+from .models import ArchivedCustomer, Customer, CustomerEvent
+from .archive import restore_customer, search_archive
+from .backup import create_backup
+from .geo import fill_locations
+from .phones import archived_phone_keys, existing_customers, new_phone_keys, normalize_phones
+from .bulk import aget_bulk_job, cancel_bulk_job, start_bulk_job
+from .distribution import STRATEGY_CHOICES, distribute_leads
+from .changefeed import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, ChangeCSVWriter, change_chunks, change_page, change_rows, ndjson_lines,
+)
+from .caching import get_cached_page, get_generation, user_scope
+from .decorators import admin_required, login_required, sales_required
+from .jobstats import cached_job_stats
+from monsterabc_crm.middleware import get_query_stats
+from monsterabc_crm.routers import read_from_replica
+from monsterabc_crm.sqlite import retry_on_locked
+
+
+# 各客户列表的基础查询: 列表名 -> (销售是否只看自己的客户, 筛选条件)
+CUSTOMER_LISTS = {
+    'mine': (True, {}),
+    'high-seas': (False, {'sales_rep__isnull': True}),
+    'key': (True, {'is_key_customer': True}),
+    'visited': (True, {'status': 'visited'}),
+    'signed': (True, {'status': 'signed'}),
+}
+
+
+def customer_list_queryset(user, list_name):
+    """返回某个客户列表中当前用户有权查看的客户"""
+    own_only, filters = CUSTOMER_LISTS[list_name]
+    customers = Customer.objects.filter(**filters)
+    if own_only and not user.is_superuser:
+        customers = customers.filter(sales_rep=user)
+    return customers
+
+
+def apply_customer_filters(customers, params):
+    """按状态、城市、关键词筛选（列表页和JSON接口共用）"""
+    status_filter = params.get('status', '')
+    city_filter = params.get('city', '')
+    search_query = params.get('search', '')
+    
+    if status_filter:
+        customers = customers.filter(status=status_filter)
+    if city_filter:
+        customers = customers.filter(Q(city_auto__icontains=city_filter) | Q(province__icontains=city_filter))
+    if search_query:
+        customers = customers.filter(
+            Q(name__icontains=search_query) | Q(phone__icontains=search_query)
+        )
+    return customers
+
+
+def bulk_edit_updates(post):
+    """从批量修改表单得到合并后的修改内容（一条 UPDATE 同时修改状态和负责人）"""
+    updates = {}
+    status = post.get('status')
+    if status in Customer.STATUS_LABELS:
+        updates['status'] = status
+    
+    sales_rep_id = post.get('sales_rep')
+    if sales_rep_id == '0':
+        updates['sales_rep'] = None
+    elif sales_rep_id and sales_rep_id.isdigit():
+        updates['sales_rep_id'] = int(sales_rep_id)
+    return updates
+
+
+def handle_bulk_action(request, list_name, redirect_name):
+    """
+    列表页的批量修改/删除（仅管理员）
+    
+    apply_to=filtered 时对当前筛选条件下的全部客户在后台分块执行，否则处理勾选的 customer_ids。
+    """
+    action = request.POST.get('action')
+    if action not in ('bulk_edit', 'bulk_delete'):
+        return redirect(redirect_name)
+    
+    updates = bulk_edit_updates(request.POST) if action == 'bulk_edit' else None
+    if action == 'bulk_edit' and not updates:
+        messages.error(request, '请选择要修改的字段')
+        return redirect(redirect_name)
+    
+    if request.POST.get('apply_to') == 'filtered':
+        customers = apply_customer_filters(customer_list_queryset(request.user, list_name), request.GET)
+        job_id = start_bulk_job(
+            request.user, customers, 'delete' if action == 'bulk_delete' else 'update', updates
+        )
+        messages.info(request, '已开始在后台批量处理全部筛选结果，可在页面顶部查看进度或取消')
+        params = request.GET.copy()
+        params['bulk_job'] = job_id
+        return redirect(f'{reverse(redirect_name)}?{params.urlencode()}')
+    
+    customer_ids = request.POST.getlist('customer_ids')
+    if not customer_ids:
+        messages.error(request, '请至少选择一个客户')
+        return redirect(redirect_name)
+    
+    customers = Customer.objects.filter(id__in=customer_ids)
+    if action == 'bulk_delete':
+        # 只统计客户本身，不含级联删除的自定义字段取值
+        count = retry_on_locked(customers.delete)()[1].get(Customer._meta.label, 0)
+        messages.success(request, f'成功删除 {count} 个客户')
+    else:
+        count = retry_on_locked(customers.update)(**updates)
+        messages.success(request, f'成功修改 {count} 个客户')
+    return redirect(redirect_name)
+
+
+def parse_distribution_form(post):
+    """从分配表单读取 (销售ID列表, 策略, 权重, 容量)，每个销售的数值按策略作为权重或容量上限"""
+    strategy = post.get('strategy')
+    if strategy not in dict(STRATEGY_CHOICES):
+        strategy = 'round_robin'
+    rep_ids = [int(rep_id) for rep_id in post.getlist('rep_ids') if rep_id.isdigit()]
+    values = {}
+    for rep_id in rep_ids:
+        value = post.get(f'rep_value_{rep_id}', '')
+        if value.isdigit():
+            values[rep_id] = int(value)
+    weights = values if strategy == 'weighted' else None
+    capacity = values if strategy == 'capacity' else None
+    return rep_ids, strategy, weights, capacity
+
+
+def distribution_message(assigned):
+    names = dict(User.objects.filter(pk__in=assigned).values_list('pk', 'username'))
+    details = '，'.join(f'{names.get(rep_id, rep_id)} {count} 个' for rep_id, count in assigned.items() if count)
+    return f'成功分配 {sum(assigned.values())} 个客户' + (f'（{details}）' if details else '')
+
+
+def handle_distribute(request, list_name, redirect_name):
+    """把勾选的或当前筛选条件下的全部客户分配给多个销售（仅管理员）"""
+    rep_ids, strategy, weights, capacity = parse_distribution_form(request.POST)
+    if not rep_ids:
+        messages.error(request, '请至少选择一个销售')
+        return redirect(redirect_name)
+    
+    customers = apply_customer_filters(customer_list_queryset(request.user, list_name), request.GET)
+    if request.POST.get('apply_to') != 'filtered':
+        customer_ids = request.POST.getlist('customer_ids')
+        if not customer_ids:
+            messages.error(request, '请至少选择一个客户')
+            return redirect(redirect_name)
+        customers = customers.filter(id__in=customer_ids)
+    
+    assigned = retry_on_locked(distribute_leads)(customers, rep_ids, strategy, weights, capacity)
+    messages.success(request, distribution_message(assigned))
+    return redirect(redirect_name)
 
 
 def login_view(request):
@@ -59,7 +215,7 @@ def dashboard_view(request):
         future_tasks = Customer.objects.filter(
             sales_rep=user,
             next_contact_time__gte=now
-        ).order_by('next_contact_time')
+        ).order_by('next_contact_time').select_related('sales_rep')
     
     # 按日期分组
     from itertools import groupby
@@ -106,11 +262,14 @@ def my_customers_view(request):
                 skipped_count = 0
                 error_messages = []
                 
-                for customer_data in customers_data:
+                # 整批规范化电话并一次查出已存在的号码，空号码和重复号码对应 None
+                phone_keys = new_phone_keys(data.get('phone', '') for data in customers_data)
+                
+                for customer_data, phone_key in zip(customers_data, phone_keys):
                     try:
-                        # 检查电话是否已存在
+                        # 跳过已存在（规范化后相同）的电话
                         phone = customer_data.get('phone', '').strip()
-                        if Customer.objects.filter(phone=phone).exists():
+                        if phone_key is None:
                             skipped_count += 1
                             continue
                         
@@ -144,7 +303,10 @@ def my_customers_view(request):
                         # 保存扩展数据
                         customer.extra_data = customer_data.get('extra_data', {})
                         
-                        customer.save()
+                        # 按电话号段补全省份和城市
+                        fill_locations([customer])
+                        
+                        retry_on_locked(customer.save)()
                         created_count += 1
                         
                     except Exception as e:
@@ -171,37 +333,7 @@ def my_customers_view(request):
     
     # 处理批量操作（仅管理员）
     if request.method == 'POST' and user.is_superuser:
-        action = request.POST.get('action')
-        customer_ids = request.POST.getlist('customer_ids')
-        
-        if not customer_ids:
-            messages.error(request, '请至少选择一个客户')
-            return redirect('my_customers')
-        
-        if action == 'bulk_delete':
-            # 批量删除
-            count = Customer.objects.filter(id__in=customer_ids).delete()[0]
-            messages.success(request, f'成功删除 {count} 个客户')
-            return redirect('my_customers')
-            
-        elif action == 'bulk_edit':
-            # 批量修改
-            status = request.POST.get('status')
-            sales_rep_id = request.POST.get('sales_rep')
-            
-            customers = Customer.objects.filter(id__in=customer_ids)
-            updated_count = len(customer_ids)
-            
-            if status:
-                customers.update(status=status)
-            
-            if sales_rep_id == '0':
-                customers.update(sales_rep=None)
-            elif sales_rep_id:
-                customers.update(sales_rep_id=sales_rep_id)
-            
-            messages.success(request, f'成功修改 {updated_count} 个客户')
-            return redirect('my_customers')
+        return handle_bulk_action(request, 'mine', 'my_customers')
     
     # 获取筛选和排序参数
     status_filter = request.GET.get('status', '')
@@ -211,21 +343,8 @@ def my_customers_view(request):
     sort_order = request.GET.get('sort_order', 'asc')
     page_number = request.GET.get('page', request.session.get('last_customer_page', 1))
     
-    # 基础查询
-    if user.is_superuser:
-        customers = Customer.objects.all()
-    else:
-        customers = Customer.objects.filter(sales_rep=user)
-    
-    # 应用筛选
-    if status_filter:
-        customers = customers.filter(status=status_filter)
-    if city_filter:
-        customers = customers.filter(Q(city_auto__icontains=city_filter) | Q(province__icontains=city_filter))
-    if search_query:
-        customers = customers.filter(
-            Q(name__icontains=search_query) | Q(phone__icontains=search_query)
-        )
+    # 基础查询并应用筛选
+    customers = apply_customer_filters(customer_list_queryset(user, 'mine'), request.GET)
     
     # 应用排序
     if sort_by:
@@ -258,12 +377,12 @@ def my_customers_view(request):
         # 默认按创建时间倒序排列
         customers = customers.order_by('-created_at')
     
-    # 分页处理
-    paginator = Paginator(customers, 100)  # 每页100条记录
-    customers_page = paginator.get_page(page_number)
+    # 分页处理（每页100条记录，查询结果按用户和筛选条件缓存）
+    customers_page = get_cached_page(user, 'my_customers', customers, request.GET, page_number)
     
-    # 保存当前页码到session
-    request.session['last_customer_page'] = page_number
+    # 保存当前页码到session（页码未变化时不修改会话，避免每次请求都写数据库）
+    if request.session.get('last_customer_page') != page_number:
+        request.session['last_customer_page'] = page_number
     
     context = {
         'customers': customers_page,
@@ -274,6 +393,9 @@ def my_customers_view(request):
         'sort_by': sort_by,
         'sort_order': sort_order,
         'all_users': User.objects.filter(is_staff=True) if user.is_superuser else [],
+        'bulk_job': request.GET.get('bulk_job', '') if user.is_superuser else '',
+        # 搜索时同时查找已归档的客户
+        'archived_customers': search_archive(user, search_query),
     }
     
     return render(request, 'my_customers.html', context)
@@ -282,16 +404,22 @@ def my_customers_view(request):
 @sales_required
 def customer_detail_view(request, pk=None):
     """客户详情/编辑页"""
+    archived = None
     if pk:
-        customer = get_object_or_404(Customer, pk=pk)
+        customer = Customer.objects.filter(pk=pk).first()
+        if customer is None:
+            # 主表中没有时查归档表
+            archived = get_object_or_404(ArchivedCustomer, pk=pk)
+            customer = archived.to_customer()
         # 权限检查:非管理员只能编辑自己的客户
-        if not request.user.is_superuser and customer.sales_rep != request.user:
+        if not request.user.is_superuser and customer.sales_rep_id != request.user.pk:
             messages.error(request, '您没有权限编辑此客户')
             return redirect('my_customers')
     else:
         customer = None
     
     if request.method == 'POST':
+        # 归档客户先用未保存的实例校验，校验和权限检查都通过后再恢复到主表
         form = CustomerForm(request.POST, instance=customer)
         if form.is_valid():
             customer = form.save(commit=False)
@@ -305,6 +433,8 @@ def customer_detail_view(request, pk=None):
                         'form': form,
                         'customer': customer,
                         'is_edit': pk is not None,
+                        'is_archived': archived is not None,
+                        'events': CustomerEvent.timeline(pk) if pk else [],
                     }
                     return render(request, 'customer_detail.html', context)
             
@@ -312,11 +442,20 @@ def customer_detail_view(request, pk=None):
             if not customer.pk and not customer.sales_rep and not request.user.is_superuser:
                 customer.sales_rep = request.user
             
-            customer.save()
-            messages.success(request, '客户信息保存成功')
-            # 返回到之前浏览的页码
-            last_page = request.session.get('last_customer_page', 1)
-            return redirect(f'/my-customers/?page={last_page}')
+            try:
+                # 恢复和保存在同一事务中，保存失败时归档记录保持不变
+                with transaction.atomic():
+                    if archived is not None:
+                        restore_customer(pk)
+                    customer.save()
+            except IntegrityError:
+                # 校验之后其他请求抢先使用了该号码（或归档客户的原号码已被其他客户占用）
+                form.add_error('phone', '该电话号码已被其他客户使用')
+            else:
+                messages.success(request, '客户信息保存成功')
+                # 返回到之前浏览的页码
+                last_page = request.session.get('last_customer_page', 1)
+                return redirect(f'/my-customers/?page={last_page}')
     else:
         form = CustomerForm(instance=customer)
     
@@ -324,6 +463,9 @@ def customer_detail_view(request, pk=None):
         'form': form,
         'customer': customer,
         'is_edit': pk is not None,
+        'is_archived': archived is not None,
+        # 状态、负责人、下次联系时间的变更时间线
+        'events': CustomerEvent.timeline(pk) if pk else [],
     }
     
     return render(request, 'customer_detail.html', context)
@@ -336,61 +478,24 @@ def high_seas_view(request):
     status_filter = request.GET.get('status', '')
     search_query = request.GET.get('search', '')
     
-    # 基础查询:sales_rep为空
-    customers = Customer.objects.filter(sales_rep__isnull=True)
-    
-    # 应用筛选
-    if status_filter:
-        customers = customers.filter(status=status_filter)
-    if search_query:
-        customers = customers.filter(
-            Q(name__icontains=search_query) | Q(phone__icontains=search_query)
-        )
+    # 基础查询:sales_rep为空，并应用筛选
+    customers = apply_customer_filters(customer_list_queryset(request.user, 'high-seas'), request.GET)
     
     # 处理认领操作
     if request.method == 'POST' and 'claim' in request.POST:
         customer_ids = request.POST.getlist('customer_ids')
         if customer_ids:
-            Customer.objects.filter(id__in=customer_ids, sales_rep__isnull=True).update(
+            claimed = retry_on_locked(Customer.objects.filter(id__in=customer_ids, sales_rep__isnull=True).update)(
                 sales_rep=request.user
             )
-            messages.success(request, f'成功认领 {len(customer_ids)} 个客户')
+            messages.success(request, f'成功认领 {claimed} 个客户')
             return redirect('high_seas')
     
     # 处理批量操作（仅管理员）
     if request.method == 'POST' and request.user.is_superuser:
-        action = request.POST.get('action')
-        customer_ids = request.POST.getlist('customer_ids')
-        
-        if not customer_ids:
-            messages.error(request, '请至少选择一个客户')
-            return redirect('high_seas')
-        
-        if action == 'bulk_delete':
-            # 批量删除
-            count = Customer.objects.filter(id__in=customer_ids).delete()[0]
-            messages.success(request, f'成功删除 {count} 个客户')
-            return redirect('high_seas')
-            
-        elif action == 'bulk_edit':
-            # 批量修改
-            status = request.POST.get('status')
-            sales_rep_id = request.POST.get('sales_rep')
-            
-            customers_to_update = Customer.objects.filter(id__in=customer_ids)
-            updated_count = len(customer_ids)
-            
-            if status:
-                customers_to_update.update(status=status)
-            
-            if sales_rep_id == '0':
-                # 保持公海（不修改）
-                pass
-            elif sales_rep_id:
-                customers_to_update.update(sales_rep_id=sales_rep_id)
-            
-            messages.success(request, f'成功修改 {updated_count} 个客户')
-            return redirect('high_seas')
+        if request.POST.get('action') == 'distribute':
+            return handle_distribute(request, 'high-seas', 'high_seas')
+        return handle_bulk_action(request, 'high-seas', 'high_seas')
     
     context = {
         'customers': customers,
@@ -398,6 +503,8 @@ def high_seas_view(request):
         'current_status': status_filter,
         'search_query': search_query,
         'all_users': User.objects.filter(is_staff=True) if request.user.is_superuser else [],
+        'bulk_job': request.GET.get('bulk_job', '') if request.user.is_superuser else '',
+        'strategy_choices': STRATEGY_CHOICES,
     }
     
     return render(request, 'high_seas_v2.html', context)
@@ -409,17 +516,11 @@ def visited_customers_view(request):
     user = request.user
     
     # 筛选已到访状态的客户
-    if user.is_superuser:
-        customers = Customer.objects.filter(status='visited')
-    else:
-        customers = Customer.objects.filter(status='visited', sales_rep=user)
+    customers = customer_list_queryset(user, 'visited').select_related('sales_rep')
     
     # 搜索
     search_query = request.GET.get('search', '')
-    if search_query:
-        customers = customers.filter(
-            Q(name__icontains=search_query) | Q(phone__icontains=search_query)
-        )
+    customers = apply_customer_filters(customers, {'search': search_query})
     
     context = {
         'customers': customers,
@@ -435,21 +536,17 @@ def signed_customers_view(request):
     user = request.user
     
     # 筛选已签约状态的客户
-    if user.is_superuser:
-        customers = Customer.objects.filter(status='signed')
-    else:
-        customers = Customer.objects.filter(status='signed', sales_rep=user)
+    customers = customer_list_queryset(user, 'signed').select_related('sales_rep')
     
     # 搜索
     search_query = request.GET.get('search', '')
-    if search_query:
-        customers = customers.filter(
-            Q(name__icontains=search_query) | Q(phone__icontains=search_query)
-        )
+    customers = apply_customer_filters(customers, {'search': search_query})
     
     context = {
         'customers': customers,
         'search_query': search_query,
+        # 搜索时同时查找已归档的客户
+        'archived_customers': search_archive(user, search_query),
     }
     
     return render(request, 'signed.html', context)
@@ -461,13 +558,7 @@ def key_customers_view(request):
     user = request.user
     
     # 基础查询:标记为重点客户
-    if user.is_superuser:
-        customers = Customer.objects.filter(is_key_customer=True)
-    else:
-        customers = Customer.objects.filter(
-            sales_rep=user,
-            is_key_customer=True
-        )
+    customers = customer_list_queryset(user, 'key')
     
     # 获取筛选和排序参数
     status_filter = request.GET.get('status', '')
@@ -478,14 +569,7 @@ def key_customers_view(request):
     page_number = request.GET.get('page', 1)
     
     # 应用筛选
-    if status_filter:
-        customers = customers.filter(status=status_filter)
-    if city_filter:
-        customers = customers.filter(Q(city_auto__icontains=city_filter) | Q(province__icontains=city_filter))
-    if search_query:
-        customers = customers.filter(
-            Q(name__icontains=search_query) | Q(phone__icontains=search_query)
-        )
+    customers = apply_customer_filters(customers, request.GET)
     
     # 应用排序
     if sort_by:
@@ -511,9 +595,8 @@ def key_customers_view(request):
     else:
         customers = customers.order_by('-created_at')
     
-    # 分页处理
-    paginator = Paginator(customers, 100)
-    customers_page = paginator.get_page(page_number)
+    # 分页处理（查询结果按用户和筛选条件缓存）
+    customers_page = get_cached_page(user, 'key_customers', customers, request.GET, page_number)
     
     context = {
         'customers': customers_page,
@@ -529,8 +612,8 @@ def key_customers_view(request):
 
 
 @login_required
-def get_pending_reminders_api(request):
-    """获取待提醒的预约任务API"""
+async def get_pending_reminders_api(request):
+    """获取待提醒的预约任务API（异步视图，页面每分钟轮询一次）"""
     user = request.user
     now = timezone.now()
     time_window = timedelta(minutes=5)
@@ -539,16 +622,25 @@ def get_pending_reminders_api(request):
     query = Customer.objects.filter(
         next_contact_time__gte=now - time_window,
         next_contact_time__lte=now + time_window
-    )
+    ).only('id', 'name', 'phone', 'status', 'next_contact_time', 'notes')
     
     if not user.is_superuser:
         query = query.filter(sales_rep=user)
     
+    # 已提醒标记: {"客户ID_预约时间": 提醒时间戳}，2小时后过期
+    # 统一放在一个键中，只在有新提醒或清理过期标记时才修改会话
+    # （会话已在登录校验时加载，这里只读写内存中的数据，由会话中间件保存）
+    reminded = dict(request.session.get('reminded', {}))
+    now_ts = int(now.timestamp())
+    expired = [key for key, ts in reminded.items() if now_ts - ts > 7200]
+    for key in expired:
+        del reminded[key]
+    
     reminders = []
-    for customer in query:
+    async for customer in query:
         # 检查是否已经提醒过(使用session标记)
-        session_key = f'reminded_{customer.id}_{customer.next_contact_time.strftime("%Y%m%d%H%M")}'
-        if not request.session.get(session_key):
+        reminder_key = f'{customer.id}_{customer.next_contact_time.strftime("%Y%m%d%H%M")}'
+        if reminder_key not in reminded:
             reminders.append({
                 'customer_id': customer.id,
                 'customer_name': customer.name,
@@ -557,13 +649,190 @@ def get_pending_reminders_api(request):
                 'phone': customer.phone,
                 'notes': customer.notes or ''
             })
-            # 标记已提醒(2小时后过期)
-            request.session[session_key] = True
-            request.session.set_expiry(7200)
+            reminded[reminder_key] = now_ts
+    
+    if reminders or expired:
+        request.session['reminded'] = reminded
     
     return JsonResponse({'reminders': reminders})
 
 
+# JSON接口可返回的字段（fields 参数），sales_rep 返回负责人ID
+CUSTOMER_API_FIELDS = [
+    'id', 'name', 'phone', 'status', 'status_label', 'source', 'city_auto', 'region_manual',
+    'province', 'contact_count', 'next_contact_time', 'last_contact_at', 'created_at',
+    'is_key_customer', 'notes', 'extra_data', 'sales_rep', 'sales_rep_name',
+]
+CUSTOMER_API_DEFAULT_FIELDS = [
+    'id', 'name', 'phone', 'status', 'status_label', 'city_auto', 'next_contact_time', 'created_at',
+]
+# 只读取需要的列: 派生字段 -> 依赖的数据库字段
+CUSTOMER_API_COLUMNS = {
+    'id': [],
+    'status_label': ['status'],
+    'sales_rep_name': ['sales_rep', 'sales_rep__username'],
+}
+# 游标分页支持的排序字段（均不为空）
+CUSTOMER_API_SORT_FIELDS = ['created_at', 'last_contact_at', 'name', 'contact_count', 'id']
+
+
+def encode_cursor(value, pk):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, pk]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def cursor_int(value):
+    """游标中的整数（主键、联系次数），超出数据库整数范围时抛出 ValueError"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError('cursor')
+    value = int(value)
+    if not -2 ** 63 <= value < 2 ** 63:
+        raise ValueError('cursor')
+    return value
+
+
+def decode_cursor(cursor, sort_field):
+    """解析游标，返回(排序字段值, 主键)，排序字段值转换为该字段的类型，格式错误时抛出 ValueError"""
+    from django.utils.dateparse import parse_datetime
+    
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if sort_field in ('created_at', 'last_contact_at'):
+            value = parse_datetime(value) if isinstance(value, str) else None
+            if value is None:
+                raise ValueError('cursor')
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+        elif sort_field == 'name':
+            if not isinstance(value, str):
+                raise ValueError('cursor')
+        else:
+            value = cursor_int(value)
+        pk = cursor_int(pk)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('cursor')
+    return value, pk
+
+
+def customer_list_etag(request, list_name):
+    """ETag 由列表所属范围的缓存代数和查询参数决定，数据未变化时无需查询数据库"""
+    if list_name not in CUSTOMER_LISTS:
+        return None
+    own_only = CUSTOMER_LISTS[list_name][0]
+    generation = get_generation(user_scope(request.user, own_only))
+    raw = f'{list_name}:{request.user.pk}:{generation}:{request.GET.urlencode()}'
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+@sales_required
+@condition(etag_func=customer_list_etag)
+def customer_list_api(request, list_name):
+    """
+    客户列表JSON接口（mine / high-seas / key / visited / signed）
+    
+    参数: status/city/search 与列表页相同；fields 逗号分隔的返回字段；
+    sort_by/sort_order 排序；limit 每页条数（最多200）；cursor 上一页返回的 next_cursor。
+    """
+    if list_name not in CUSTOMER_LISTS:
+        return JsonResponse({'error': f'未知的客户列表: {list_name}'}, status=404)
+    
+    fields = [f for f in request.GET.get('fields', '').split(',') if f] or CUSTOMER_API_DEFAULT_FIELDS
+    unknown = [f for f in fields if f not in CUSTOMER_API_FIELDS]
+    if unknown:
+        return JsonResponse({'error': f'不支持的字段: {", ".join(unknown)}'}, status=400)
+    
+    sort_by = request.GET.get('sort_by', 'created_at')
+    if sort_by not in CUSTOMER_API_SORT_FIELDS:
+        return JsonResponse({'error': f'不支持的排序字段: {sort_by}'}, status=400)
+    descending = request.GET.get('sort_order', 'desc') != 'asc'
+    
+    try:
+        limit = min(max(int(request.GET.get('limit', 50)), 1), 200)
+    except ValueError:
+        return JsonResponse({'error': 'limit 必须是整数'}, status=400)
+    
+    customers = apply_customer_filters(customer_list_queryset(request.user, list_name), request.GET)
+    
+    # 按(排序字段, id)做游标分页，翻页不受新增数据影响，也不需要 COUNT
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            value, pk = decode_cursor(cursor, sort_by)
+        except ValueError:
+            return JsonResponse({'error': '无效的 cursor'}, status=400)
+        op = 'lt' if descending else 'gt'
+        customers = customers.filter(
+            Q(**{f'{sort_by}__{op}': value}) | Q(**{sort_by: value, f'pk__{op}': pk})
+        )
+    prefix = '-' if descending else ''
+    customers = customers.order_by(f'{prefix}{sort_by}', f'{prefix}pk')
+    
+    # 字段投影: 只查询需要的列
+    columns = {sort_by}
+    for field in fields:
+        columns.update(CUSTOMER_API_COLUMNS.get(field, [field]))
+    columns.discard('id')
+    if 'sales_rep_name' in fields:
+        customers = customers.select_related('sales_rep')
+    customers = customers.only(*columns)
+    
+    rows = list(customers[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    results = []
+    for customer in rows:
+        item = {}
+        for field in fields:
+            if field == 'sales_rep':
+                item[field] = customer.sales_rep_id
+            elif field == 'sales_rep_name':
+                item[field] = customer.sales_rep.username if customer.sales_rep_id else None
+            else:
+                item[field] = getattr(customer, field)
+        results.append(item)
+    
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_by), last.pk)
+    
+    return JsonResponse({'results': results, 'next_cursor': next_cursor})
+
+
+@admin_required
+async def bulk_job_status_api(request, job_id):
+    """批量任务进度API - 仅管理员（异步视图，进度条每秒轮询一次）"""
+    job = await aget_bulk_job(job_id)
+    if job is None:
+        return JsonResponse({'error': '任务不存在或已过期'}, status=404)
+    return JsonResponse(job)
+
+
+@admin_required
+def bulk_job_cancel_api(request, job_id):
+    """取消批量任务API - 仅管理员（POST）"""
+    if request.method != 'POST':
+        return JsonResponse({'error': '仅支持POST请求'}, status=405)
+    if not cancel_bulk_job(job_id):
+        return JsonResponse({'error': '任务不存在或已过期'}, status=404)
+    return JsonResponse({'cancelled': True})
+
+
+@admin_required
+def query_stats_api(request):
+    """按URL汇总的数据库查询统计API - 仅管理员"""
+    return JsonResponse({'stats': get_query_stats()})
+
+
+@admin_required
+def scheduler_stats_api(request):
+    """后台任务运行统计API（启动延迟、耗时、处理数量、错过执行次数）- 仅管理员"""
+    return JsonResponse(cached_job_stats())
+
+
 @admin_required
 def settings_view(request):
     """系统设置页 - 仅管理员"""
@@ -579,11 +848,25 @@ def settings_view(request):
     else:
         user_form = UserManagementForm()
     
-    # 处理用户删除
+    # 处理用户删除（离职交接：客户退回公海，或分配给其他销售）
     if request.method == 'POST' and 'delete_user' in request.POST:
         user_id = request.POST.get('user_id')
         if user_id and int(user_id) != request.user.id:
-            User.objects.filter(id=user_id).delete()
+            reassign = request.POST.get('reassign', 'pool')
+            if reassign in dict(STRATEGY_CHOICES):
+                other_reps = User.objects.filter(
+                    is_active=True, is_staff=True, is_superuser=False
+                ).exclude(id=user_id).values_list('pk', flat=True)
+                assigned = retry_on_locked(distribute_leads)(
+                    Customer.objects.filter(sales_rep_id=user_id), list(other_reps), reassign
+                )
+                if assigned:
+                    messages.success(request, distribution_message(assigned))
+            with transaction.atomic():
+                # 剩余客户退回公海：显式批量修改，记录负责人变更并更新修改时间，
+                # 不依赖外键的 SET_NULL（它直接改表，不经过 CustomerQuerySet.update）
+                Customer.objects.filter(sales_rep_id=user_id).update(sales_rep=None)
+                User.objects.filter(id=user_id).delete()
             messages.success(request, '用户删除成功')
             return redirect('settings')
     
@@ -595,18 +878,33 @@ def settings_view(request):
     return render(request, 'settings.html', context)
 
 
-@admin_required
-def export_customers_api(request):
-    """导出客户数据API - 仅管理员"""
-    # 获取导出类型
-    export_type = request.GET.get('type', 'all')
-    
-    if export_type == 'signed':
-        customers = Customer.objects.filter(status='signed')
-        filename = '已签约客户.xlsx'
-    else:
-        customers = Customer.objects.all()
-        filename = '全部客户.xlsx'
+# 导出文件的表头，与 export_row 的列一一对应
+EXPORT_HEADERS = ['姓名', '电话', '状态', '负责人', '线索渠道', '自动定位城市',
+                  '手动填写地域', '沟通次数', '下次联系时间', '线索创建时间', '备注信息']
+# CSV 流式导出每次从数据库读取、向客户端发送的行数
+EXPORT_CHUNK_SIZE = 2000
+
+
+def export_row(customer):
+    """一个客户（主表或归档表）在导出文件中的一行"""
+    return [
+        customer.name,
+        customer.phone,
+        customer.get_status_display(),
+        customer.sales_rep.username if customer.sales_rep else '公海',
+        customer.source,
+        customer.city_auto,
+        customer.region_manual,
+        customer.contact_count,
+        customer.next_contact_time.strftime('%Y-%m-%d %H:%M:%S') if customer.next_contact_time else '',
+        customer.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        customer.extra_data.get('note', ''),  # 备注信息
+    ]
+
+
+def customers_workbook_response(querysets, filename):
+    """把若干客户查询集（主表或归档表）依次写入一个Excel文件并返回下载响应"""
+    from openpyxl import Workbook
     
     # 创建Excel文件
     wb = Workbook()
@@ -614,26 +912,12 @@ def export_customers_api(request):
     ws.title = "客户数据"
     
     # 表头
-    headers = ['姓名', '电话', '状态', '负责人', '线索渠道', '自动定位城市', 
-               '手动填写地域', '沟通次数', '下次联系时间', '线索创建时间', '备注信息']
-    ws.append(headers)
+    ws.append(EXPORT_HEADERS)
     
     # 数据行
-    for customer in customers:
-        row = [
-            customer.name,
-            customer.phone,
-            customer.get_status_display(),
-            customer.sales_rep.username if customer.sales_rep else '公海',
-            customer.source,
-            customer.city_auto,
-            customer.region_manual,
-            customer.contact_count,
-            customer.next_contact_time.strftime('%Y-%m-%d %H:%M:%S') if customer.next_contact_time else '',
-            customer.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            customer.extra_data.get('note', ''),  # 备注信息
-        ]
-        ws.append(row)
+    for customers in querysets:
+        for customer in customers.select_related('sales_rep'):
+            ws.append(export_row(customer))
     
     # 保存到BytesIO
     output = BytesIO()
@@ -650,9 +934,195 @@ def export_customers_api(request):
     return response
 
 
+class EchoBuffer:
+    """csv.writer 的写入目标，直接返回写入的内容"""
+    
+    def write(self, value):
+        return value
+
+
+def served_over_asgi(request):
+    """
+    请求是否由 ASGI 服务器处理
+    
+    WSGI 部署下流式响应必须使用同步迭代器：异步迭代器会被 Django 先全部读入内存再发送。
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def export_queryset(customers):
+    return customers.select_related('sales_rep').order_by('pk')
+
+
+async def stream_customers_csv(querysets, replica=False):
+    """
+    按块从数据库读取客户并逐块生成CSV内容（ASGI 部署）
+    
+    边读边发，内存中只保留一块数据，导出期间不占用 worker。
+    响应内容在中间件返回之后才生成，需要读副本时在这里重新设置。
+    """
+    writer = csv.writer(EchoBuffer())
+    with read_from_replica(replica):
+        # 带BOM，Excel 打开时按 UTF-8 识别中文
+        yield '\ufeff' + writer.writerow(EXPORT_HEADERS)
+        for customers in querysets:
+            lines = []
+            async for customer in export_queryset(customers).aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+                lines.append(writer.writerow(export_row(customer)))
+                if len(lines) >= EXPORT_CHUNK_SIZE:
+                    yield ''.join(lines)
+                    lines = []
+            if lines:
+                yield ''.join(lines)
+
+
+def iter_customers_csv(querysets, replica=False):
+    """stream_customers_csv 的同步版本（WSGI 部署），由处理请求的 worker 线程边读边发"""
+    writer = csv.writer(EchoBuffer())
+    with read_from_replica(replica):
+        yield '\ufeff' + writer.writerow(EXPORT_HEADERS)
+        for customers in querysets:
+            lines = []
+            for customer in export_queryset(customers).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                lines.append(writer.writerow(export_row(customer)))
+                if len(lines) >= EXPORT_CHUNK_SIZE:
+                    yield ''.join(lines)
+                    lines = []
+            if lines:
+                yield ''.join(lines)
+
+
+@admin_required
+async def export_customers_api(request):
+    """
+    导出客户数据API - 仅管理员，archived=1 时包含已归档的客户
+    
+    默认导出Excel；format=csv 时流式导出CSV，适合数据量大的全量导出。
+    """
+    # 获取导出类型
+    export_type = request.GET.get('type', 'all')
+    
+    if export_type == 'signed':
+        querysets = [Customer.objects.filter(status='signed'), ArchivedCustomer.objects.filter(status='signed')]
+        filename = '已签约客户'
+    else:
+        querysets = [Customer.objects.all(), ArchivedCustomer.objects.all()]
+        filename = '全部客户'
+    
+    if request.GET.get('archived') != '1':
+        querysets = querysets[:1]
+    
+    if request.GET.get('format') == 'csv':
+        stream = stream_customers_csv if served_over_asgi(request) else iter_customers_csv
+        response = StreamingHttpResponse(
+            stream(querysets, replica=getattr(request, 'read_from_replica', False)),
+            content_type='text/csv; charset=utf-8',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+        return response
+    
+    # openpyxl 生成文件是同步的CPU操作，放到线程中执行
+    return await sync_to_async(customers_workbook_response)(querysets, f'{filename}.xlsx')
+
+
+async def stream_changes(changes, output_format):
+    """分块读取一页变更的客户数据并逐块生成 NDJSON / CSV 内容（ASGI 部署）"""
+    writer = ChangeCSVWriter()
+    if output_format == 'csv':
+        yield writer.header()
+    for chunk in change_chunks(changes):
+        rows = await sync_to_async(change_rows)(chunk)
+        yield writer.lines(rows) if output_format == 'csv' else ndjson_lines(rows)
+
+
+def iter_changes(changes, output_format):
+    """stream_changes 的同步版本（WSGI 部署）"""
+    writer = ChangeCSVWriter()
+    if output_format == 'csv':
+        yield writer.header()
+    for chunk in change_chunks(changes):
+        rows = change_rows(chunk)
+        yield writer.lines(rows) if output_format == 'csv' else ndjson_lines(rows)
+
+
+@admin_required
+async def customer_changes_api(request):
+    """
+    客户变更订阅API - 仅管理员，供BI等下游增量同步（见 changefeed.py）
+    
+    参数: cursor 上次返回的游标（为空时从头开始）；limit 每页条数（默认1000，最多10000）；
+    format=ndjson（默认）或 csv。每行一个变更，op 为 upsert 或 delete，
+    下一页游标和是否还有更多在响应头 X-Next-Cursor / X-Has-More 中。
+    """
+    output_format = request.GET.get('format', 'ndjson')
+    if output_format not in ('ndjson', 'csv'):
+        return JsonResponse({'error': f'不支持的格式: {output_format}'}, status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'limit 必须是整数'}, status=400)
+    
+    try:
+        changes, next_cursor, has_more = await sync_to_async(change_page)(request.GET.get('cursor'), limit)
+    except ValueError:
+        return JsonResponse({'error': '无效的 cursor'}, status=400)
+    
+    content_type = 'text/csv; charset=utf-8' if output_format == 'csv' else 'application/x-ndjson'
+    stream = stream_changes if served_over_asgi(request) else iter_changes
+    response = StreamingHttpResponse(stream(changes, output_format), content_type=content_type)
+    response['X-Next-Cursor'] = next_cursor or ''
+    response['X-Has-More'] = '1' if has_more else '0'
+    return response
+
+
+@retry_on_locked
+@transaction.atomic
+def _import_customer_rows(rows, user):
+    """在单个事务中导入Excel数据行，SQLite被锁定时整体重试"""
+    imported_count = 0
+    rows = [row for row in rows if row[0] and row[1]]  # 姓名和电话必填
+    
+    # 整批规范化电话，一次查出已存在的客户
+    phone_keys = normalize_phones(row[1] for row in rows)
+    existing = existing_customers(phone_keys)
+    # 已归档客户的号码跳过，避免归档客户恢复时号码冲突
+    archived = archived_phone_keys(phone_keys)
+    
+    for row, phone_key in zip(rows, phone_keys):
+        if not phone_key or phone_key in archived:
+            continue
+        
+        # 创建或更新客户（规范化后相同的号码视为同一客户）
+        customer = existing.get(phone_key)
+        if customer is None:
+            customer = existing[phone_key] = Customer(
+                name=row[0],
+                # Excel 中的数字号码直接保存规范化后的号码
+                phone=row[1].strip() if isinstance(row[1], str) else phone_key,
+                source=(row[4] if len(row) > 4 else '') or '',
+                city_auto=(row[5] if len(row) > 5 else '') or '',
+                region_manual=(row[6] if len(row) > 6 else '') or '',
+            )
+        
+        # 分配负责人
+        if user.is_superuser:
+            customer.sales_rep = None  # 管理员导入到公海
+        else:
+            customer.sales_rep = user  # 员工导入到私海
+        
+        # 按电话号段补全省份和城市
+        fill_locations([customer])
+        customer.save()
+        imported_count += 1
+    
+    return imported_count
+
+
 @admin_required
 def import_customers_api(request):
     """导入客户数据API - 管理员导入到公海,员工导入到私海"""
+    from openpyxl import load_workbook
+    
     if request.method == 'POST':
         form = ImportForm(request.POST, request.FILES)
         if form.is_valid():
@@ -666,30 +1136,7 @@ def import_customers_api(request):
                 # 跳过表头
                 rows = list(ws.iter_rows(min_row=2, values_only=True))
                 
-                imported_count = 0
-                for row in rows:
-                    if not row[0] or not row[1]:  # 姓名和电话必填
-                        continue
-                    
-                    # 创建或更新客户
-                    customer, created = Customer.objects.get_or_create(
-                        phone=row[1],
-                        defaults={
-                            'name': row[0],
-                            'source': row[4] if len(row) > 4 else '',
-                            'city_auto': row[5] if len(row) > 5 else '',
-                            'region_manual': row[6] if len(row) > 6 else '',
-                        }
-                    )
-                    
-                    # 分配负责人
-                    if request.user.is_superuser:
-                        customer.sales_rep = None  # 管理员导入到公海
-                    else:
-                        customer.sales_rep = request.user  # 员工导入到私海
-                    
-                    customer.save()
-                    imported_count += 1
+                imported_count = _import_customer_rows(rows, request.user)
                 
                 messages.success(request, f'成功导入 {imported_count} 条客户数据')
                 
@@ -701,8 +1148,48 @@ def import_customers_api(request):
     return redirect('settings')
 
 
+# 备份文件每次读取、发送的字节数
+BACKUP_CHUNK_SIZE = 1024 * 1024
+
+
+def open_backup_snapshot():
+    """在临时目录生成一份备份并打开，返回 (文件对象, 文件名)；目录随即删除，文件关闭后释放空间"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = create_backup(directory)
+        return open(path, 'rb'), os.path.basename(path)
+
+
+async def stream_backup(backup_file):
+    """逐块读取备份文件（ASGI 部署；Django 4.2 在 ASGI 下会把 FileResponse 整个读入内存）"""
+    try:
+        while True:
+            chunk = await sync_to_async(backup_file.read)(BACKUP_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        backup_file.close()
+
+
 @admin_required
-def backup_data_api(request):
-    """数据备份API - 仅管理员"""
-    # 导出所有客户数据
-    return export_customers_api(request)
+async def backup_data_api(request):
+    """
+    数据备份API - 仅管理员
+    
+    下载压缩后的数据库在线快照（SQLite 在线备份接口 / PostgreSQL pg_dump，见 backup.py），
+    包含用户、自定义字段、扩展数据等全部数据，可用 restore_database 命令恢复。
+    """
+    try:
+        backup_file, filename = await sync_to_async(open_backup_snapshot)()
+    except (OSError, RuntimeError, sqlite3.Error) as e:
+        return JsonResponse({'error': f'备份失败: {e}'}, status=500)
+    
+    if not served_over_asgi(request):
+        # WSGI 部署下由 FileResponse 逐块发送（服务器支持时使用 wsgi.file_wrapper）
+        return FileResponse(backup_file, as_attachment=True, filename=filename,
+                            content_type='application/octet-stream')
+    
+    response = StreamingHttpResponse(stream_backup(backup_file), content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Content-Length'] = os.fstat(backup_file.fileno()).st_size
+    return response
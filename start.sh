@@ -1 +1,10 @@
-gunicorn --bind 0.0.0.0:3000 monsterabc_crm.wsgi:application
\ No newline at end of file
+# 生产配置需要设置 CRM_SECRET_KEY 和 CRM_ALLOWED_HOSTS（见 deployment_guide.md 2.3）
+export DJANGO_SETTINGS_MODULE=${DJANGO_SETTINGS_MODULE:-monsterabc_crm.settings_production}
+# CRM_SERVER=asgi 时用 uvicorn worker 运行 ASGI 应用（需 pip install uvicorn-worker），
+# 提醒轮询、任务进度和CSV导出等异步接口不再占用整个 worker
+if [ "${CRM_SERVER:-wsgi}" = "asgi" ]; then
+    export CRM_SERVER
+    gunicorn --bind 0.0.0.0:3000 -k uvicorn_worker.UvicornWorker monsterabc_crm.asgi:application
+else
+    gunicorn --bind 0.0.0.0:3000 monsterabc_crm.wsgi:application
+fi